@@ -0,0 +1,155 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from pydantic import ConfigDict, PrivateAttr
+
+import metrics
+from numpy_vector_store import NumpyVectorStore
+from query_expansion import expand_query
+
+logger = logging.getLogger(__name__)
+
+
+def cosine_score_fn(vectorstore: VectorStore) -> Optional[Callable[[float], float]]:
+    """
+    Hàm đổi điểm thô của similarity_search_with_score sang cosine similarity, để cùng một ngưỡng có cùng ý nghĩa
+    trên mọi backend (embedding đã chuẩn hóa L2). None nếu không biết thang điểm của backend.
+    - NumpyVectorStore: điểm thô đã là cosine similarity
+    - Chroma: "l2" (mặc định) trả về bình phương khoảng cách L2 = 2 - 2cos; "cosine"/"ip" trả về 1 - cos
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        return lambda score: score
+    collection = getattr(vectorstore, "_collection", None)
+    if collection is not None:
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "l2":
+            return lambda distance: 1.0 - distance / 2.0
+        if space in ("cosine", "ip"):
+            return lambda distance: 1.0 - distance
+    return None
+
+
+class AdaptiveRetriever(BaseRetriever):
+    """
+    Chạy vector search trước, chỉ mở rộng truy vấn khi kết quả không đủ tin cậy:
+    cosine similarity cao nhất dưới `min_top_score` hoặc khoảng cách giữa kết quả đầu và kết quả thứ k
+    dưới `min_score_margin` (điểm được quy về cosine similarity cho mọi backend, xem cosine_score_fn). Mở rộng bằng bảng từ đồng nghĩa cục bộ ("local") hoặc
+    bằng MultiQueryRetriever ("llm"). Đếm số lượt gọi LLM viết lại truy vấn đã tránh được.
+    """
+    vectorstore: VectorStore
+    k: int = 3
+    min_top_score: float = 0.65
+    min_score_margin: float = 0.015
+    expansion: str = "local"
+    llm_retriever: Optional[BaseRetriever] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _score_fn: Optional[Callable[[float], float]] = PrivateAttr(default=None)
+    _score_fn_resolved: bool = PrivateAttr(default=False)
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {
+        'queries': 0, 'confident': 0, 'local_expansions': 0, 'llm_rewrites': 0, 'llm_rewrites_avoided': 0,
+    })
+
+    def _cosine_fn(self) -> Optional[Callable[[float], float]]:
+        if not self._score_fn_resolved:
+            self._score_fn = cosine_score_fn(self.vectorstore)
+            self._score_fn_resolved = True
+            if self._score_fn is None:
+                logger.warning(f" Không rõ thang điểm của {type(self.vectorstore).__name__}, dùng relevance score "
+                               f"của vector store cho ngưỡng adaptive retrieval")
+        return self._score_fn
+
+    def _search(self, query: str) -> List[Tuple[Document, float]]:
+        fn = self._cosine_fn()
+        if fn is None:
+            return self.vectorstore.similarity_search_with_relevance_scores(query, k=self.k)
+        return [(doc, fn(score)) for doc, score in self.vectorstore.similarity_search_with_score(query, k=self.k)]
+
+    async def _asearch(self, query: str) -> List[Tuple[Document, float]]:
+        fn = self._cosine_fn()
+        if fn is None:
+            return await self.vectorstore.asimilarity_search_with_relevance_scores(query, k=self.k)
+        scored = await self.vectorstore.asimilarity_search_with_score(query, k=self.k)
+        return [(doc, fn(score)) for doc, score in scored]
+
+    def _count(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._stats[key] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _is_confident(self, scored: List[Tuple[Document, float]]) -> bool:
+        if not scored:
+            return False
+        top_score = scored[0][1]
+        margin = top_score - scored[-1][1]
+        confident = top_score >= self.min_top_score and (len(scored) < 2 or margin >= self.min_score_margin)
+        logger.info(f" Adaptive retrieval: top={top_score:.3f}, margin={margin:.3f} -> "
+                    f"{'đủ tin cậy' if confident else 'cần mở rộng truy vấn'}")
+        return confident
+
+    def _merge(self, scored_lists: List[List[Tuple[Document, float]]]) -> List[Document]:
+        best: Dict[str, Tuple[Document, float]] = {}
+        for scored in scored_lists:
+            for doc, score in scored:
+                if doc.page_content not in best or score > best[doc.page_content][1]:
+                    best[doc.page_content] = (doc, score)
+        ranked = sorted(best.values(), key=lambda item: item[1], reverse=True)
+        return [doc for doc, _ in ranked[:self.k]]
+
+    @staticmethod
+    def _union(first: List[Document], second: List[Document]) -> List[Document]:
+        seen = {doc.page_content for doc in first}
+        return first + [doc for doc in second if doc.page_content not in seen]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self._count('queries')
+        with metrics.span("vector_store.search"):
+            scored = self._search(query)
+        docs = [doc for doc, _ in scored]
+        if self._is_confident(scored):
+            self._count('confident', 'llm_rewrites_avoided')
+            return docs
+
+        if self.expansion == "llm" and self.llm_retriever is not None:
+            self._count('llm_rewrites')
+            rewritten = self.llm_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            return self._union(docs, rewritten)
+
+        variants = expand_query(query)
+        self._count('local_expansions', 'llm_rewrites_avoided')
+        with metrics.span("vector_store.search"):
+            scored_lists = [scored] + [self._search(v) for v in variants]
+        return self._merge(scored_lists)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        self._count('queries')
+        with metrics.span("vector_store.search"):
+            scored = await self._asearch(query)
+        docs = [doc for doc, _ in scored]
+        if self._is_confident(scored):
+            self._count('confident', 'llm_rewrites_avoided')
+            return docs
+
+        if self.expansion == "llm" and self.llm_retriever is not None:
+            self._count('llm_rewrites')
+            rewritten = await self.llm_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+            return self._union(docs, rewritten)
+
+        variants = expand_query(query)
+        self._count('local_expansions', 'llm_rewrites_avoided')
+        scored_lists = [scored]
+        with metrics.span("vector_store.search"):
+            for variant in variants:
+                scored_lists.append(await self._asearch(variant))
+        return self._merge(scored_lists)
@@ -0,0 +1,173 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Điều/Khoản/Điểm/Chương được nêu trong câu hỏi: hai câu hỏi chỉ khác số Điều có embedding gần như trùng nhau
+REFERENCE_PATTERN = re.compile(r'\b(điều|khoản|điểm|chương|mục)\s+([0-9]+|[ivxlcdm]+\b|[a-zđ]\b)', re.IGNORECASE)
+
+
+def legal_references(question: str) -> Tuple[Tuple[str, str], ...]:
+    """Các tham chiếu cấu trúc trong câu hỏi, ví dụ (("khoản", "2"), ("điều", "5")), đã chuẩn hóa và sắp xếp"""
+    return tuple(sorted({(kind.lower(), value.lower()) for kind, value in REFERENCE_PATTERN.findall(question)}))
+
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời theo ngữ nghĩa: câu hỏi mới có cosine similarity với một câu hỏi
+    đã lưu vượt ngưỡng sẽ dùng lại câu trả lời (kèm trích dẫn) thay vì chạy lại RAG.
+    Hai câu hỏi chỉ khớp khi nêu đúng cùng các Điều/Khoản/Điểm/Chương (legal_references).
+    Giới hạn kích thước theo LRU, hết hạn theo TTL và tự xóa khi knowledge base được build lại.
+    """
+    def __init__(self, embedding_function, similarity_threshold: float = 0.92, max_size: int = 256,
+                 ttl_seconds: float = 3600, version_provider: Optional[Callable[[], str]] = None):
+        self.embedding_function = embedding_function
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self.version_provider = version_provider
+
+        self._lock = threading.Lock()
+        self._vectors = None  # ma trận (max_size, dim), tạo khi có embedding đầu tiên
+        self._valid = np.zeros(self.max_size, dtype=bool)
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()  # slot -> entry, theo thứ tự LRU
+        self._free_slots = list(range(self.max_size - 1, -1, -1))
+        self._pending: "OrderedDict[str, np.ndarray]" = OrderedDict()  # embedding của các câu hỏi vừa tra cứu
+        self._kb_version = version_provider() if version_provider else ""
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        with self._lock:
+            vector = self._pending.pop(question, None)
+        if vector is None:
+            vector = np.asarray(self.embedding_function.embed_query(question), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+        return vector
+
+    def _remember_pending(self, question: str, vector: np.ndarray):
+        self._pending[question] = vector
+        while len(self._pending) > 64:
+            self._pending.popitem(last=False)
+
+    def _check_version(self):
+        """Xóa toàn bộ cache nếu knowledge base đã được build lại. Gọi khi đang giữ lock."""
+        if not self.version_provider:
+            return
+        current = self.version_provider()
+        if current != self._kb_version:
+            if self._entries:
+                logger.info(" Knowledge base đã thay đổi. Xóa semantic cache.")
+            self._clear_locked()
+            self._kb_version = current
+            self.invalidations += 1
+
+    def _evict_slot(self, slot: int):
+        self._entries.pop(slot, None)
+        self._valid[slot] = False
+        self._free_slots.append(slot)
+
+    def _evict_expired(self, now: float):
+        """Xóa các entry đã quá TTL. Gọi khi đang giữ lock."""
+        for slot in [s for s, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]:
+            self._evict_slot(slot)
+            self.evictions += 1
+
+    def _clear_locked(self):
+        self._entries.clear()
+        self._pending.clear()
+        self._valid[:] = False
+        self._free_slots = list(range(self.max_size - 1, -1, -1))
+
+    def _best_match(self, vector: np.ndarray, references: Tuple[Tuple[str, str], ...]) -> Tuple[Optional[int], float]:
+        """Slot có similarity cao nhất trong các entry nêu đúng cùng tham chiếu cấu trúc. Gọi khi đang giữ lock."""
+        if self._vectors is None or not self._entries:
+            return None, -np.inf
+        scores = self._vectors @ vector
+        candidates = np.zeros(self.max_size, dtype=bool)
+        for slot, entry in self._entries.items():
+            candidates[slot] = entry["references"] == references
+        scores[~(self._valid & candidates)] = -np.inf
+        slot = int(np.argmax(scores))
+        score = float(scores[slot])
+        return (slot, score) if np.isfinite(score) else (None, score)
+
+    def get(self, question: str) -> Optional[str]:
+        """Trả về câu trả lời đã lưu cho câu hỏi tương tự, hoặc None nếu không có"""
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            # Bỏ các entry hết hạn trước khi so khớp để không che mất một entry còn hạn có điểm thấp hơn
+            self._evict_expired(time.monotonic())
+            slot, score = self._best_match(vector, legal_references(question))
+            if slot is not None and score >= self.similarity_threshold:
+                entry = self._entries[slot]
+                self._entries.move_to_end(slot)
+                self.hits += 1
+                logger.info(f" Semantic cache hit (similarity={score:.3f}): '{entry['question']}'")
+                return entry["answer"]
+
+            self.misses += 1
+            self._remember_pending(question, vector)
+            return None
+
+    def put(self, question: str, answer: str):
+        """
+        Lưu câu trả lời cho câu hỏi. Nếu đã có entry cho chính câu hỏi này hoặc một câu hỏi khớp (vượt ngưỡng,
+        cùng tham chiếu) thì cập nhật tại chỗ thay vì chiếm thêm slot và đẩy các entry khác ra khỏi LRU.
+        """
+        vector = self._embed(question)
+        references = legal_references(question)
+        with self._lock:
+            self._check_version()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            now = time.monotonic()
+            self._evict_expired(now)
+            slot = next((s for s, e in self._entries.items() if e["question"] == question), None)
+            if slot is None:
+                match, score = self._best_match(vector, references)
+                if match is not None and score >= self.similarity_threshold:
+                    slot = match
+            if slot is not None:
+                self._entries.move_to_end(slot)
+            else:
+                if not self._free_slots:
+                    lru_slot = next(iter(self._entries))
+                    self._evict_slot(lru_slot)
+                    self.evictions += 1
+                slot = self._free_slots.pop()
+
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._entries[slot] = {"question": question, "answer": answer, "created_at": now,
+                                   "references": references}
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
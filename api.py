@@ -0,0 +1,139 @@
+# api.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from config import API_HOST, API_PORT, API_BATCH_MAX_QUESTIONS, API_BATCH_CONCURRENCY
+from llm_scheduler import llm_priority
+from rag_system import RAGSystem
+import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+rag_system = RAGSystem()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Khởi tạo hệ thống ở thread nền: server nhận request ngay, /ready trả 503 cho tới khi tải xong
+    logger.info("Bắt đầu khởi tạo hệ thống RAG cho HTTP API...")
+    rag_system.load_in_background()
+    yield
+
+
+app = FastAPI(title="Trợ Lý AI Pháp Lý API", lifespan=lifespan)
+
+
+class AskRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+
+
+class AskResponse(BaseModel):
+    question: str
+    answer: str
+    elapsed_seconds: float
+
+
+class BatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=API_BATCH_MAX_QUESTIONS)
+
+
+class BatchResponse(BaseModel):
+    results: List[AskResponse]
+    elapsed_seconds: float
+
+
+def _require_agent():
+    if not rag_system.ready:
+        raise HTTPException(status_code=503, detail=f"Hệ thống chưa sẵn sàng: {rag_system.error or 'đang khởi tạo'}")
+    # Mỗi request có lịch sử hội thoại riêng, các thành phần nặng được dùng chung
+    return rag_system.legal_agent.new_session()
+
+
+async def _answer(question: str) -> AskResponse:
+    session_agent = _require_agent()
+    start_time = time.time()
+    answer = "".join([chunk async for chunk in session_agent.astream_ask(question)])
+    return AskResponse(question=question, answer=answer, elapsed_seconds=round(time.time() - start_time, 3))
+
+
+@app.get("/health")
+async def health():
+    """Liveness: tiến trình đang chạy, kèm trạng thái từng thành phần"""
+    return {"status": "ok", "components": rag_system.status()}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: chỉ trả 200 khi vector store, LLM và Agent đã được khởi tạo"""
+    body = {"ready": rag_system.ready, "components": rag_system.status()}
+    if not rag_system.ready:
+        body["error"] = rag_system.error
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+@app.get("/metrics")
+async def metrics_prometheus():
+    """Số liệu theo định dạng văn bản Prometheus (counter và summary với quantile p50/p95/p99)"""
+    return PlainTextResponse(metrics.registry.to_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/metrics/json")
+async def metrics_json():
+    """Số liệu dạng JSON: span theo giai đoạn, lượt gọi LLM và token, cache hit, thống kê các thành phần"""
+    return rag_system.metrics_snapshot()
+
+
+@app.post("/ask", response_model=AskResponse)
+async def ask(request: AskRequest):
+    return await _answer(request.question)
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: AskRequest):
+    """Trả về câu trả lời dạng text/plain theo từng token ngay khi được sinh ra"""
+    session_agent = _require_agent()
+    return StreamingResponse(session_agent.astream_ask(request.question), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/ask/batch", response_model=BatchResponse)
+async def ask_batch(request: BatchRequest):
+    """
+    Trả lời nhiều câu hỏi trong một request: các câu hỏi trùng lặp chỉ được xử lý một lần,
+    embedding của mọi truy vấn được tính trong một lần gọi model, các lượt gọi LLM chạy song song
+    tối đa API_BATCH_CONCURRENCY câu hỏi. Các lượt gọi LLM của batch chạy ở làn ưu tiên "batch",
+    nhường quota cho các câu hỏi tương tác (/ask, /ask/stream).
+    """
+    _require_agent()
+    start_time = time.time()
+    unique_questions = list(dict.fromkeys(request.questions))
+    await asyncio.to_thread(rag_system.prime_queries, unique_questions)
+
+    semaphore = asyncio.Semaphore(API_BATCH_CONCURRENCY)
+
+    async def run(question: str) -> AskResponse:
+        async with semaphore:
+            return await _answer(question)
+
+    with llm_priority("batch"):
+        answers = await asyncio.gather(*(run(q) for q in unique_questions))
+    by_question = dict(zip(unique_questions, answers))
+    logger.info(f"Batch {len(request.questions)} câu hỏi ({len(unique_questions)} khác nhau) "
+                f"trong {time.time() - start_time:.2f} giây")
+    return BatchResponse(
+        results=[by_question[q] for q in request.questions],
+        elapsed_seconds=round(time.time() - start_time, 3)
+    )
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
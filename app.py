@@ -1,23 +1,12 @@
 # app.py
+import asyncio
 import gradio as gr
 import logging
 import time
 
 # Import các module đã tạo
-from config import (
-    DATABASE_PATH,
-    COLLECTION_NAME,
-    EMBEDDING_MODEL_NAME,
-    GROQ_API_KEY,
-    LLM_MODEL_NAME
-)
-from vector_store_loader import VectorStoreLoader
-from llm_connector import LLMConnector
-from legal_agent import SimpleLegalAgent
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
+from config import APP_CONCURRENCY_LIMIT
+from rag_system import RAGSystem
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,109 +14,63 @@ logger = logging.getLogger(__name__)
 
 
 # --- 1. Khởi tạo toàn bộ hệ thống RAG và Agent ---
+# Hệ thống được tải ở thread nền (các thành phần song song) nên import app.py và dựng giao diện không bị chặn;
+# request đầu tiên sẽ chờ đến khi hệ thống sẵn sàng.
+rag_system = RAGSystem()
+
+
 def initialize_system():
-    """Khởi tạo và trả về các đối tượng cần thiết cho RAG."""
+    """Bắt đầu khởi tạo các thành phần RAG ở thread nền."""
     print("🤖" + "=" * 60)
-    print("        KHỞI TẠO HỆ THỐNG RAG CHO GIAO DIỆN WEB")
+    print("        KHỞI TẠO HỆ THỐNG RAG CHO GIAO DIỆN WEB")
     print("=" * 65)
-
-    # Tải lại VD
-    vector_store_loader = VectorStoreLoader(
-        db_directory=DATABASE_PATH,
-        collection_name=COLLECTION_NAME,
-        embedding_model_name=EMBEDDING_MODEL_NAME
-    )
-    vectordb = vector_store_loader.load()
-    if not vectordb:
-        raise Exception("Không thể tải Vector Database.")
-
-    # Khởi tạo và kết nối LLM
-    llm_connector = LLMConnector(
-        groq_api_key=GROQ_API_KEY,
-        model_name=LLM_MODEL_NAME
-    )
-    llm = llm_connector.connect()
-    if not llm:
-        raise Exception("Không thể kết nối LLM.")
-
-    # --- Xây Dựng Lõi RAG (Retriever & Chain) ---
-    base_retriever = vectordb.as_retriever(search_kwargs={"k": 3})
-    retriever = MultiQueryRetriever.from_llm(
-        retriever=base_retriever,
-        llm=llm
-    )
-
-    PROMPT_TEMPLATE = """
-    Bạn là một trợ lý AI pháp lý, chuyên trả lời các câu hỏi dựa trên nội dung của văn bản Luật được cung cấp.
-    Nhiệm vụ của bạn là trả lời câu hỏi của người dùng một cách chính xác và chỉ dựa vào thông tin có trong phần "NGỮ CẢNH" dưới đây.
-
-    **NGỮ CẢNH:**
-    {context}
-
-    **DỰA VÀO NGỮ CẢNH TRÊN, HÃY TRẢ LỜI CÂU HỎI SAU:**
-    **Câu hỏi:** {question}
-
-    **QUY TẮC TRẢ LỜI:**
-    - Trả lời thẳng vào vấn đề, không thêm lời chào hay các câu nói không liên quan.
-    - Nếu câu trả lời có trong ngữ cảnh, hãy trích dẫn lại thông tin một cách ngắn gọn.
-    - **Nếu câu trả lời không thể được tìm thấy trong ngữ cảnh, hãy trả lời chính xác là: "Tôi không tìm thấy thông tin về điều này trong tài liệu được cung cấp."**
-    - Không được suy diễn, phỏng đoán hay sử dụng kiến thức bên ngoài ngữ cảnh.
-    - Luôn trả lời bằng tiếng Việt.
-    """
-    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
-
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    rag_chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-    )
-
-    # Khởi tạo Agent
-    legal_agent = SimpleLegalAgent(
-        retriever=retriever,
-        llm=llm,
-        rag_chain=rag_chain
-    )
-
-    logger.info("Tất cả thành phần đã sẵn sàng!")
-    return legal_agent
+    rag_system.load_in_background()
 
 
-# --- Khởi tạo hệ thống một lần khi app được load ---
-try:
-    legal_agent = initialize_system()
-except Exception as e:
-    legal_agent = None
-    logger.error(f"Lỗi khi khởi tạo hệ thống: {e}")
+async def get_legal_agent():
+    """Trả về Agent dùng chung sau khi hệ thống khởi tạo xong, None nếu khởi tạo thất bại"""
+    rag_system.load_in_background()
+    if not await asyncio.to_thread(rag_system.wait_until_loaded):
+        logger.error(f"Lỗi khi khởi tạo hệ thống: {rag_system.error}")
+        return None
+    return rag_system.legal_agent
 
 
 # --- 2. Định nghĩa hàm xử lý cho Gradio ---
-def chat_with_agent(question, history):
-    if not legal_agent:
-        return "Hệ thống đang gặp lỗi. Vui lòng thử lại sau.", history
+async def chat_with_agent(question, history, session_agent):
+    """
+    Mỗi phiên trình duyệt có một Agent riêng (lưu trong gr.State) chỉ giữ lịch sử hội thoại;
+    retriever, vector store, LLM client và cache được dùng chung giữa các phiên.
+    """
+    if session_agent is None:
+        legal_agent = await get_legal_agent()
+        if not legal_agent:
+            yield "Hệ thống đang gặp lỗi. Vui lòng thử lại sau.", history, session_agent
+            return
+        session_agent = legal_agent.new_session()
 
     start_time = time.time()
+    first_token_time = None
+    answer = ""
+    history.append((question, answer))
     try:
-        
-        answer = legal_agent.ask(question)
+        # Cập nhật khung chat ngay khi có thêm token/phần trả lời mới
+        async for chunk in session_agent.astream_ask(question):
+            if first_token_time is None and chunk:
+                first_token_time = time.time()
+            answer += chunk
+            history[-1] = (question, answer)
+            yield "", history, session_agent
         end_time = time.time()
 
-        # In kết quả 
-        logger.info(f"Thời gian xử lý: {end_time - start_time:.2f} giây")
-
-        # Cập nhật lịch sử chat
-        history.append((question, answer))
-        return "", history
+        ttft = (first_token_time or end_time) - start_time
+        logger.info(f"Thời gian xử lý: {end_time - start_time:.2f} giây (time-to-first-token: {ttft:.2f} giây)")
 
     except Exception as e:
         logger.error(f"Lỗi khi xử lý câu hỏi từ người dùng: {e}")
         error_message = f"Có lỗi xảy ra trong quá trình xử lý: {e}"
-        history.append((question, error_message))
-        return "", history
+        history[-1] = (question, error_message)
+        yield "", history, session_agent
 
 
 # --- 3. Tạo giao diện Gradio ---
@@ -142,6 +85,7 @@ with gr.Blocks(title="Trợ Lý AI Pháp Lý (RAG + Agent)") as demo:
 
    
     chatbot = gr.Chatbot(height=500)
+    session_agent = gr.State(None)
 
     
     msg = gr.Textbox(
@@ -151,22 +95,20 @@ with gr.Blocks(title="Trợ Lý AI Pháp Lý (RAG + Agent)") as demo:
 
     
     with gr.Row():
-        clear_btn = gr.ClearButton([msg, chatbot], value="Xóa")
+        clear_btn = gr.ClearButton([msg, chatbot, session_agent], value="Xóa")
         submit_btn = gr.Button("Gửi", variant="primary")
 
     
     submit_btn.click(
         chat_with_agent,
-        inputs=[msg, chatbot],
-        outputs=[msg, chatbot],
-        queue=False
+        inputs=[msg, chatbot, session_agent],
+        outputs=[msg, chatbot, session_agent]
     )
 
     msg.submit(
         chat_with_agent,
-        inputs=[msg, chatbot],
-        outputs=[msg, chatbot],
-        queue=False
+        inputs=[msg, chatbot, session_agent],
+        outputs=[msg, chatbot, session_agent]
     )
 
     gr.Examples(
@@ -179,4 +121,7 @@ with gr.Blocks(title="Trợ Lý AI Pháp Lý (RAG + Agent)") as demo:
     )
 
 if __name__ == "__main__":
+    initialize_system()
+    # Streaming (generator) cần bật hàng đợi của Gradio; các handler async chạy đồng thời tới giới hạn cấu hình
+    demo.queue(default_concurrency_limit=APP_CONCURRENCY_LIMIT)
     demo.launch(share=True)  
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+ARTICLE_INDEX_DIR = "article_index"
+# Metadata chỉ có ý nghĩa với chunk con cấp Khoản, không chuyển sang Điều cha
+CHILD_METADATA_KEYS = ("clause", "part")
+
+
+def article_index_path(db_path: str, collection_name: str) -> Path:
+    return Path(db_path) / ARTICLE_INDEX_DIR / f"{collection_name}.json"
+
+
+def child_body(content: str, heading: str) -> str:
+    """Nội dung chunk con sau khi bỏ dòng tiêu đề Điều được lặp lại ở đầu mỗi chunk con"""
+    prefix = f"{heading}\n"
+    return content[len(prefix):] if heading and content.startswith(prefix) else content
+
+
+def _fold(text: str) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt ("Nghị định" -> "nghi dinh") để so khớp với tên file không dấu"""
+    text = unicodedata.normalize('NFD', text.lower().replace('đ', 'd'))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def source_mentioned(source_file: str, question: str) -> bool:
+    """Câu hỏi có nêu tên file nguồn không (tên file hoặc tên không phần mở rộng, "_"/"-" coi như khoảng trắng)"""
+    question = _fold(question)
+    name = _fold(Path(source_file).name)
+    stem = _fold(Path(source_file).stem)
+    return any(candidate and candidate in question
+               for candidate in (name, stem, stem.replace("_", " ").replace("-", " ")))
+
+
+class ArticleIndex:
+    """
+    Chỉ mục cấu trúc của văn bản luật: (file nguồn, số Điều) -> các chunk của Điều đó (theo thứ tự),
+    (file nguồn, Chương) -> các Điều. Cho phép lấy trực tiếp nội dung một Điều mà không cần vector search.
+    Số Điều chỉ xác định một Điều trong phạm vi một văn bản: khi nhiều file cùng có "Điều 12", cần chỉ rõ
+    file nguồn (resolve_source) thay vì trộn nội dung của các văn bản.
+    Với chunk con cấp Khoản (metadata "parent_id"), Điều cha được ghép lại từ các chunk con theo thứ tự.
+    """
+    def __init__(self):
+        self.articles: Dict[Tuple[str, int], List[str]] = {}
+        self.chapters: Dict[Tuple[str, str], List[int]] = {}
+        self.sources: Dict[int, List[str]] = {}
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self.parents: Dict[str, List[str]] = {}
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> "ArticleIndex":
+        index = cls()
+        ordered = []
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            metadata = metadata or {}
+            article = int(metadata.get('article') or 0)
+            if article <= 0:
+                continue
+            index.chunks[doc_id] = {'content': document, 'metadata': metadata}
+            ordered.append((metadata.get('source_file', ''), article, int(metadata.get('part', 0)), doc_id))
+
+        for source, article, _, doc_id in sorted(ordered):
+            index.articles.setdefault((source, article), []).append(doc_id)
+            article_sources = index.sources.setdefault(article, [])
+            if source not in article_sources:
+                article_sources.append(source)
+            chapter = index.chunks[doc_id]['metadata'].get('chapter', '')
+            if chapter:
+                chapter_articles = index.chapters.setdefault((source, chapter), [])
+                if article not in chapter_articles:
+                    chapter_articles.append(article)
+        index._link_parents()
+        logger.info(f" Đã build article index: {len(index.articles)} Điều, {len(index.chapters)} Chương, "
+                    f"{len(index.parents)} Điều chia theo Khoản")
+        return index
+
+    def _link_parents(self):
+        self.parents = {}
+        for doc_ids in self.articles.values():
+            for doc_id in doc_ids:
+                parent_id = self.chunks[doc_id]['metadata'].get('parent_id')
+                if parent_id:
+                    self.parents.setdefault(parent_id, []).append(doc_id)
+
+    def __len__(self) -> int:
+        return len(self.articles)
+
+    def __contains__(self, article: int) -> bool:
+        """Có ít nhất một văn bản chứa Điều này"""
+        return article in self.sources
+
+    def resolve_source(self, articles: Iterable[int], question: str = "") -> Optional[str]:
+        """
+        File nguồn duy nhất chứa tất cả các Điều được hỏi: văn bản duy nhất có đủ các Điều đó, hoặc văn bản
+        được nêu tên trong câu hỏi. Trả về None nếu không xác định được (mơ hồ giữa nhiều văn bản).
+        """
+        articles = list(articles)
+        if not articles:
+            return None
+        candidates = [source for source in self.sources.get(articles[0], [])
+                      if all((source, article) in self.articles for article in articles[1:])]
+        if len(candidates) == 1:
+            return candidates[0]
+        named = [source for source in candidates if source_mentioned(source, question)]
+        return named[0] if len(named) == 1 else None
+
+    def get_chunk_ids(self, article: int, source: str) -> List[str]:
+        return list(self.articles.get((source, article), []))
+
+    def get_articles_in_chapter(self, chapter: str, source: str) -> List[int]:
+        return list(self.chapters.get((source, chapter), []))
+
+    def get_parent(self, parent_id: str) -> Optional[Document]:
+        """Ghép lại toàn bộ Điều cha từ các chunk con cấp Khoản của nó"""
+        child_ids = self.parents.get(parent_id)
+        if not child_ids:
+            return None
+        metadata = self.chunks[child_ids[0]]['metadata']
+        heading = metadata.get('heading', '')
+        bodies = [child_body(self.chunks[doc_id]['content'], heading) for doc_id in child_ids]
+        content = "\n".join(([heading] if heading else []) + bodies)
+        parent_metadata = {key: value for key, value in metadata.items() if key not in CHILD_METADATA_KEYS}
+        return Document(page_content=content, metadata=parent_metadata, id=parent_id)
+
+    def get_documents(self, articles: List[int], source: str) -> List[Document]:
+        """
+        Lấy toàn bộ nội dung các Điều được yêu cầu của văn bản `source`, theo đúng thứ tự
+        (chunk con được ghép lại thành Điều cha)
+        """
+        documents = []
+        added_parents = set()
+        for article in articles:
+            for doc_id in self.articles.get((source, article), []):
+                chunk = self.chunks[doc_id]
+                parent_id = chunk['metadata'].get('parent_id')
+                if parent_id in self.parents:
+                    if parent_id not in added_parents:
+                        added_parents.add(parent_id)
+                        documents.append(self.get_parent(parent_id))
+                    continue
+                documents.append(Document(page_content=chunk['content'], metadata=dict(chunk['metadata']), id=doc_id))
+        return documents
+
+    def save(self, path: str):
+        """Chỉ lưu các chunk; các bảng tra cứu được dựng lại khi load"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'chunks': self.chunks}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        logger.info(f" Đã lưu article index vào '{path}'")
+
+    @classmethod
+    def load(cls, path: str) -> "ArticleIndex":
+        with open(path, 'r', encoding='utf-8') as f:
+            chunks = json.load(f)['chunks']
+        return cls.build(list(chunks), [chunk['content'] for chunk in chunks.values()],
+                         [chunk['metadata'] for chunk in chunks.values()])
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Set
+
+from config import BATCH_QA_CONCURRENCY
+from llm_scheduler import llm_priority
+from rag_system import RAGSystem
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+logger = logging.getLogger(__name__)
+
+ERROR_MARKERS = ("Lỗi khi tìm kiếm", "Xin lỗi, có lỗi xảy ra")
+
+
+def read_questions(input_path: str, field: str = "question") -> List[str]:
+    """
+    Đọc câu hỏi từ file JSONL (mỗi dòng là object có trường `field` hoặc một chuỗi)
+    hoặc CSV (cột `field`, nếu không có thì lấy cột đầu tiên). Bỏ dòng trống và câu hỏi trùng lặp.
+    """
+    path = Path(input_path)
+    questions = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.suffix.lower() == ".csv":
+            reader = csv.reader(f)
+            header = next(reader, [])
+            column = header.index(field) if field in header else 0
+            if field not in header and header:
+                questions.append(header[column])
+            questions.extend(row[column] for row in reader if len(row) > column)
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if isinstance(record, str):
+                    questions.append(record)
+                elif isinstance(record, dict):
+                    questions.append(record.get(field, ""))
+                else:
+                    logger.warning(f" Bỏ qua dòng không phải object/chuỗi trong '{input_path}': {line[:60]}")
+
+    unique = list(dict.fromkeys(q.strip() for q in questions if q and q.strip()))
+    logger.info(f" Đọc {len(questions)} câu hỏi từ '{input_path}', còn {len(unique)} câu sau khi bỏ trùng lặp")
+    return unique
+
+
+def iter_results(output_path: str) -> Iterator[Dict]:
+    """Các bản ghi hợp lệ trong file kết quả JSONL, theo thứ tự ghi"""
+    path = Path(output_path)
+    if not path.exists():
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Dòng cuối có thể bị ghi dở nếu lần chạy trước bị dừng đột ngột
+                continue
+            if isinstance(record, dict) and "question" in record:
+                yield record
+
+
+def read_answered(output_path: str) -> Set[str]:
+    """Các câu hỏi đã được trả lời thành công trong file kết quả (checkpoint) của lần chạy trước"""
+    return {record["question"] for record in iter_results(output_path) if record.get("status") == "ok"}
+
+
+def compact_results(output_path: str) -> int:
+    """
+    Giữ lại bản ghi cuối cùng của mỗi câu hỏi (câu bị lỗi ở lần chạy trước và được trả lời lại có hai bản ghi),
+    theo thứ tự câu hỏi xuất hiện lần đầu; ghi ra file tạm rồi thay thế để không làm hỏng checkpoint.
+    Trả về số bản ghi đã bỏ.
+    """
+    latest: Dict[str, Dict] = {}
+    total = 0
+    for record in iter_results(output_path):
+        latest[record["question"]] = record
+        total += 1
+    removed = total - len(latest)
+    if removed:
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in latest.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, output_path)
+        logger.info(f" Đã gộp file kết quả: bỏ {removed} bản ghi cũ của các câu hỏi được trả lời lại")
+    return removed
+
+
+def extract_citations(answer: str) -> List[str]:
+    """Lấy danh sách "Điều N" từ các dòng "Nguồn: ..." trong câu trả lời của Agent"""
+    citations = []
+    for line in re.findall(r'Nguồn: (.+)', answer):
+        citations.extend(source.strip() for source in line.split(','))
+    return list(dict.fromkeys(citations))
+
+
+class BatchQuestionAnswerer:
+    """
+    Trả lời hàng loạt câu hỏi: encode mọi truy vấn trong một lần gọi embedding model,
+    chạy truy xuất và sinh câu trả lời đồng thời (tối đa `concurrency` câu hỏi),
+    ghi từng kết quả vào file JSONL ngay khi xong để lần chạy lại bỏ qua các câu đã trả lời.
+    Câu hỏi bị lỗi được trả lời lại ở lần chạy sau; khi chạy xong, file được gộp để mỗi câu hỏi chỉ còn
+    bản ghi mới nhất (nếu bị dừng giữa chừng, bản ghi cuối cùng của mỗi câu hỏi là kết quả hiện hành).
+    """
+    def __init__(self, rag_system: RAGSystem, concurrency: int = 4):
+        self.rag_system = rag_system
+        self.concurrency = max(1, concurrency)
+
+    async def _answer(self, question: str) -> Dict:
+        session_agent = self.rag_system.legal_agent.new_session()
+        start_time = time.time()
+        answer = "".join([chunk async for chunk in session_agent.astream_ask(question)])
+        return {
+            "question": question,
+            "answer": answer,
+            "citations": extract_citations(answer),
+            "status": "error" if any(marker in answer for marker in ERROR_MARKERS) else "ok",
+            "elapsed_seconds": round(time.time() - start_time, 3),
+        }
+
+    async def run(self, questions: List[str], output_path: str) -> Dict[str, int]:
+        answered = read_answered(output_path)
+        pending = [q for q in questions if q not in answered]
+        logger.info(f" {len(answered)} câu hỏi đã có kết quả, cần trả lời {len(pending)} câu")
+        stats = {'total': len(questions), 'skipped': len(questions) - len(pending), 'ok': 0, 'error': 0}
+        if not pending:
+            return stats
+
+        await asyncio.to_thread(self.rag_system.prime_queries, pending)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'a', encoding='utf-8') as output:
+            async def run_one(question: str):
+                async with semaphore:
+                    try:
+                        record = await self._answer(question)
+                    except Exception as e:
+                        record = {"question": question, "answer": "", "citations": [], "status": "error",
+                                  "error": str(e)}
+                # Checkpoint: ghi và flush ngay để không mất kết quả nếu tiến trình bị dừng
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                stats[record["status"]] += 1
+                done = stats['ok'] + stats['error']
+                logger.info(f" [{done}/{len(pending)}] {record['status']}: {question[:60]}")
+
+            # Làn ưu tiên thấp của bộ lập lịch LLM: câu hỏi tương tác (nếu có) được cấp quota trước
+            with llm_priority("batch"):
+                await asyncio.gather(*(run_one(q) for q in pending))
+        compact_results(output_path)
+        return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Trả lời hàng loạt câu hỏi từ file JSONL/CSV, ghi kết quả ra JSONL")
+    parser.add_argument("input", help="File câu hỏi (.jsonl hoặc .csv)")
+    parser.add_argument("output", help="File kết quả .jsonl (chạy lại sẽ bỏ qua các câu đã trả lời và "
+                                           "trả lời lại các câu bị lỗi)")
+    parser.add_argument("--field", default="question", help="Tên trường/cột chứa câu hỏi")
+    parser.add_argument("--concurrency", type=int, default=BATCH_QA_CONCURRENCY,
+                        help="Số câu hỏi được xử lý đồng thời")
+    parser.add_argument("--metrics-out", default=None,
+                        help="Ghi số liệu theo dõi (thời gian từng giai đoạn, lượt gọi LLM, token, cache) ra file JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    questions = read_questions(args.input, field=args.field)
+
+    rag_system = RAGSystem()
+    if not rag_system.load():
+        logger.error(f" Không thể khởi tạo hệ thống: {rag_system.error}")
+        exit(1)
+
+    start_time = time.time()
+    stats = asyncio.run(BatchQuestionAnswerer(rag_system, concurrency=args.concurrency).run(questions, args.output))
+    elapsed = time.time() - start_time
+
+    print("=" * 60)
+    print(f"Tổng số câu hỏi: {stats['total']} (bỏ qua {stats['skipped']} câu đã có kết quả)")
+    print(f"Thành công: {stats['ok']}, lỗi: {stats['error']}")
+    print(f"Thời gian: {elapsed:.2f} giây")
+    print("=" * 60)
+
+    if args.metrics_out:
+        with open(args.metrics_out, 'w', encoding='utf-8') as f:
+            json.dump(rag_system.metrics_snapshot(), f, ensure_ascii=False, indent=2)
+        logger.info(f" Đã ghi số liệu theo dõi vào '{args.metrics_out}'")
@@ -0,0 +1,127 @@
+"""
+So sánh các backend suy luận embedding trên CPU (torch full-precision, ONNX Runtime, int8 lượng tử hóa động)
+trên chính văn bản luật của dự án.
+
+Cách chạy (từ thư mục gốc của dự án):
+    python -m benchmarks.bench_embedding_backends --backends torch onnx int8 --k 3
+
+Với mỗi backend, script đo thời gian tải model, tốc độ encode toàn bộ chunks (chunks/s), độ trễ encode
+một truy vấn (p50/p95), và mức độ khớp kết quả truy xuất so với backend torch: tỉ lệ trùng top-k
+và cosine trung bình giữa vector của hai backend. Các truy vấn là câu hỏi mẫu cộng tiêu đề các Điều.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from config import FULL_FILE_PATH, EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP
+from embedding_generator import EmbeddingGenerator, EMBEDDING_BACKENDS
+from text_processor import TextProcessor
+
+SAMPLE_QUESTIONS = [
+    "Dữ liệu dùng chung là gì?",
+    "Sự khác nhau giữa dữ liệu dùng chung và dữ liệu dùng riêng?",
+    "Cơ sở dữ liệu quốc gia được lưu trữ ở đâu?",
+    "Dữ liệu cá nhân nhạy cảm là gì?",
+    "Các hành vi bị nghiêm cấm trong hoạt động dữ liệu?",
+    "Trách nhiệm của cơ quan nhà nước trong quản lý dữ liệu?",
+    "Luật này có hiệu lực từ khi nào?",
+    "Quy định về chuyển dữ liệu ra nước ngoài?",
+]
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000, q))
+
+
+def load_corpus(file_path: str, chunk_size: int, overlap: int):
+    processor = TextProcessor()
+    text = processor.clean_text(processor.read_file(file_path))
+    chunks = processor.split_into_chunks(text, chunk_size=chunk_size, overlap=overlap)
+    documents = [chunk['content'] for chunk in chunks]
+    titles = [chunk.get('metadata', {}).get('article_title', '') for chunk in chunks]
+    queries = SAMPLE_QUESTIONS + [title for title in dict.fromkeys(titles) if title]
+    return documents, queries
+
+
+def top_k(query_vectors: np.ndarray, doc_vectors: np.ndarray, k: int) -> np.ndarray:
+    scores = query_vectors @ doc_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def measure_backend(backend: str, model_name: str, documents, queries, batch_size: int) -> dict:
+    start = time.perf_counter()
+    generator = EmbeddingGenerator(model_name, backend=backend)
+    load_seconds = time.perf_counter() - start
+
+    generator.encode(documents[:batch_size])  # warm-up
+    start = time.perf_counter()
+    doc_vectors = np.concatenate([
+        generator.encode(documents[i:i + batch_size]) for i in range(0, len(documents), batch_size)
+    ])
+    encode_seconds = time.perf_counter() - start
+
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        t = time.perf_counter()
+        query_vectors.append(generator.encode([query])[0])
+        latencies.append(time.perf_counter() - t)
+
+    return {
+        'backend': generator.backend,
+        'requested_backend': backend,
+        'load_seconds': load_seconds,
+        'chunks_per_second': len(documents) / max(encode_seconds, 1e-9),
+        'query_p50_ms': percentile_ms(latencies, 50),
+        'query_p95_ms': percentile_ms(latencies, 95),
+        'doc_vectors': doc_vectors,
+        'query_vectors': np.asarray(query_vectors, dtype=np.float32),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=FULL_FILE_PATH)
+    parser.add_argument('--model', default=EMBEDDING_MODEL_NAME)
+    parser.add_argument('--backends', nargs='+', default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--json', help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    documents, queries = load_corpus(args.file, CHUNK_SIZE, CHUNK_OVERLAP)
+    print(f"Văn bản '{args.file}': {len(documents)} chunks, {len(queries)} truy vấn, k={args.k}")
+
+    # Backend torch luôn được đo đầu tiên để làm mốc so sánh
+    backends = ['torch'] + [backend for backend in args.backends if backend != 'torch']
+    reports = {}
+    for backend in backends:
+        reports[backend] = measure_backend(backend, args.model, documents, queries, args.batch_size)
+
+    reference = reports['torch']
+    reference_top_k = top_k(reference['query_vectors'], reference['doc_vectors'], args.k)
+    for report in reports.values():
+        report_top_k = top_k(report['query_vectors'], report['doc_vectors'], args.k)
+        overlaps = [len(set(a) & set(b)) / args.k for a, b in zip(reference_top_k, report_top_k)]
+        report['top_k_overlap'] = float(np.mean(overlaps))
+        report['top1_agreement'] = float(np.mean(reference_top_k[:, 0] == report_top_k[:, 0]))
+        report['mean_doc_cosine'] = float(np.mean(np.sum(reference['doc_vectors'] * report['doc_vectors'], axis=1)))
+
+    print(f"{'backend':<12} {'load':>7} {'chunks/s':>9} {'p50':>8} {'p95':>8} {'top-k':>6} {'top-1':>6} {'cosine':>7}")
+    for name, report in reports.items():
+        label = name if report['backend'] == name else f"{name}->{report['backend']}"
+        print(f"{label:<12} {report['load_seconds']:>6.1f}s {report['chunks_per_second']:>9.1f} "
+              f"{report['query_p50_ms']:>6.1f}ms {report['query_p95_ms']:>6.1f}ms {report['top_k_overlap']:>6.2f} "
+              f"{report['top1_agreement']:>6.2f} {report['mean_doc_cosine']:>7.4f}")
+
+    if args.json:
+        summary = {name: {key: value for key, value in report.items() if not key.endswith('_vectors')}
+                   for name, report in reports.items()}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
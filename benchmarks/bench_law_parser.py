@@ -0,0 +1,144 @@
+"""
+Thời gian và bộ nhớ của bước làm sạch + chia chunk theo cấu trúc luật trên corpus lớn:
+cách cũ (clean_text nhiều lượt + re.split + nối chuỗi bằng `+=`) so với parser một lượt (law_parser.py)
+trên chuỗi trong bộ nhớ và khi đọc theo luồng từ file qua memory map.
+
+Cách chạy (từ thư mục gốc của dự án):
+    python -m benchmarks.bench_law_parser --scale 100
+    python -m benchmarks.bench_law_parser --scale 100 --layout long --skip-legacy
+
+Corpus được tạo bằng cách nhân bản data/luatbvdl.txt `--scale` lần:
+- "repeat": mỗi bản sao được đánh lại số Điều, mô phỏng knowledge base gồm nhiều văn bản luật
+- "long": nội dung mỗi Điều được lặp `--scale` lần dưới cùng một tiêu đề (trường hợp xấu của nối chuỗi `+=`)
+Cách cũ cần langchain để chia nhỏ các Điều quá dài.
+"""
+import argparse
+import re
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from config import FULL_FILE_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+from text_processor import TextProcessor
+
+ARTICLE_HEADING = re.compile(r'^Điều\s+(\d+)\.', re.MULTILINE)
+ARTICLE_START = re.compile(r'^(?=Điều\s+\d+\.)', re.MULTILINE)
+
+
+def build_corpus(source_path: str, scale: int, layout: str, output_path: Path) -> int:
+    text = Path(source_path).read_text(encoding='utf-8')
+    with open(output_path, 'w', encoding='utf-8') as output:
+        if layout == "repeat":
+            max_article = max(int(n) for n in ARTICLE_HEADING.findall(text))
+            for copy in range(scale):
+                offset = copy * max_article
+                output.write(ARTICLE_HEADING.sub(lambda m: f"Điều {int(m.group(1)) + offset}.", text) + "\n")
+        else:
+            for piece in ARTICLE_START.split(text):
+                heading, _, body = piece.partition("\n")
+                if not ARTICLE_HEADING.match(heading):
+                    output.write(piece)
+                    continue
+                output.write(heading + "\n" + body.rstrip("\n") * scale + "\n")
+    return output_path.stat().st_size
+
+
+def legacy_clean_text(text: str) -> str:
+    """TextProcessor.clean_text trước khi chuyển sang parser một lượt"""
+    text = re.sub(r'\r\n', '\n', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return '\n'.join(lines)
+
+
+def legacy_split_by_law_article(text: str, max_chars_per_chunk: int) -> List[Dict[str, Any]]:
+    """TextProcessor._split_by_law_article trước khi chuyển sang parser một lượt (bỏ phần tạo ID/metadata)"""
+    raw_parts = re.split(r'(Chương [IVXLCDM\d]+.*?)\n|(Điều \d+\..*?)\n', text)
+    parts = [p.strip() for p in raw_parts if p and p.strip()]
+
+    chunks = []
+    current_heading = ""
+    current_content = ""
+    for part in parts:
+        is_heading = part.startswith("Chương") or part.startswith("Điều")
+        if is_heading and current_content:
+            chunks.append((current_heading + "\n" + current_content).strip())
+            current_heading = part
+            current_content = ""
+        elif is_heading:
+            current_heading = part
+        else:
+            current_content += "\n" + part
+    if current_content:
+        chunks.append((current_heading + "\n" + current_content).strip())
+
+    final_chunks = []
+    for chunk in chunks:
+        if len(chunk) > max_chars_per_chunk:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            splitter = RecursiveCharacterTextSplitter(chunk_size=max_chars_per_chunk,
+                                                      chunk_overlap=int(max_chars_per_chunk * 0.1),
+                                                      separators=["\n\n", "\n", ". ", ", ", " ", ""])
+            final_chunks.extend({"content": c} for c in splitter.split_text(chunk))
+        else:
+            final_chunks.append({"content": chunk})
+    return final_chunks
+
+
+def measure(name: str, run: Callable[[], int], input_bytes: int, memory: bool) -> Dict[str, Any]:
+    start = time.perf_counter()
+    chunks = run()
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return {'name': name, 'seconds': seconds, 'mb_per_second': input_bytes / 1e6 / seconds, 'chunks': chunks,
+            'peak_mb': peak_mb}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=FULL_FILE_PATH)
+    parser.add_argument('--scale', type=int, default=100, help='Số lần nhân bản file nguồn')
+    parser.add_argument('--layout', choices=['repeat', 'long'], default='repeat')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--skip-legacy', action='store_true', help='Bỏ qua cách cũ (chậm, cần langchain)')
+    parser.add_argument('--memory', action='store_true', help='Đo bộ nhớ đỉnh bằng tracemalloc (chạy thêm một lần)')
+    args = parser.parse_args()
+
+    processor = TextProcessor()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_path = Path(tmp_dir) / "corpus.txt"
+        input_bytes = build_corpus(args.file, args.scale, args.layout, corpus_path)
+        print(f"Corpus: {args.scale} x {Path(args.file).name} ({args.layout}) = {input_bytes / 1e6:.1f} MB, "
+              f"chunk_size={args.chunk_size}")
+
+        def legacy() -> int:
+            text = legacy_clean_text(corpus_path.read_text(encoding='utf-8'))
+            return len(legacy_split_by_law_article(text, args.chunk_size))
+
+        def single_pass_text() -> int:
+            text = processor.clean_text(corpus_path.read_text(encoding='utf-8'))
+            return len(processor.split_into_chunks(text, args.chunk_size, CHUNK_OVERLAP))
+
+        def single_pass_stream() -> int:
+            return sum(1 for _ in processor.iter_law_chunks_from_file(str(corpus_path), args.chunk_size))
+
+        runs = [] if args.skip_legacy else [("cũ (re.split + +=)", legacy)]
+        runs += [("một lượt (chuỗi)", single_pass_text), ("một lượt (mmap, luồng)", single_pass_stream)]
+        reports = [measure(name, run, input_bytes, args.memory) for name, run in runs]
+
+    print(f"{'cách':<24} {'thời gian':>10} {'MB/s':>8} {'chunks':>8} {'bộ nhớ đỉnh':>12}")
+    for report in reports:
+        peak = f"{report['peak_mb']:.1f}MB" if report['peak_mb'] is not None else "-"
+        print(f"{report['name']:<24} {report['seconds']:>9.2f}s {report['mb_per_second']:>8.1f} "
+              f"{report['chunks']:>8} {peak:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Benchmark toàn hệ thống chạy hoàn toàn offline: LLMConnector được thay bằng LLM cục bộ trả lời xác định
+(local_llm.DeterministicChatModel) với độ trễ cấu hình được, nên kết quả không phụ thuộc mạng hay rate limit của Groq.
+
+Cách chạy (từ thư mục gốc của dự án, cần knowledge base đã build và embedding model có sẵn trên máy):
+    python -m benchmarks.bench_offline --llm-latency-ms 200 --llm-tokens-per-second 150
+    python -m benchmarks.bench_offline --compare benchmarks/results/offline-<commit>.json
+    python -m benchmarks.bench_offline --llm replay   # phát lại phản hồi Groq đã ghi trong LLM_CACHE_PATH
+
+Bộ câu hỏi tiếng Việt cố định (benchmarks/data/questions_vi.jsonl) được chạy qua SimpleLegalAgent, báo cáo:
+- độ trễ p50/p95/p99 theo handler (definition, comparison, compliance, article, general) và time-to-first-token
+- số lượt gọi LLM và prompt/completion tokens cho mỗi câu hỏi
+- recall@k của retriever so với các "Điều" đã gán nhãn cho từng câu hỏi
+- thông lượng nạp dữ liệu của build_kb.py (build vào thư mục tạm, không đụng tới knowledge base đang dùng)
+Kết quả được lưu ra JSON (mặc định benchmarks/results/offline-<commit>.json) để so sánh giữa các commit.
+"""
+import argparse
+import asyncio
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from config import FULL_FILE_PATH, CHUNK_STRATEGY, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, \
+    VECTOR_BACKEND, VECTOR_COMPRESSION, PQ_SUBSPACES, RETRIEVER_K, RETRIEVAL_MODE, CONTEXT_TOKEN_BUDGET, \
+    PARENT_ARTICLE_MAX_CHARS
+
+QUESTIONS_FILE = Path(__file__).parent / "data" / "questions_vi.jsonl"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000, q)) if len(samples) else 0.0
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def document_articles(doc) -> List[int]:
+    """Các số Điều mà một tài liệu truy xuất được thuộc về (metadata, hoặc tiêu đề "Điều N" ở đầu nội dung)"""
+    article = (doc.metadata or {}).get('article')
+    if article:
+        return [int(article)]
+    return [int(n) for n in re.findall(r'Điều (\d+)\.', doc.page_content[:200])]
+
+
+async def run_questions(rag_system, questions: List[Dict[str, Any]], repeat: int, concurrency: int) -> List[Dict]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(question: str) -> Dict:
+        async with semaphore:
+            session_agent = rag_system.legal_agent.new_session()
+            start = time.perf_counter()
+            first_token = None
+            answer = []
+            async for chunk in session_agent.astream_ask(question):
+                if first_token is None and chunk:
+                    first_token = time.perf_counter()
+                answer.append(chunk)
+            end = time.perf_counter()
+            return {'question': question, 'seconds': end - start, 'ttft_seconds': (first_token or end) - start,
+                    'answer_chars': len("".join(answer))}
+
+    records = []
+    for _ in range(max(1, repeat)):
+        records.extend(await asyncio.gather(*(run(item['question']) for item in questions)))
+    return records
+
+
+def measure_recall(retriever, questions: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    recalls, hits = [], []
+    per_question = []
+    for item in questions:
+        expected = set(item['articles'])
+        found = []
+        for doc in retriever.invoke(item['question'])[:k]:
+            found.extend(document_articles(doc))
+        matched = expected & set(found)
+        recalls.append(len(matched) / len(expected))
+        hits.append(bool(matched))
+        per_question.append({'question': item['question'], 'expected': sorted(expected),
+                             'retrieved': list(dict.fromkeys(found))})
+    return {'k': k, 'recall': float(np.mean(recalls)), 'hit_rate': float(np.mean(hits)), 'questions': per_question}
+
+
+def measure_ingestion(file_path: str) -> Dict[str, Any]:
+    """Build knowledge base từ file vào một thư mục tạm, đo thời gian chia chunk, tải model và embed + ghi"""
+    from build_kb import KnowledgeBaseBuilder, default_chunk_size, load_and_chunk_file
+
+    text_chars = len(Path(file_path).read_text(encoding='utf-8'))
+    start = time.perf_counter()
+    chunk_size = default_chunk_size(CHUNK_STRATEGY)
+    _, chunks = load_and_chunk_file(file_path, chunk_size, CHUNK_OVERLAP, Path(file_path).name, CHUNK_STRATEGY)
+    chunk_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        builder = KnowledgeBaseBuilder(db_path=tmp_dir, collection_name="bench_offline",
+                                       embedding_model=EMBEDDING_MODEL_NAME, backend=VECTOR_BACKEND,
+                                       embedding_backend=EMBEDDING_BACKEND, compression=VECTOR_COMPRESSION,
+                                       pq_subspaces=PQ_SUBSPACES)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        success = builder.build_from_file(file_path, chunk_size, CHUNK_OVERLAP, clear_existing=True,
+                                          strategy=CHUNK_STRATEGY)
+        build_seconds = time.perf_counter() - start
+
+    return {
+        'success': bool(success),
+        'chars': text_chars,
+        'chunks': len(chunks),
+        'chunk_seconds': chunk_seconds,
+        'chunking_chars_per_second': text_chars / max(chunk_seconds, 1e-9),
+        'model_load_seconds': load_seconds,
+        'build_seconds': build_seconds,
+        'chunks_per_second': len(chunks) / max(build_seconds, 1e-9),
+    }
+
+
+def summarize(records: List[Dict], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    summaries = snapshot['summaries']
+    counters = snapshot['counters']
+    handlers = {entry['labels']['handler']: {key: entry[key] for key in ('count', 'p50', 'p95', 'p99')}
+                for entry in summaries.get('rag_request_seconds', [])}
+    llm_per_request = summaries.get('rag_llm_calls_per_request', [])
+    questions = sum(entry['count'] for entry in llm_per_request) or len(records)
+
+    def counter_total(name: str) -> float:
+        return sum(entry['value'] for entry in counters.get(name, []))
+
+    llm_calls = counter_total('rag_llm_calls_total')
+    return {
+        'questions': len(records),
+        'latency_ms': {
+            'p50': percentile_ms([r['seconds'] for r in records], 50),
+            'p95': percentile_ms([r['seconds'] for r in records], 95),
+            'p99': percentile_ms([r['seconds'] for r in records], 99),
+        },
+        'ttft_ms': {
+            'p50': percentile_ms([r['ttft_seconds'] for r in records], 50),
+            'p95': percentile_ms([r['ttft_seconds'] for r in records], 95),
+        },
+        'handlers': {handler: {'count': stats['count'], 'p50_ms': stats['p50'] * 1000, 'p95_ms': stats['p95'] * 1000,
+                               'p99_ms': stats['p99'] * 1000}
+                     for handler, stats in sorted(handlers.items())},
+        'llm': {
+            'calls': llm_calls,
+            'calls_per_question': llm_calls / max(questions, 1),
+            'calls_by_stage': {entry['labels']['stage']: entry['value']
+                               for entry in counters.get('rag_llm_calls_total', [])},
+            'prompt_tokens_per_question': counter_total('rag_llm_prompt_tokens_total') / max(questions, 1),
+            'completion_tokens_per_question': counter_total('rag_llm_completion_tokens_total') / max(questions, 1),
+        },
+        'stages_ms': {entry['labels']['stage']: {'count': entry['count'], 'p50': entry['p50'] * 1000,
+                                                 'p95': entry['p95'] * 1000}
+                      for entry in summaries.get('rag_stage_seconds', [])},
+    }
+
+
+def print_report(report: Dict[str, Any], previous: Dict[str, Any] = None):
+    def delta(path: List[str]) -> str:
+        if not previous:
+            return ""
+        old, new = previous, report
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    agent = report['agent']
+    print("=" * 72)
+    settings = report['settings']
+    llm_label = "replay" if settings.get('llm') == 'replay' else \
+        f"cục bộ {settings['llm_latency_ms']:.0f} ms, {settings['llm_tokens_per_second']} tokens/s"
+    print(f"Commit {report['commit']} | {agent['questions']} câu hỏi | LLM {llm_label}")
+    print(f"Độ trễ: p50 {agent['latency_ms']['p50']:.1f}ms{delta(['agent', 'latency_ms', 'p50'])} | "
+          f"p95 {agent['latency_ms']['p95']:.1f}ms{delta(['agent', 'latency_ms', 'p95'])} | "
+          f"p99 {agent['latency_ms']['p99']:.1f}ms | TTFT p50 {agent['ttft_ms']['p50']:.1f}ms")
+    print(f"{'handler':<12} {'n':>4} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for handler, stats in agent['handlers'].items():
+        print(f"{handler:<12} {stats['count']:>4} {stats['p50_ms']:>8.1f}ms {stats['p95_ms']:>8.1f}ms "
+              f"{stats['p99_ms']:>8.1f}ms{delta(['agent', 'handlers', handler, 'p50_ms'])}")
+    llm = agent['llm']
+    print(f"LLM calls/câu hỏi: {llm['calls_per_question']:.2f}{delta(['agent', 'llm', 'calls_per_question'])} "
+          f"{llm['calls_by_stage']} | prompt tokens/câu hỏi: {llm['prompt_tokens_per_question']:.0f}"
+          f"{delta(['agent', 'llm', 'prompt_tokens_per_question'])}")
+    recall = report.get('retrieval')
+    if recall:
+        print(f"Retrieval recall@{recall['k']}: {recall['recall']:.3f}{delta(['retrieval', 'recall'])} "
+              f"(hit rate {recall['hit_rate']:.3f})")
+    ingestion = report.get('ingestion')
+    if ingestion:
+        print(f"Nạp dữ liệu: {ingestion['chunks']} chunks, chia chunk {ingestion['chunking_chars_per_second']:.0f} "
+              f"ký tự/s, build {ingestion['build_seconds']:.2f}s ({ingestion['chunks_per_second']:.1f} chunks/s)"
+              f"{delta(['ingestion', 'chunks_per_second'])}")
+    print("=" * 72)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', default=str(QUESTIONS_FILE), help='File JSONL {"question", "articles"}')
+    parser.add_argument('--k', type=int, default=RETRIEVER_K, help='k của recall@k')
+    parser.add_argument('--llm', choices=['local', 'replay'], default='local',
+                        help='"local": LLM cục bộ xác định; "replay": phản hồi Groq đã ghi (LLM_CACHE_PATH), không gọi mạng')
+    parser.add_argument('--llm-latency-ms', type=float, default=200, help='Độ trễ tới token đầu tiên của LLM cục bộ')
+    parser.add_argument('--llm-tokens-per-second', type=float, default=0, help='Tốc độ sinh của LLM cục bộ (0 = tức thì)')
+    parser.add_argument('--repeat', type=int, default=1, help='Số lần chạy lại bộ câu hỏi')
+    parser.add_argument('--concurrency', type=int, default=1, help='Số câu hỏi chạy đồng thời')
+    parser.add_argument('--with-cache', action='store_true', help='Bật semantic answer cache (mặc định tắt để đo đủ pipeline)')
+    parser.add_argument('--skip-ingest', action='store_true', help='Bỏ qua đo thông lượng build_kb.py')
+    parser.add_argument('--ingest-file', default=FULL_FILE_PATH)
+    parser.add_argument('--output', help='File JSON kết quả (mặc định benchmarks/results/offline-<commit>.json)')
+    parser.add_argument('--compare', help='File JSON kết quả của một lần chạy trước để so sánh')
+    args = parser.parse_args()
+
+    import metrics
+    from config import GROQ_API_KEY, LLM_MODEL_NAME, LLM_CACHE_PATH, LLM_CACHE_MAX_MB
+    from llm_connector import LLMConnector
+    from local_llm import LocalLLMConnector
+    from rag_system import RAGSystem
+
+    questions = load_questions(args.questions)
+    if args.llm == 'replay':
+        llm_connector = LLMConnector(groq_api_key=GROQ_API_KEY, model_name=LLM_MODEL_NAME, cache_mode="replay",
+                                     cache_path=LLM_CACHE_PATH, cache_max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024)
+    else:
+        llm_connector = LocalLLMConnector(latency_ms=args.llm_latency_ms, tokens_per_second=args.llm_tokens_per_second)
+    rag_system = RAGSystem(llm_connector=llm_connector)
+    if not rag_system.load():
+        print(f"Không thể khởi tạo hệ thống: {rag_system.error}")
+        sys.exit(1)
+    if not args.with_cache:
+        rag_system.legal_agent.answer_cache = None
+
+    metrics.registry.reset()
+    start = time.perf_counter()
+    records = asyncio.run(run_questions(rag_system, questions, args.repeat, args.concurrency))
+    wall_seconds = time.perf_counter() - start
+    agent_report = summarize(records, metrics.registry.to_dict())
+    agent_report['wall_seconds'] = wall_seconds
+    agent_report['questions_per_second'] = len(records) / max(wall_seconds, 1e-9)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'llm': args.llm,
+            'llm_latency_ms': args.llm_latency_ms,
+            'llm_tokens_per_second': args.llm_tokens_per_second,
+            'repeat': args.repeat,
+            'concurrency': args.concurrency,
+            'answer_cache': args.with_cache,
+            'retrieval_mode': RETRIEVAL_MODE,
+            'vector_backend': VECTOR_BACKEND,
+            'context_token_budget': CONTEXT_TOKEN_BUDGET,
+            'chunk_strategy': CHUNK_STRATEGY,
+            'parent_article_max_chars': PARENT_ARTICLE_MAX_CHARS,
+        },
+        'startup_seconds': dict(rag_system.startup_timings),
+        'agent': agent_report,
+        'retrieval': measure_recall(rag_system.retriever, questions, args.k),
+        'ingestion': None if args.skip_ingest else measure_ingestion(args.ingest_file),
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"offline-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"So sánh với commit {previous.get('commit')} ({args.compare})")
+    print_report(report, previous)
+    print(f"Đã lưu kết quả vào '{output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+So sánh backend Chroma và index NumPy memory-mapped trên collection hiện có.
+
+Cách chạy (từ thư mục gốc của dự án):
+    python -m benchmarks.bench_vector_backends --queries 200 --k 3
+
+Script xuất collection Chroma sang một index NumPy tạm (hoặc vào DATABASE_PATH với --export),
+rồi đo từng backend trong một tiến trình con riêng để số liệu RSS không ảnh hưởng lẫn nhau.
+Vector truy vấn được lấy từ chính các embeddings đã lưu cộng nhiễu, nên không cần tải embedding model.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config import DATABASE_PATH, COLLECTION_NAME
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Không có /proc (macOS/Windows): dùng RSS đỉnh
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000, q))
+
+
+def export_chroma_to_numpy(db_path: str, collection_name: str, target_db_path: str) -> int:
+    import chromadb
+    from vector_database import NumpyVectorDatabase
+
+    collection = chromadb.PersistentClient(path=db_path).get_collection(collection_name)
+    data = collection.get(include=['embeddings', 'documents', 'metadatas'])
+    numpy_db = NumpyVectorDatabase(target_db_path, collection_name)
+    numpy_db.reset()
+    numpy_db.upsert_records(data['ids'], data['documents'], np.asarray(data['embeddings'], dtype=np.float32),
+                            data['metadatas'])
+    numpy_db.flush()
+    return len(data['ids'])
+
+
+def make_queries(db_path: str, collection_name: str, n: int, seed: int = 0) -> np.ndarray:
+    from numpy_vector_store import NumpyVectorIndex, numpy_index_dir, normalize_rows
+
+    index = NumpyVectorIndex.load(str(numpy_index_dir(db_path, collection_name)))
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(index), size=n)
+    base = np.asarray(index.embeddings[rows], dtype=np.float32)
+    return normalize_rows(base + rng.normal(scale=0.05, size=base.shape).astype(np.float32))
+
+
+def run_worker(backend: str, db_path: str, numpy_db_path: str, collection_name: str, queries_file: str, k: int, batch_size: int):
+    queries = np.load(queries_file)
+    rss_before = current_rss_mb()
+
+    start = time.perf_counter()
+    if backend == "chroma":
+        import chromadb
+        collection = chromadb.PersistentClient(path=db_path).get_collection(collection_name)
+
+        def search(batch):
+            result = collection.query(query_embeddings=batch, n_results=k, include=[])
+            return result['ids']
+    else:
+        from numpy_vector_store import NumpyVectorIndex, numpy_index_dir
+        index = NumpyVectorIndex.load(str(numpy_index_dir(numpy_db_path, collection_name)), mmap=True)
+
+        def search(batch):
+            indices, _ = index.search(batch, k)
+            return [[index.ids[i] for i in row] for row in indices]
+
+    search(queries[:1])
+    cold_start = time.perf_counter() - start
+
+    latencies = []
+    results = []
+    for query in queries:
+        t = time.perf_counter()
+        results.extend(search(query[None, :]))
+        latencies.append(time.perf_counter() - t)
+
+    batch_start = time.perf_counter()
+    for start_row in range(0, len(queries), batch_size):
+        search(queries[start_row:start_row + batch_size])
+    batch_total = time.perf_counter() - batch_start
+
+    print(json.dumps({
+        'backend': backend,
+        'cold_start_ms': cold_start * 1000,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p95_ms': percentile_ms(latencies, 95),
+        'p99_ms': percentile_ms(latencies, 99),
+        'batched_qps': len(queries) / max(batch_total, 1e-9),
+        'rss_delta_mb': current_rss_mb() - rss_before,
+        'results': results,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-path', default=DATABASE_PATH)
+    parser.add_argument('--collection', default=COLLECTION_NAME)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--export', action='store_true', help='Ghi index NumPy vào --db-path thay vì thư mục tạm')
+    parser.add_argument('--worker', choices=['chroma', 'numpy'], help=argparse.SUPPRESS)
+    parser.add_argument('--numpy-db-path', help=argparse.SUPPRESS)
+    parser.add_argument('--queries-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.db_path, args.numpy_db_path, args.collection, args.queries_file, args.k, args.batch_size)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        numpy_db_path = args.db_path if args.export else tmp_dir
+        count = export_chroma_to_numpy(args.db_path, args.collection, numpy_db_path)
+        queries_file = str(Path(tmp_dir) / 'queries.npy')
+        np.save(queries_file, make_queries(numpy_db_path, args.collection, args.queries))
+        print(f"Collection '{args.collection}': {count} vectors, {args.queries} truy vấn, k={args.k}")
+
+        reports = {}
+        for backend in ('chroma', 'numpy'):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_vector_backends', '--worker', backend,
+                 '--db-path', args.db_path, '--numpy-db-path', numpy_db_path, '--collection', args.collection,
+                 '--queries-file', queries_file, '--k', str(args.k), '--batch-size', str(args.batch_size)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            reports[backend] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'backend':<8} {'cold start':>11} {'p50':>8} {'p95':>8} {'p99':>8} {'batched qps':>12} {'RSS +MB':>8}")
+    for backend, report in reports.items():
+        print(f"{backend:<8} {report['cold_start_ms']:>9.1f}ms {report['p50_ms']:>6.2f}ms {report['p95_ms']:>6.2f}ms "
+              f"{report['p99_ms']:>6.2f}ms {report['batched_qps']:>12.0f} {report['rss_delta_mb']:>8.1f}")
+
+    overlaps = [len(set(a) & set(b)) / max(len(b), 1)
+                for a, b in zip(reports['chroma']['results'], reports['numpy']['results'])]
+    print(f"Độ trùng khớp top-{args.k} giữa HNSW (Chroma) và tìm kiếm chính xác (NumPy): {np.mean(overlaps):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Đánh đổi giữa bộ nhớ và độ chính xác của các kiểu nén vectors (float16, int8, product quantization)
+cho backend NumPy, so với tìm kiếm chính xác trên float32.
+
+Cách chạy (từ thư mục gốc của dự án):
+    python -m benchmarks.bench_vector_compression --k 3 --rerank-factor 4 --scale 100000
+
+Vectors được lấy từ index NumPy của collection (xuất từ Chroma sang thư mục tạm nếu chưa có).
+Với --scale N, các vectors được nhân bản kèm nhiễu tới N hàng để mô phỏng knowledge base nhiều văn bản luật.
+Báo cáo: bộ nhớ của ma trận quét (mã nén) so với float32, tổng dung lượng vectors trên đĩa
+(float32 vẫn được giữ để chấm lại nên luôn tăng khi bật nén), recall@k của tìm kiếm xấp xỉ thuần và sau khi chấm lại chính xác,
+cùng độ trễ p50/p95 mỗi truy vấn.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.bench_vector_backends import export_chroma_to_numpy, percentile_ms
+from config import DATABASE_PATH, COLLECTION_NAME, PQ_SUBSPACES
+from numpy_vector_store import NumpyVectorIndex, numpy_index_dir, normalize_rows
+from vector_quantization import COMPRESSIONS
+
+
+def load_vectors(db_path: str, collection_name: str) -> np.ndarray:
+    index_dir = numpy_index_dir(db_path, collection_name)
+    if (index_dir / "metadata.json").exists():
+        return np.asarray(NumpyVectorIndex.load(str(index_dir), mmap=False).embeddings, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        export_chroma_to_numpy(db_path, collection_name, tmp_dir)
+        return np.asarray(NumpyVectorIndex.load(str(numpy_index_dir(tmp_dir, collection_name)), mmap=False).embeddings,
+                          dtype=np.float32)
+
+
+def scale_vectors(vectors: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    if n <= len(vectors):
+        return vectors
+    rows = rng.integers(0, len(vectors), size=n - len(vectors))
+    extra = vectors[rows] + rng.normal(scale=0.05, size=(len(rows), vectors.shape[1])).astype(np.float32)
+    return np.concatenate([vectors, normalize_rows(extra)])
+
+
+def recall(expected: np.ndarray, found: np.ndarray) -> float:
+    k = expected.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db-path', default=DATABASE_PATH)
+    parser.add_argument('--collection', default=COLLECTION_NAME)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--rerank-factor', type=int, default=4)
+    parser.add_argument('--pq-subspaces', type=int, default=PQ_SUBSPACES)
+    parser.add_argument('--scale', type=int, default=0, help='Nhân bản vectors (kèm nhiễu) tới số hàng này')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = scale_vectors(load_vectors(args.db_path, args.collection), args.scale, rng)
+    rows = rng.integers(0, len(vectors), size=args.queries)
+    queries = normalize_rows(vectors[rows] + rng.normal(scale=0.05, size=(args.queries, vectors.shape[1])).astype(np.float32))
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} chiều, {args.queries} truy vấn, k={args.k}, "
+          f"rerank {args.k * args.rerank_factor} ứng viên")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ids = [str(i) for i in range(len(vectors))]
+        reports = []
+        for compression in COMPRESSIONS:
+            index_dir = Path(tmp_dir) / compression
+            start = time.perf_counter()
+            NumpyVectorIndex.save(str(index_dir), ids, [''] * len(ids), [{}] * len(ids), vectors,
+                                  compression=compression, pq_subspaces=args.pq_subspaces)
+            build_seconds = time.perf_counter() - start
+            index = NumpyVectorIndex.load(str(index_dir), mmap=True, rerank_factor=args.rerank_factor)
+
+            latencies, found = [], []
+            for query in queries:
+                t = time.perf_counter()
+                indices, _ = index.search(query, args.k)
+                latencies.append(time.perf_counter() - t)
+                found.append(indices[0])
+            if compression == "none":
+                exact = np.asarray(found)
+                approximate = exact
+            else:
+                approximate = np.argsort(-index.approximate_scores(queries), axis=1)[:, :args.k]
+
+            disk_bytes = sum(path.stat().st_size for path in index_dir.glob('*') if path.name != 'metadata.json')
+            code_bytes = index.codes.nbytes if index.codes is not None else vectors.nbytes
+            reports.append({
+                'compression': compression,
+                'memory_mb': code_bytes / 1e6,
+                'saving': vectors.nbytes / code_bytes,
+                'disk_mb': disk_bytes / 1e6,
+                'recall_approx': recall(exact, approximate),
+                'recall_rerank': recall(exact, np.asarray(found)),
+                'p50_ms': percentile_ms(latencies, 50),
+                'p95_ms': percentile_ms(latencies, 95),
+                'build_seconds': build_seconds,
+            })
+
+    print(f"{'nén':<8} {'bộ nhớ':>10} {'giảm':>6} {'trên đĩa':>10} {'recall xấp xỉ':>14} {'recall rerank':>14} {'p50':>8} {'p95':>8} {'build':>7}")
+    for report in reports:
+        print(f"{report['compression']:<8} {report['memory_mb']:>8.2f}MB {report['saving']:>5.1f}x {report['disk_mb']:>8.2f}MB "
+              f"{report['recall_approx']:>14.3f} {report['recall_rerank']:>14.3f} {report['p50_ms']:>6.2f}ms "
+              f"{report['p95_ms']:>6.2f}ms {report['build_seconds']:>6.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_DIR = "bm25_index"
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def bm25_index_path(db_path: str, collection_name: str) -> Path:
+    return Path(db_path) / BM25_INDEX_DIR / f"{collection_name}.json"
+
+
+def tokenize_vietnamese(text: str) -> List[str]:
+    """
+    Tách từ cho tiếng Việt: chuẩn hóa Unicode (NFC), chữ thường, tách theo âm tiết,
+    rồi thêm các cặp âm tiết liền kề ("dữ_liệu", "điều_12") để giữ được từ ghép
+    và các cụm tham chiếu điều luật mà embedding thường làm mờ đi.
+    """
+    syllables = _TOKEN_PATTERN.findall(unicodedata.normalize('NFC', text).lower())
+    bigrams = [f"{first}_{second}" for first, second in zip(syllables, syllables[1:])]
+    return syllables + bigrams
+
+
+class BM25Index:
+    """Chỉ mục từ vựng BM25 (Okapi) lưu dạng inverted index, được build cùng lúc với vector database"""
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self.avg_doc_length = 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.idf: Dict[str, float] = {}
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+              k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+        index.ids = list(ids)
+        index.documents = list(documents)
+        index.metadatas = [dict(metadata or {}) for metadata in metadatas]
+
+        postings = defaultdict(list)
+        for doc_idx, document in enumerate(index.documents):
+            term_counts = Counter(tokenize_vietnamese(document))
+            index.doc_lengths.append(sum(term_counts.values()))
+            for term, tf in term_counts.items():
+                postings[term].append((doc_idx, tf))
+        index.postings = dict(postings)
+        index._update_statistics()
+        logger.info(f" Đã build BM25 index: {len(index.ids)} documents, {len(index.postings)} terms")
+        return index
+
+    def _update_statistics(self):
+        n = len(self.doc_lengths)
+        self.avg_doc_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Trả về danh sách (vị trí document, điểm BM25) giảm dần theo điểm"""
+        if not self.ids:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize_vietnamese(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_idx, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_doc_length)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path: str):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'k1': self.k1,
+            'b': self.b,
+            'ids': self.ids,
+            'documents': self.documents,
+            'metadatas': self.metadatas,
+            'doc_lengths': self.doc_lengths,
+            'postings': self.postings,
+        }
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        logger.info(f" Đã lưu BM25 index vào '{path}'")
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(k1=data['k1'], b=data['b'])
+        index.ids = data['ids']
+        index.documents = data['documents']
+        index.metadatas = data['metadatas']
+        index.doc_lengths = data['doc_lengths']
+        index.postings = {term: [tuple(entry) for entry in posting] for term, posting in data['postings'].items()}
+        index._update_statistics()
+        return index
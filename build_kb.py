@@ -1,66 +1,303 @@
 # build_kb.py
-import os
+import time
+import queue
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from pathlib import Path
-import chromadb
+import numpy as np
 
 
 from config import FULL_FILE_PATH, DATABASE_PATH, COLLECTION_NAME, EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP, \
-    CLEAR_EXISTING_DB
+    CLEAR_EXISTING_DB, INCREMENTAL_BUILD, DATA_DIR, INGEST_MODE, INGEST_FILE_EXTENSIONS, INGEST_MAX_WORKERS, \
+    CHROMA_BATCH_SIZE, EMBEDDING_BATCH_SIZE, VECTOR_BACKEND, HYBRID_SEARCH_ENABLED, EMBEDDING_BACKEND, \
+    VECTOR_COMPRESSION, PQ_SUBSPACES, CHUNK_STRATEGY, CLAUSE_CHUNK_SIZE
 from text_processor import TextProcessor
 from embedding_generator import EmbeddingGenerator
-from vector_database import VectorDatabase
+from vector_database import create_vector_database
+from kb_version import bump_kb_version
+from bm25_index import BM25Index, bm25_index_path
+from article_index import ArticleIndex, article_index_path
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def default_chunk_size(strategy: str) -> int:
+    """Độ dài tối đa của chunk theo chiến lược: chunk cấp Khoản nhỏ hơn chunk cấp Điều"""
+    return CLAUSE_CHUNK_SIZE if strategy == "law_clause" else CHUNK_SIZE
+
+
+def load_and_chunk_file(file_path: str, chunk_size: int, overlap: int, source_file: str,
+                        strategy: str = "law_article") -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Đọc, làm sạch và chia chunk một file (theo luồng, trong một lượt qua file).
+    Là hàm cấp module để có thể chạy trong process pool khi nạp cả thư mục; vì kết quả phải được
+    pickle về tiến trình chính, danh sách chunk của cả file được dựng đầy đủ trong bộ nhớ.
+    """
+    return source_file, TextProcessor().split_file_into_chunks(file_path, chunk_size, overlap, strategy=strategy,
+                                                               source=source_file)
+
+
+class _PrefetchError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _prefetch(iterator: Iterator, depth: int) -> Iterator:
+    """
+    Chạy iterator trong một thread nền và đệm tối đa `depth` phần tử, để bước sinh dữ liệu
+    (encode) chạy chồng lấn với bước tiêu thụ (ghi vào vector database).
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as e:
+            put(_PrefetchError(e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, _PrefetchError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
 class KnowledgeBaseBuilder:
     """Lớp chính để xây dựng kho tri thức"""
 
-    def __init__(self, db_path: str, collection_name: str, embedding_model: str):
+    def __init__(self, db_path: str, collection_name: str, embedding_model: str, batch_size: int = 1000,
+                 embedding_batch_size: int = 64, prefetch_batches: int = 2, backend: str = "chroma",
+                 build_bm25: bool = True, embedding_backend: str = "torch", compression: str = "none",
+                 pq_subspaces: int = 16):
         self.text_processor = TextProcessor()
-        self.embedding_generator = EmbeddingGenerator(embedding_model)
-        self.vector_db = VectorDatabase(db_path, collection_name)
+        self.embedding_generator = EmbeddingGenerator(embedding_model, backend=embedding_backend)
+        self.vector_db = create_vector_database(backend, db_path, collection_name, batch_size=batch_size,
+                                                compression=compression, pq_subspaces=pq_subspaces)
+        self.embedding_batch_size = max(1, embedding_batch_size)
+        self.prefetch_batches = max(1, prefetch_batches)
+        self.build_bm25 = build_bm25
         logger.info("KnowledgeBaseBuilder khởi tạo thành công.")
 
-    def build_from_file(self, file_path: str, chunk_size: int, overlap: int, clear_existing: bool):
-        logger.info(f"Bắt đầu xây dựng knowledge base từ file: {file_path}")
+    def _iter_embedded_batches(self, chunks: Iterable[Dict[str, Any]], stats: Dict[str, Any]) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """Gom chunks thành các batch cố định và encode từng batch"""
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= self.embedding_batch_size:
+                yield batch, self._encode_batch(batch, stats)
+                batch = []
+        if batch:
+            yield batch, self._encode_batch(batch, stats)
 
-        
-        if clear_existing:
-            logger.info(f"Yêu cầu xóa dữ liệu cũ. Đang tạo lại collection '{self.vector_db.collection_name}'...")
+    def _encode_batch(self, batch: List[Dict[str, Any]], stats: Dict[str, Any]) -> np.ndarray:
+        start_time = time.perf_counter()
+        embeddings = self.embedding_generator.create_embeddings([chunk['content'] for chunk in batch], show_progress_bar=False)
+        stats['embed_seconds'] += time.perf_counter() - start_time
+        return embeddings
+
+    def _store_chunks(self, source_file: str, chunks: List[Dict[str, Any]], incremental: bool) -> Optional[Dict[str, Any]]:
+        """
+        Embed và ghi các chunk của một file nguồn vào vector database theo dạng pipeline:
+        chunk -> encode theo batch cố định -> ghi từng batch. Việc encode batch kế tiếp chạy song song
+        với việc ghi batch hiện tại, nên embeddings chỉ tồn tại theo batch. Danh sách chunk (văn bản) của
+        cả file vẫn nằm trong bộ nhớ (cần để so sánh ids ở chế độ incremental), nên bộ nhớ đỉnh bị chặn
+        theo từng file chứ không theo batch; với backend "numpy", toàn bộ records còn được giữ tới flush().
+        Với incremental=True, chỉ embed các chunk mới/thay đổi và xóa các chunk không còn trong file.
+        Trả về thống kê {'embedded', 'deleted', 'embed_seconds'} hoặc None nếu có lỗi.
+        """
+        stats = {'embedded': 0, 'deleted': 0, 'embed_seconds': 0.0}
+
+        stale_ids = []
+        pending_chunks: Iterable[Dict[str, Any]] = chunks
+        if incremental:
+            existing_ids = self.vector_db.get_ids_by_source(source_file)
+            current_ids = {chunk['id'] for chunk in chunks}
+            stale_ids = sorted(existing_ids - current_ids)
+            unchanged = len(current_ids & existing_ids)
+            logger.info(f"[{source_file}] Chế độ incremental: {len(chunks) - unchanged} chunks mới/thay đổi, "
+                        f"{unchanged} chunks không đổi, {len(stale_ids)} chunks cần xóa.")
+            pending_chunks = (chunk for chunk in chunks if chunk['id'] not in existing_ids)
+
+        batches = _prefetch(self._iter_embedded_batches(pending_chunks, stats), depth=self.prefetch_batches)
+        for batch, embeddings in batches:
+            if len(embeddings) != len(batch):
+                batches.close()
+                return None
+            if not self.vector_db.add_documents(batch, embeddings, source_file):
+                batches.close()
+                return None
+            stats['embedded'] += len(batch)
+
+        if not self.vector_db.delete_ids(stale_ids):
+            return None
+        stats['deleted'] = len(stale_ids)
+        return stats
+
+    def _delete_missing_sources(self, current_sources: Iterable[str]) -> Optional[int]:
+        """
+        Xóa chunks của các file nguồn đã lưu nhưng không còn trong thư mục (file bị xóa hoặc đổi tên),
+        để chúng không còn được truy xuất và trích dẫn. Trả về số chunk đã xóa hoặc None nếu có lỗi.
+        """
+        try:
+            missing = sorted(self.vector_db.get_sources() - set(current_sources))
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc danh sách file nguồn đã lưu: {e}")
+            return None
+        deleted = 0
+        for source_file in missing:
+            stale_ids = sorted(self.vector_db.get_ids_by_source(source_file))
+            logger.info(f"[{source_file}] File không còn trong thư mục, xóa {len(stale_ids)} chunks.")
+            if not self.vector_db.delete_ids(stale_ids):
+                return None
+            deleted += len(stale_ids)
+        return deleted
+
+    def _update_indexes(self, changed: bool) -> bool:
+        """
+        Build lại các index phụ (BM25, article index) từ toàn bộ nội dung vector database
+        khi có thay đổi, hoặc khi index chưa tồn tại.
+        """
+        db_path = str(self.vector_db.db_path)
+        collection_name = self.vector_db.collection_name
+        builders = [(article_index_path(db_path, collection_name), ArticleIndex.build, "article index")]
+        if self.build_bm25:
+            builders.append((bm25_index_path(db_path, collection_name), BM25Index.build, "BM25 index"))
+
+        pending = [(path, build, name) for path, build, name in builders if changed or not path.exists()]
+        if not pending:
+            return True
+        try:
+            records = self.vector_db.get_all_records()
+        except Exception as e:
+            logger.error(f"Lỗi khi đọc dữ liệu để build index: {e}")
+            return False
+        for path, build, name in pending:
             try:
-                self.vector_db.client.delete_collection(name=self.vector_db.collection_name)
-                self.vector_db.collection = self.vector_db.client.create_collection(name=self.vector_db.collection_name)
-                logger.info(f"Đã tạo lại collection '{self.vector_db.collection_name}' thành công.")
+                build(records['ids'], records['documents'], records['metadatas']).save(str(path))
             except Exception as e:
-                logger.error(f"Lỗi khi tạo lại collection: {e}. Collection không tồn tại.")
-                
-                self.vector_db.collection = self.vector_db.client.get_or_create_collection(
-                    name=self.vector_db.collection_name)
+                logger.error(f"Lỗi khi build {name}: {e}")
+                return False
+        return True
 
-        raw_text = self.text_processor.read_file(file_path)
-        if not raw_text: return False
+    def build_from_file(self, file_path: str, chunk_size: int, overlap: int, clear_existing: bool,
+                        incremental: bool = False, strategy: str = "law_article"):
+        """
+        Xây dựng knowledge base từ một file.
+        Với incremental=True (và không xóa dữ liệu cũ), chỉ embed các chunk mới hoặc đã thay đổi,
+        xóa các chunk không còn trong file và bỏ qua các chunk không đổi.
+        """
+        logger.info(f"Bắt đầu xây dựng knowledge base từ file: {file_path}")
 
-        cleaned_text = self.text_processor.clean_text(raw_text)
-        if not cleaned_text: return False
+        if clear_existing:
+            logger.info(f"Yêu cầu xóa dữ liệu cũ. Đang tạo lại collection '{self.vector_db.collection_name}'...")
+            self.vector_db.reset()
 
-        chunks = self.text_processor.split_into_chunks(cleaned_text, chunk_size, overlap)
+        source_file, chunks = load_and_chunk_file(file_path, chunk_size, overlap, Path(file_path).name, strategy)
         if not chunks: return False
 
-        texts = [chunk['content'] for chunk in chunks]
-        embeddings = self.embedding_generator.create_embeddings(texts)
-        if not embeddings: return False
+        stats = self._store_chunks(source_file, chunks, incremental and not clear_existing)
+        if stats is None: return False
 
-        success = self.vector_db.add_documents(chunks, embeddings, Path(file_path).name)
-        if success:
+        changed = bool(stats['embedded'] or stats['deleted'])
+        if not self.vector_db.flush(): return False
+        if not self._update_indexes(changed): return False
+        if changed:
+            bump_kb_version(str(self.vector_db.db_path))
             logger.info("Xây dựng knowledge base thành công!")
-            self.print_summary()
-            return True
-        return False
+        else:
+            logger.info("Knowledge base đã được cập nhật, không có thay đổi.")
+        self.print_summary()
+        return True
+
+    def build_from_directory(self, dir_path: str, chunk_size: int, overlap: int, clear_existing: bool,
+                             incremental: bool = False, extensions: Iterable[str] = ('.txt', '.md'),
+                             max_workers: Optional[int] = None, strategy: str = "law_article"):
+        """
+        Xây dựng knowledge base từ tất cả các file văn bản trong một thư mục (kể cả thư mục con).
+        Việc đọc, làm sạch và chia chunk chạy song song trong process pool; embedding và ghi vào
+        vector database được thực hiện ngay khi mỗi file xử lý xong, theo từng batch giới hạn.
+        Với incremental=True, chunks của các file đã bị xóa/đổi tên khỏi thư mục cũng được xóa.
+        """
+        dir_path = Path(dir_path)
+        extensions = {ext.lower() for ext in extensions}
+        files = sorted(p for p in dir_path.rglob('*') if p.is_file() and p.suffix.lower() in extensions)
+        if not files:
+            logger.error(f"Không tìm thấy file nào ({', '.join(sorted(extensions))}) trong thư mục: {dir_path}")
+            return False
+        logger.info(f"Bắt đầu xây dựng knowledge base từ {len(files)} file trong thư mục: {dir_path}")
+
+        if clear_existing:
+            logger.info(f"Yêu cầu xóa dữ liệu cũ. Đang tạo lại collection '{self.vector_db.collection_name}'...")
+            self.vector_db.reset()
+
+        total = {'files': 0, 'failed': 0, 'chunks': 0, 'embedded': 0, 'deleted': 0, 'embed_seconds': 0.0}
+        if incremental and not clear_existing:
+            deleted = self._delete_missing_sources(path.relative_to(dir_path).as_posix() for path in files)
+            if deleted is None:
+                return False
+            total['deleted'] += deleted
+
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(load_and_chunk_file, str(path), chunk_size, overlap,
+                                path.relative_to(dir_path).as_posix(), strategy): path
+                for path in files
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    source_file, chunks = future.result()
+                except Exception as e:
+                    logger.error(f"Lỗi khi xử lý file {path}: {e}")
+                    total['failed'] += 1
+                    continue
+                if not chunks:
+                    total['failed'] += 1
+                    continue
+
+                stats = self._store_chunks(source_file, chunks, incremental and not clear_existing)
+                if stats is None:
+                    total['failed'] += 1
+                    continue
+                total['files'] += 1
+                total['chunks'] += len(chunks)
+                for key in ('embedded', 'deleted', 'embed_seconds'):
+                    total[key] += stats[key]
+        elapsed = time.perf_counter() - start_time
+
+        changed = bool(total['embedded'] or total['deleted'])
+        if not self.vector_db.flush(): return False
+        if not self._update_indexes(changed): return False
+        if changed:
+            bump_kb_version(str(self.vector_db.db_path))
+        self.print_summary()
+        self.print_throughput(total, elapsed)
+        return total['files'] > 0
 
     def print_summary(self):
         db_info = self.vector_db.get_database_info()
@@ -69,10 +306,19 @@ class KnowledgeBaseBuilder:
         print(f"Đường dẫn DB: {db_info.get('database_path', 'N/A')}")
         print(f"Collection: {db_info.get('collection_name', 'N/A')}")
         print(f"Tổng số documents: {db_info.get('total_documents', 0)}")
-        print(f"Embedding model: {model_info.get('model_name', 'N/A')}")
+        print(f"Embedding model: {model_info.get('model_name', 'N/A')} (backend: {model_info.get('backend', 'N/A')})")
         print(f"Vector dimension: {model_info.get('vector_dimension', 'N/A')}")
         print("=" * 60 + "\n")
 
+    def print_throughput(self, total: Dict[str, Any], elapsed: float):
+        elapsed = max(elapsed, 1e-9)
+        embed_seconds = max(total['embed_seconds'], 1e-9)
+        print(f"File đã nạp: {total['files']} (lỗi: {total['failed']}) trong {elapsed:.2f} giây")
+        print(f"Tốc độ: {total['files'] / elapsed:.2f} files/s | {total['chunks'] / elapsed:.1f} chunks/s | "
+              f"{total['embedded'] / embed_seconds:.1f} embeddings/s")
+        print(f"Chunks mới/thay đổi: {total['embedded']} | Chunks đã xóa: {total['deleted']}")
+        print("=" * 60 + "\n")
+
 
 
 if __name__ == "__main__":
@@ -83,14 +329,35 @@ if __name__ == "__main__":
         builder = KnowledgeBaseBuilder(
             db_path=DATABASE_PATH,
             collection_name=COLLECTION_NAME,
-            embedding_model=EMBEDDING_MODEL_NAME
-        )
-        success = builder.build_from_file(
-            file_path=FULL_FILE_PATH,
-            chunk_size=CHUNK_SIZE,
-            overlap=CHUNK_OVERLAP,
-            clear_existing=CLEAR_EXISTING_DB
+            embedding_model=EMBEDDING_MODEL_NAME,
+            batch_size=CHROMA_BATCH_SIZE,
+            embedding_batch_size=EMBEDDING_BATCH_SIZE,
+            backend=VECTOR_BACKEND,
+            build_bm25=HYBRID_SEARCH_ENABLED,
+            embedding_backend=EMBEDDING_BACKEND,
+            compression=VECTOR_COMPRESSION,
+            pq_subspaces=PQ_SUBSPACES
         )
+        if INGEST_MODE == "directory":
+            success = builder.build_from_directory(
+                dir_path=DATA_DIR,
+                chunk_size=default_chunk_size(CHUNK_STRATEGY),
+                overlap=CHUNK_OVERLAP,
+                clear_existing=CLEAR_EXISTING_DB,
+                incremental=INCREMENTAL_BUILD,
+                extensions=INGEST_FILE_EXTENSIONS,
+                max_workers=INGEST_MAX_WORKERS,
+                strategy=CHUNK_STRATEGY
+            )
+        else:
+            success = builder.build_from_file(
+                file_path=FULL_FILE_PATH,
+                chunk_size=default_chunk_size(CHUNK_STRATEGY),
+                overlap=CHUNK_OVERLAP,
+                clear_existing=CLEAR_EXISTING_DB,
+                incremental=INCREMENTAL_BUILD,
+                strategy=CHUNK_STRATEGY
+            )
 
         if success:
             print("Xây dựng knowledge base thành công!")
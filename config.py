@@ -6,12 +6,43 @@ FULL_FILE_PATH = os.path.join(DATA_DIR, FILE_NAME)
 DB_DIR = "vector_db"
 DATABASE_PATH = os.path.join(DB_DIR, "my_knowledge_db")
 COLLECTION_NAME = "luat_bao_ve_du_lieu"
+# "chroma": ChromaDB (mặc định); "numpy": ma trận embeddings memory-mapped, top-k chính xác trong tiến trình
+VECTOR_BACKEND = "chroma"
+# Nén vectors của backend "numpy": "none" (float32), "float16" (1/2 bộ nhớ), "int8" (1/4) hoặc "pq"
+# (product quantization, PQ_SUBSPACES byte mỗi vector). Tìm kiếm xấp xỉ trên mã nén lấy
+# k * VECTOR_RERANK_FACTOR ứng viên rồi chấm lại chính xác bằng float32 (tăng hệ số để tăng recall).
+# Nén chỉ giảm ma trận quét khi tìm kiếm: embeddings float32 vẫn được lưu để chấm lại, nên tổng dung lượng
+# trên đĩa tăng thêm phần mã nén (codes.npy) và tham số codec (codec.npz).
+VECTOR_COMPRESSION = "none"
+PQ_SUBSPACES = 16
+VECTOR_RERANK_FACTOR = 4
 
 EMBEDDING_MODEL_NAME = "keepitreal/vietnamese-sbert"
+# Backend suy luận embedding trên CPU: "torch" (full-precision), "onnx" (ONNX Runtime, cần optimum[onnxruntime])
+# hoặc "int8" (lượng tử hóa động). Dùng chung cho build_kb.py và lúc truy vấn; đổi backend thì nên build lại
+# knowledge base với CLEAR_EXISTING_DB = True để vector đã lưu và vector truy vấn khớp nhau.
+EMBEDDING_BACKEND = "torch"
+# Gom các truy vấn đến trong vòng QUERY_EMBEDDING_BATCH_WAIT_MS (ms) thành một lần encode (0 = tắt)
+QUERY_EMBEDDING_BATCH_SIZE = 32
+QUERY_EMBEDDING_BATCH_WAIT_MS = 5
 
 CHUNK_SIZE = 2000
 CHUNK_OVERLAP = 200
+# Cách chia chunk: "law_clause" (chunk nhỏ cấp Khoản/Điểm, tối đa CLAUSE_CHUNK_SIZE ký tự, liên kết với Điều cha),
+# "law_article" (mỗi chunk một Điều, tối đa CHUNK_SIZE ký tự) hoặc "sentence"
+CHUNK_STRATEGY = "law_clause"
+CLAUSE_CHUNK_SIZE = 800
 CLEAR_EXISTING_DB = False
+# Chỉ embed các chunk mới/thay đổi và xóa các chunk đã bị loại bỏ khỏi file nguồn
+INCREMENTAL_BUILD = True
+
+# "file": chỉ nạp FULL_FILE_PATH; "directory": nạp toàn bộ file văn bản trong DATA_DIR
+INGEST_MODE = "file"
+INGEST_FILE_EXTENSIONS = ['.txt', '.md']
+INGEST_MAX_WORKERS = None  # None = số CPU
+CHROMA_BATCH_SIZE = 1000
+# Số chunk được encode và ghi vào vector database mỗi lượt (quyết định bộ nhớ đỉnh khi build)
+EMBEDDING_BATCH_SIZE = 64
 
 import os
 from dotenv import load_dotenv
@@ -19,3 +50,74 @@ load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 LLM_MODEL_NAME = "llama3-8b-8192" 
+# "groq": gọi Groq API; "local": LLM cục bộ trả lời xác định (local_llm.py), không cần mạng, dùng cho benchmark/CI
+LLM_PROVIDER = "groq"
+# Độ trễ mô phỏng của LLM cục bộ: thời gian tới token đầu tiên (ms) và tốc độ sinh (0 = tức thì)
+LOCAL_LLM_LATENCY_MS = 200
+LOCAL_LLM_TOKENS_PER_SECOND = 0
+# Cache phản hồi LLM trên đĩa, khóa theo tên model, hash prompt và tham số sinh: "off", "on" (đọc + ghi),
+# "record" (luôn gọi LLM và ghi lại phiên) hoặc "replay" (chỉ dùng phản hồi đã ghi, không gọi mạng, prompt mới sẽ báo lỗi)
+LLM_CACHE_MODE = "on"
+LLM_CACHE_PATH = os.path.join(DB_DIR, "llm_cache.sqlite3")
+LLM_CACHE_MAX_MB = 64
+# Bộ lập lịch gọi Groq: token bucket theo quota request/token mỗi phút (0 = không giới hạn), retry 429/lỗi tạm thời
+# với exponential backoff + jitter, gộp các prompt giống hệt đang chạy; câu hỏi tương tác được ưu tiên hơn batch
+LLM_SCHEDULER_ENABLED = True
+LLM_REQUESTS_PER_MINUTE = 30
+LLM_TOKENS_PER_MINUTE = 30000
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 30.0
+# Số completion tokens ước lượng cho mỗi lượt gọi khi trừ quota token trước (được điều chỉnh theo usage thực tế)
+LLM_EXPECTED_COMPLETION_TOKENS = 512
+# Gọi thử LLM khi khởi động: "background" (thread nền, không chặn khởi động), "blocking" hoặc "off"
+LLM_WARMUP = "background"
+
+# Số đoạn văn lấy từ vector search cho mỗi truy vấn
+RETRIEVER_K = 3
+# Chế độ truy xuất: "adaptive" (vector search trước, chỉ mở rộng truy vấn khi kết quả kém tin cậy),
+# "multi_query" (luôn gọi LLM viết lại truy vấn) hoặc "vector" (chỉ vector search)
+RETRIEVAL_MODE = "adaptive"
+# Cách mở rộng truy vấn ở chế độ adaptive: "llm" (Multi-Query) hoặc "local" (bảng viết tắt/đồng nghĩa, không gọi LLM)
+QUERY_EXPANSION = "llm"
+# Ngưỡng cosine similarity của kết quả tốt nhất và khoảng cách tối thiểu giữa kết quả đầu và kết quả thứ k.
+# Điểm được quy về cosine similarity cho cả Chroma và backend "numpy" nên cùng một ngưỡng dùng được cho mọi backend
+ADAPTIVE_MIN_TOP_SCORE = 0.65
+ADAPTIVE_MIN_SCORE_MARGIN = 0.015
+# Hybrid retrieval: gộp BM25 (từ vựng) với vector search bằng Reciprocal Rank Fusion
+HYBRID_SEARCH_ENABLED = True
+HYBRID_TOP_K = 5
+BM25_TOP_K = 10
+RRF_K = 60
+
+# Đóng gói ngữ cảnh trước khi gửi LLM: bỏ chunk trùng lặp/chồng lấn giữa các truy vấn viết lại,
+# sắp theo thứ tự Điều và giới hạn tổng số token (đếm bằng tiktoken) của phần NGỮ CẢNH (0 = không giới hạn)
+CONTEXT_PACKING_ENABLED = True
+CONTEXT_TOKEN_BUDGET = 3000
+CONTEXT_TOKEN_ENCODING = "cl100k_base"
+# Truy xuất cha-con (CHUNK_STRATEGY = "law_clause"): khi các Khoản của một Điều khớp, đưa cả Điều vào ngữ cảnh nếu
+# Điều đó không dài quá PARENT_ARTICLE_MAX_CHARS ký tự, ngược lại chỉ đưa các Khoản khớp kèm tiêu đề Điều
+PARENT_ARTICLE_MAX_CHARS = 1200
+
+# Số truy vấn con (sub-query) của Agent được chạy đồng thời cho một câu hỏi
+MAX_CONCURRENT_SUBQUERIES = 3
+# Số lượt hỏi-đáp tối đa giữ trong lịch sử hội thoại của mỗi phiên
+MAX_HISTORY_TURNS = 20
+# Số request Gradio được xử lý đồng thời (các phiên dùng chung retriever, vector store và LLM client)
+APP_CONCURRENCY_LIMIT = 8
+
+# HTTP API (api.py)
+API_HOST = "0.0.0.0"
+API_PORT = 8000
+# Số câu hỏi tối đa trong một request /ask/batch và số câu hỏi được xử lý đồng thời (giới hạn lượt gọi LLM song song)
+API_BATCH_MAX_QUESTIONS = 100
+API_BATCH_CONCURRENCY = 4
+# Số câu hỏi được xử lý đồng thời khi chạy batch_qa.py
+BATCH_QA_CONCURRENCY = 4
+
+
+# Semantic cache cho câu trả lời của Agent
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_SIZE = 256
+SEMANTIC_CACHE_TTL_SECONDS = 3600
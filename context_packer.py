@@ -0,0 +1,193 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """
+    Đếm token bằng tiktoken. Nếu không tải được encoding (ví dụ máy không có mạng để tải file BPE lần đầu)
+    thì ước lượng theo số ký tự để việc đóng gói ngữ cảnh vẫn hoạt động.
+    """
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self.encoding_name = encoding_name
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f" Không tải được tiktoken encoding '{encoding_name}': {e}. Ước lượng token theo số ký tự.")
+            self._encoding = None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is None:
+            return max(1, len(text) // 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cắt văn bản để còn tối đa `max_tokens` token"""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is None:
+            return text[:max_tokens * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens])
+
+
+class _Unit:
+    """Một đoạn ngữ cảnh đang được đóng gói: nội dung, metadata và thứ hạng tốt nhất khi truy xuất"""
+    __slots__ = ("content", "metadata", "rank", "doc_id")
+
+    def __init__(self, doc: Document, rank: int):
+        self.content = doc.page_content
+        self.metadata = dict(doc.metadata or {})
+        self.rank = rank
+        self.doc_id = getattr(doc, "id", None)
+
+    def structure_key(self) -> Tuple[str, int, int, int]:
+        metadata = self.metadata
+        return (str(metadata.get("source_file", "")), int(metadata.get("article") or 0),
+                int(metadata.get("part", 0) or 0), self.rank)
+
+    def same_article(self, other: "_Unit") -> bool:
+        return self.structure_key()[:2] == other.structure_key()[:2]
+
+    def to_document(self) -> Document:
+        return Document(page_content=self.content, metadata={**self.metadata, "retrieval_rank": self.rank},
+                        id=self.doc_id)
+
+
+def overlap_length(first: str, second: str, min_overlap: int) -> int:
+    """Độ dài phần cuối của `first` trùng với phần đầu của `second` (0 nếu ngắn hơn `min_overlap`)"""
+    if min_overlap <= 0 or len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    probe = second[:min_overlap]
+    start = max(0, len(first) - len(second))
+    position = first.find(probe, start)
+    while position != -1:
+        length = len(first) - position
+        if second.startswith(first[position:]):
+            return length
+        position = first.find(probe, position + 1)
+    return 0
+
+
+class ContextPacker:
+    """
+    Chuẩn bị ngữ cảnh cho LLM từ các tài liệu đã truy xuất (thường từ nhiều truy vấn viết lại):
+    1. Bỏ các chunk trùng lặp hoặc nằm trọn trong một chunk khác.
+    2. Ghép các chunk liền nhau của cùng một Điều có phần chồng lấn (CHUNK_OVERLAP khi chia nhỏ Điều dài).
+    3. Chọn các đoạn theo thứ hạng truy xuất cho đến khi hết ngân sách `token_budget`.
+    4. Sắp xếp các đoạn đã chọn theo cấu trúc văn bản luật (file nguồn, số Điều, thứ tự phần).
+    Số token tiết kiệm được so với cách nối toàn bộ tài liệu được log cho từng request và cộng dồn trong get_stats().
+    """
+    def __init__(self, token_budget: int = 3000, encoding_name: str = "cl100k_base", min_overlap_chars: int = 40,
+                 token_counter: Optional[TokenCounter] = None):
+        self.token_budget = token_budget
+        self.min_overlap_chars = min_overlap_chars
+        self.token_counter = token_counter or TokenCounter(encoding_name)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            'requests': 0, 'documents_in': 0, 'documents_out': 0, 'duplicates_removed': 0,
+            'overlaps_merged': 0, 'dropped_over_budget': 0, 'tokens_in': 0, 'tokens_out': 0, 'tokens_saved': 0,
+        }
+
+    def _deduplicate(self, docs: List[Document]) -> List[_Unit]:
+        """Bỏ chunk trùng nội dung hoặc nằm trọn trong chunk khác, giữ thứ hạng tốt nhất của chúng"""
+        units: List[_Unit] = []
+        seen = set()
+        for rank, doc in enumerate(docs):
+            content = doc.page_content.strip()
+            if not content or content in seen:
+                continue
+            seen.add(content)
+            unit = _Unit(doc, rank)
+            unit.content = content
+            units.append(unit)
+
+        # Xét chunk dài trước để chunk ngắn nằm trọn trong nó được gộp vào
+        kept: List[_Unit] = []
+        for unit in sorted(units, key=lambda u: len(u.content), reverse=True):
+            container = next((other for other in kept if unit.content in other.content), None)
+            if container is not None:
+                container.rank = min(container.rank, unit.rank)
+                continue
+            kept.append(unit)
+        return kept
+
+    def _merge_overlaps(self, units: List[_Unit]) -> Tuple[List[_Unit], int]:
+        """Ghép các chunk liên tiếp (theo cấu trúc) của cùng một Điều có đoạn chồng lấn"""
+        merged: List[_Unit] = []
+        merges = 0
+        for unit in sorted(units, key=_Unit.structure_key):
+            if merged and merged[-1].same_article(unit):
+                previous = merged[-1]
+                length = overlap_length(previous.content, unit.content, self.min_overlap_chars)
+                if length:
+                    previous.content += unit.content[length:]
+                    previous.rank = min(previous.rank, unit.rank)
+                    merges += 1
+                    continue
+            merged.append(unit)
+        return merged, merges
+
+    def _select(self, units: List[_Unit]) -> Tuple[List[_Unit], int]:
+        """Chọn các đoạn theo thứ hạng truy xuất cho đến khi hết ngân sách token"""
+        if self.token_budget <= 0:
+            return units, 0
+        separator_tokens = self.token_counter.count(CONTEXT_SEPARATOR)
+        selected = []
+        used = 0
+        for unit in sorted(units, key=lambda u: u.rank):
+            cost = self.token_counter.count(unit.content) + (separator_tokens if selected else 0)
+            if used + cost <= self.token_budget:
+                selected.append(unit)
+                used += cost
+            elif not selected:
+                # Đoạn liên quan nhất lớn hơn cả ngân sách: cắt bớt thay vì gửi ngữ cảnh rỗng
+                unit.content = self.token_counter.truncate(unit.content, self.token_budget)
+                selected.append(unit)
+                used = self.token_budget
+        return sorted(selected, key=_Unit.structure_key), len(units) - len(selected)
+
+    def pack(self, docs: List[Document]) -> List[Document]:
+        """Trả về danh sách tài liệu đã khử trùng lặp, sắp theo cấu trúc luật và nằm trong ngân sách token"""
+        with metrics.span("context.pack"):
+            return self._pack(docs)
+
+    def _pack(self, docs: List[Document]) -> List[Document]:
+        docs = list(docs or [])
+        if not docs:
+            return []
+        units = self._deduplicate(docs)
+        duplicates = len(docs) - len(units)
+        units, merges = self._merge_overlaps(units)
+        units, dropped = self._select(units)
+        packed = [unit.to_document() for unit in units]
+
+        tokens_in = self.token_counter.count(CONTEXT_SEPARATOR.join(doc.page_content for doc in docs))
+        tokens_out = self.token_counter.count(CONTEXT_SEPARATOR.join(doc.page_content for doc in packed))
+        saved = max(0, tokens_in - tokens_out)
+        metrics.registry.inc("rag_context_tokens_saved_total", saved)
+        with self._lock:
+            for key, value in (('requests', 1), ('documents_in', len(docs)), ('documents_out', len(packed)),
+                               ('duplicates_removed', duplicates), ('overlaps_merged', merges),
+                               ('dropped_over_budget', dropped), ('tokens_in', tokens_in),
+                               ('tokens_out', tokens_out), ('tokens_saved', saved)):
+                self._stats[key] += value
+        logger.info(f" Đóng gói ngữ cảnh: {len(docs)} đoạn / {tokens_in} tokens -> {len(packed)} đoạn / "
+                    f"{tokens_out} tokens (tiết kiệm {saved} tokens; {duplicates} trùng lặp, {merges} chồng lấn, "
+                    f"{dropped} vượt ngân sách {self.token_budget})")
+        return packed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
@@ -1,41 +1,159 @@
 import logging
-from typing import List, Dict, Any
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Any, Tuple
 from sentence_transformers import SentenceTransformer
 import numpy as np
+from langchain_core.embeddings import Embeddings
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_BACKENDS = ("torch", "onnx", "int8")
+
+
+def load_sentence_transformer(model_name: str, backend: str = "torch") -> SentenceTransformer:
+    """
+    Tải SentenceTransformer theo backend suy luận trên CPU:
+    - "torch": model gốc full-precision
+    - "onnx": chạy bằng ONNX Runtime (sentence-transformers >= 3.2 và optimum[onnxruntime]); tự export nếu model chưa có file ONNX
+    - "int8": model gốc với các lớp Linear được lượng tử hóa động sang int8 (torch.quantization.quantize_dynamic)
+    """
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    if backend == "int8":
+        import torch
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return SentenceTransformer(model_name)
+
+
 class EmbeddingGenerator:
     """Tạo vector embeddings từ văn bản"""
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, backend: str = "torch"):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"EMBEDDING_BACKEND không hợp lệ: '{backend}'. Chọn một trong {EMBEDDING_BACKENDS}.")
         try:
-            logger.info(f"Đang tải embedding model: {model_name}")
-            self.model = SentenceTransformer(model_name)
+            logger.info(f"Đang tải embedding model: {model_name} (backend: {backend})")
+            self.model = self._load_with_backend(model_name, backend)
             self.model_name = model_name
             self.vector_dimension = self.model.get_sentence_embedding_dimension()
             logger.info(f"Đã tải model '{model_name}' thành công. Dimension: {self.vector_dimension}")
         except Exception as e:
             logger.warning(f"Không thể tải model {model_name}. Lỗi: {e}. Đang chuyển sang model dự phòng.")
             fallback_model = "sentence-transformers/all-MiniLM-L6-v2"
-            self.model = SentenceTransformer(fallback_model)
+            self.model = self._load_with_backend(fallback_model, backend)
             self.model_name = fallback_model
             self.vector_dimension = self.model.get_sentence_embedding_dimension()
             logger.info(f"Đã tải model dự phòng: {fallback_model}")
 
-    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        if not texts: return []
+    def _load_with_backend(self, model_name: str, backend: str) -> SentenceTransformer:
+        """Tải model theo backend yêu cầu, quay về backend torch nếu backend tối ưu không dùng được"""
+        try:
+            model = load_sentence_transformer(model_name, backend)
+            self.backend = backend
+            return model
+        except Exception as e:
+            if backend == "torch":
+                raise
+            logger.warning(f"Không dùng được backend '{backend}' cho {model_name}: {e}. Dùng backend torch.")
+            self.backend = "torch"
+            return load_sentence_transformer(model_name, "torch")
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Encode và chuẩn hóa L2, trả về ma trận float32 (n, dim). Đây là đường encode duy nhất cho cả
+        lúc build knowledge base lẫn lúc truy vấn, nên hai phía luôn được chuẩn hóa giống nhau.
+        Ném lỗi nếu encode thất bại.
+        """
+        if not texts: return np.empty((0, self.vector_dimension), dtype=np.float32)
+        embeddings = self.model.encode(texts, show_progress_bar=show_progress_bar, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def create_embeddings(self, texts: List[str], show_progress_bar: bool = True) -> np.ndarray:
+        """
+        Trả về ma trận float32 (n, dim) đã chuẩn hóa. Giữ nguyên dạng NumPy để ghi thẳng vào
+        vector store, không chuyển sang list Python từng số thực.
+        """
+        if not texts: return np.empty((0, self.vector_dimension), dtype=np.float32)
         try:
             logger.info(f"Đang tạo embeddings cho {len(texts)} đoạn văn...")
-            embeddings = self.model.encode(texts, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True)
-            embeddings_list = embeddings.tolist()
-            logger.info(f"Đã tạo {len(embeddings_list)} embeddings")
-            return embeddings_list
+            embeddings = self.encode(texts, show_progress_bar=show_progress_bar)
+            logger.info(f"Đã tạo {len(embeddings)} embeddings")
+            return embeddings
         except Exception as e:
             logger.error(f"Lỗi khi tạo embeddings: {e}")
-            return []
+            return np.empty((0, self.vector_dimension), dtype=np.float32)
 
     def get_model_info(self) -> Dict[str, Any]:
         return {
             'model_name': self.model_name,
+            'backend': self.backend,
             'vector_dimension': self.vector_dimension
         }
+
+
+class EmbeddingService(Embeddings):
+    """
+    Embedding function của LangChain dùng chung EmbeddingGenerator với bước build knowledge base.
+    Các lời gọi embed_query đến gần như cùng lúc (trong `max_wait_ms`) từ nhiều thread được gom lại
+    thành một lần model.encode, tối đa `max_batch_size` truy vấn mỗi lần.
+    """
+    def __init__(self, generator: EmbeddingGenerator, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.generator = generator
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._requests: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats = {'queries': 0, 'batches': 0}
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[Tuple[str, Future]]):
+        try:
+            vectors = self.generator.encode([text for text, _ in batch])
+        except Exception as e:
+            logger.error(f"Lỗi khi encode {len(batch)} truy vấn: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self._stats['queries'] += len(batch)
+        self._stats['batches'] += 1
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector.tolist())
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['avg_batch_size'] = stats['queries'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.max_wait_ms <= 0:
+            return self.generator.encode([text])[0].tolist()
+        future: Future = Future()
+        self._ensure_worker()
+        self._requests.put((text, future))
+        return future.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.generator.encode(texts).tolist()
@@ -0,0 +1,62 @@
+import logging
+from typing import Dict, List, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+import metrics
+from bm25_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Document]], rrf_k: int = 60) -> List[Document]:
+    """Gộp nhiều danh sách kết quả đã xếp hạng bằng Reciprocal Rank Fusion: score = sum(1 / (rrf_k + rank))"""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, 1):
+            key = doc.page_content
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Kết hợp kết quả của retriever vector với BM25 index (từ vựng) bằng Reciprocal Rank Fusion,
+    giúp các câu hỏi phụ thuộc vào thuật ngữ chính xác ("dữ liệu dùng chung", "Điều 12")
+    tìm đúng đoạn luật mà không cần thêm lượt gọi LLM.
+    """
+    vector_retriever: BaseRetriever
+    bm25_index: BM25Index
+    top_k: int = 5
+    bm25_k: int = 10
+    rrf_k: int = 60
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _bm25_documents(self, query: str) -> List[Document]:
+        hits: List[Tuple[int, float]] = self.bm25_index.search(query, self.bm25_k)
+        return [
+            Document(page_content=self.bm25_index.documents[doc_idx],
+                     metadata={**self.bm25_index.metadatas[doc_idx], 'bm25_score': score})
+            for doc_idx, score in hits
+        ]
+
+    def _fuse(self, query: str, vector_docs: List[Document]) -> List[Document]:
+        with metrics.span("retrieval.bm25"):
+            bm25_docs = self._bm25_documents(query)
+        fused = reciprocal_rank_fusion([vector_docs, bm25_docs], rrf_k=self.rrf_k)[:self.top_k]
+        logger.info(f" Hybrid retrieval: {len(vector_docs)} vector + {len(bm25_docs)} BM25 -> {len(fused)} documents")
+        return fused
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(query, vector_docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_docs = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(query, vector_docs)
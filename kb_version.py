@@ -0,0 +1,26 @@
+import logging
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+KB_VERSION_FILE = "kb_version.txt"
+
+
+def read_kb_version(db_path: str) -> str:
+    """Đọc phiên bản hiện tại của knowledge base (chuỗi rỗng nếu chưa từng build)"""
+    try:
+        return (Path(db_path) / KB_VERSION_FILE).read_text(encoding='utf-8').strip()
+    except OSError:
+        return ""
+
+
+def bump_kb_version(db_path: str) -> str:
+    """Ghi phiên bản mới sau mỗi lần knowledge base thay đổi, để các cache phía truy vấn tự vô hiệu hóa"""
+    version = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = Path(db_path) / KB_VERSION_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(version, encoding='utf-8')
+    logger.info(f" Đã cập nhật phiên bản knowledge base: {version}")
+    return version
@@ -0,0 +1,237 @@
+import io
+import mmap
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Một dòng tiêu đề cấu trúc, nhận diện ở đầu dòng (sau khi chuẩn hóa khoảng trắng) bằng một regex duy nhất
+_HEADING_END = r'(?=\s*$|\s*[.:\-–])'
+BOUNDARY_PATTERN = re.compile(
+    r'(?P<law_part>(?:Phần|PHẦN)\s+(?:(?:thứ|THỨ)\s+\w+|[IVXLCDM]+|\d+)' + _HEADING_END + r')'
+    r'|(?P<chapter>(?:Chương|CHƯƠNG)\s+(?:[IVXLCDM]+|\d+)' + _HEADING_END + r')'
+    r'|(?P<section>(?:Mục|MỤC)\s+\d+\.)'
+    r'|(?P<article>Điều\s+(?P<article_number>\d+)\.\s*(?P<article_title>.*))'
+    r'|(?P<clause>(?P<clause_number>\d+)\.\s)'
+    r'|(?P<point>(?P<point_letter>[a-zđ])\)\s)'
+)
+_SPACES = re.compile(r'[ \t]+')
+
+
+def normalize_line(line: str) -> str:
+    """Gộp các khoảng trắng liên tiếp và bỏ khoảng trắng đầu/cuối dòng (chuỗi rỗng = dòng trống)"""
+    line = line.strip()
+    # Phần lớn các dòng không có khoảng trắng kép/tab, tránh chạy regex trên cả dòng
+    if "  " in line or "\t" in line:
+        line = _SPACES.sub(' ', line)
+    return line
+
+
+def iter_file_lines(file_path: str) -> Iterator[str]:
+    """Đọc lần lượt từng dòng của file UTF-8 qua memory map, không nạp cả file vào một chuỗi"""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            first = True
+            for raw in iter(mapped.readline, b""):
+                yield raw.decode('utf-8-sig' if first else 'utf-8')
+                first = False
+
+
+@dataclass
+class LawClause:
+    """Một Khoản; `points` là các Điểm dạng (chữ cái, vị trí dòng bắt đầu trong `lines`)"""
+    number: int
+    lines: List[str]
+    points: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def blocks(self) -> List[str]:
+        """Phần dẫn của Khoản và từng Điểm, dùng khi cả Khoản vượt giới hạn độ dài"""
+        starts = [0] + [start for _, start in self.points if start > 0] + [len(self.lines)]
+        return ["\n".join(self.lines[begin:end]) for begin, end in zip(starts, starts[1:]) if begin < end]
+
+
+@dataclass
+class LawUnit:
+    """
+    Một đơn vị cấu trúc của văn bản luật: một Điều, hoặc phần nội dung nằm ngay dưới tiêu đề
+    Phần/Chương/Mục (thường là tên của nó), hoặc phần mở đầu trước tiêu đề đầu tiên.
+    `lines` là các dòng trước Khoản đầu tiên; nội dung các Khoản nằm trong `clauses`.
+    """
+    heading: str = ""
+    law_part: str = ""
+    chapter: str = ""
+    section: str = ""
+    article: int = 0
+    article_title: str = ""
+    lines: List[str] = field(default_factory=list)
+    clauses: List[LawClause] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        """Đường dẫn cấu trúc, ví dụ "Chương III > Mục 1 > Điều 30" """
+        article = f"Điều {self.article}" if self.article else ""
+        return " > ".join(part for part in (self.law_part, self.chapter, self.section, article) if part)
+
+    @property
+    def content(self) -> str:
+        return "\n".join(([self.heading] if self.heading else []) + self.lines +
+                         [clause.text for clause in self.clauses])
+
+    def has_body(self) -> bool:
+        return bool(self.lines or self.clauses)
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "heading": self.heading,
+            "law_part": self.law_part,
+            "chapter": self.chapter,
+            "section": self.section,
+            "article": self.article,
+            "article_title": self.article_title,
+            "path": self.path,
+        }
+
+    def clause_numbers(self) -> List[int]:
+        return [clause.number for clause in self.clauses]
+
+    def blocks(self, max_chars: int) -> Iterator[Tuple[int, str]]:
+        """
+        Các khối nội dung theo ranh giới Khoản, rồi Điểm, rồi khoảng trắng, mỗi khối không dài quá `max_chars`,
+        kèm số Khoản chứa khối đó (0 = phần dẫn trước Khoản 1)
+        """
+        if self.lines:
+            lead = "\n".join(self.lines)
+            yield from ((0, block) for block in ([lead] if len(lead) <= max_chars else _fit(self.lines, max_chars)))
+        for clause in self.clauses:
+            text = clause.text
+            blocks = [text] if len(text) <= max_chars else _fit(clause.blocks(), max_chars)
+            yield from ((clause.number, block) for block in blocks)
+
+    def split(self, max_chars: int) -> List[Tuple[List[int], str]]:
+        """
+        Chia một đơn vị quá dài thành các phần không vượt `max_chars`: gộp liên tiếp các khối theo Khoản/Điểm,
+        mỗi phần bắt đầu bằng dòng tiêu đề (ví dụ "Điều 3. Giải thích từ ngữ") để vẫn đọc được độc lập.
+        Trả về (các số Khoản có trong phần, nội dung).
+        """
+        prefix = f"{self.heading}\n" if self.heading else ""
+        budget = max(max_chars - len(prefix), max_chars // 2)
+        return [(clauses, prefix + part) for clauses, part in _pack(self.blocks(budget), budget)]
+
+    def children(self, max_chars: int) -> List[Tuple[int, str]]:
+        """
+        Các đoạn con cấp Khoản của một Điều: (số Khoản, nội dung), số Khoản 0 là phần dẫn trước Khoản 1.
+        Khoản dài hơn `max_chars` được chia theo Điểm (và khoảng trắng nếu một Điểm vẫn quá dài).
+        """
+        children = []
+        if self.lines:
+            children.extend((0, part) for _, part in _pack(((0, block) for block in _fit(self.lines, max_chars)),
+                                                           max_chars))
+        for clause in self.clauses:
+            text = clause.text
+            if len(text) <= max_chars:
+                children.append((clause.number, text))
+            else:
+                blocks = ((clause.number, block) for block in _fit(clause.blocks(), max_chars))
+                children.extend((clause.number, part) for _, part in _pack(blocks, max_chars))
+        return children
+
+
+def format_clauses(numbers: Iterable[int]) -> str:
+    """Danh sách số Khoản dạng "1,2,3" để lưu trong metadata (Chroma không nhận giá trị list)"""
+    return ",".join(str(number) for number in numbers)
+
+
+def _pack(blocks: Iterable[Tuple[int, str]], max_chars: int) -> List[Tuple[List[int], str]]:
+    """
+    Gộp liên tiếp các khối (số Khoản, nội dung), mỗi khối không dài quá `max_chars`, thành các phần dài nhất
+    có thể; trả về (các số Khoản khác 0 có trong phần, nội dung)
+    """
+    parts, current, numbers, current_length = [], [], [], 0
+    for number, block in blocks:
+        if current and current_length + 1 + len(block) > max_chars:
+            parts.append((numbers, "\n".join(current)))
+            current, numbers, current_length = [], [], 0
+        current_length += len(block) + (1 if current else 0)
+        current.append(block)
+        if number and number not in numbers:
+            numbers.append(number)
+    if current:
+        parts.append((numbers, "\n".join(current)))
+    return parts
+
+
+def _fit(blocks: Iterable[str], max_chars: int) -> Iterator[str]:
+    for block in blocks:
+        if len(block) <= max_chars:
+            yield block
+        else:
+            yield from split_long_text(block, max_chars)
+
+
+def split_long_text(text: str, max_chars: int) -> Iterator[str]:
+    """Cắt đoạn văn không có ranh giới cấu trúc tại khoảng trắng gần nhất trước `max_chars`"""
+    start = 0
+    while len(text) - start > max_chars:
+        end = text.rfind(" ", start, start + max_chars + 1)
+        if end <= start:
+            end = start + max_chars
+        yield text[start:end].strip()
+        start = end
+    if text[start:].strip():
+        yield text[start:].strip()
+
+
+class LawStructureParser:
+    """
+    Parser một lượt cho văn bản luật: đọc lần lượt từng dòng, chuẩn hóa khoảng trắng và nhận diện ranh giới
+    Phần/Chương/Mục/Điều/Khoản/Điểm bằng một regex biên dịch sẵn, trả về lần lượt từng LawUnit ngay khi
+    gặp tiêu đề kế tiếp. Chi phí tuyến tính theo độ dài văn bản, bộ nhớ chỉ phụ thuộc độ dài một Điều.
+    """
+    def parse(self, lines: Iterable[str]) -> Iterator[LawUnit]:
+        law_part = chapter = section = ""
+        current = LawUnit()
+        for raw_line in lines:
+            line = normalize_line(raw_line)
+            if not line:
+                continue
+            match = BOUNDARY_PATTERN.match(line)
+            kind = match.lastgroup if match else None
+
+            if kind in ("law_part", "chapter", "section", "article"):
+                if current.has_body():
+                    yield current
+                if kind == "law_part":
+                    law_part, chapter, section = match.group("law_part"), "", ""
+                elif kind == "chapter":
+                    chapter, section = match.group("chapter"), ""
+                elif kind == "section":
+                    section = line
+                current = LawUnit(heading=line, law_part=law_part, chapter=chapter, section=section)
+                if kind == "article":
+                    current.article = int(match.group("article_number"))
+                    current.article_title = match.group("article_title").strip()
+            elif kind == "clause" and current.article:
+                current.clauses.append(LawClause(int(match.group("clause_number")), [line]))
+            elif kind == "point" and current.clauses:
+                clause = current.clauses[-1]
+                clause.points.append((match.group("point_letter"), len(clause.lines)))
+                clause.lines.append(line)
+            elif current.clauses:
+                current.clauses[-1].lines.append(line)
+            else:
+                current.lines.append(line)
+
+        if current.has_body():
+            yield current
+
+    def parse_file(self, file_path: str) -> Iterator[LawUnit]:
+        return self.parse(iter_file_lines(file_path))
+
+    def parse_text(self, text: str) -> Iterator[LawUnit]:
+        return self.parse(io.StringIO(text))
@@ -1,156 +1,394 @@
 import re
+import copy
+import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, NamedTuple, Tuple, AsyncIterator
+
+import metrics
+from llm_scheduler import is_rate_limit_error
 
 logger = logging.getLogger(__name__)
 
+
+class SubQuery(NamedTuple):
+    """Một truy vấn con của Agent; nếu có `articles` thì lấy trực tiếp các Điều đó thay vì vector search"""
+    heading: str
+    query: str
+    articles: Tuple[int, ...] = ()
+
+
 class SimpleLegalAgent:
     """
     Phiên bản đơn giản hóa của Legal Agent với xử lý lỗi tốt hơn
     """
-    def __init__(self, retriever, llm, rag_chain):
+    def __init__(self, retriever, llm, rag_chain, max_concurrent_subqueries: int = 3, answer_cache=None,
+                 article_index=None, answer_chain=None, max_history_turns: int = 20, callbacks=None):
         self.retriever = retriever
         self.llm = llm
         self.rag_chain = rag_chain
+        self.max_concurrent_subqueries = max(1, max_concurrent_subqueries)
+        self.answer_cache = answer_cache
+        self.article_index = article_index
+        self.answer_chain = answer_chain
+        self.max_history_turns = max_history_turns
+        # Callback LangChain (ví dụ metrics.MetricsCallbackHandler) truyền cho mọi lượt gọi chain
+        self.run_config = {"callbacks": list(callbacks)} if callbacks else None
         self.conversation_history = []  
 
         logger.info("Simple Legal Agent đã được khởi tạo thành công!")
 
+    def new_session(self) -> "SimpleLegalAgent":
+        """
+        Tạo Agent cho một phiên hội thoại (mỗi người dùng): dùng chung retriever, LLM, chain, cache
+        và index với Agent gốc, chỉ có lịch sử hội thoại là riêng.
+        """
+        session = copy.copy(self)
+        session.conversation_history = []
+        return session
+
+    def _remember(self, role: str, content: str):
+        """Ghi vào lịch sử hội thoại, chỉ giữ lại `max_history_turns` lượt hỏi-đáp gần nhất"""
+        self.conversation_history.append({"role": role, "content": content})
+        max_entries = 2 * self.max_history_turns
+        if max_entries > 0 and len(self.conversation_history) > max_entries:
+            del self.conversation_history[:-max_entries]
+
+    def _extract_sources(self, docs) -> List[str]:
+        """Lấy trích dẫn "Điều N" từ các tài liệu đã dùng làm ngữ cảnh"""
+        sources = []
+        # Ngữ cảnh đã đóng gói được sắp theo cấu trúc luật; trích dẫn vẫn ưu tiên các đoạn liên quan nhất
+        ranked = sorted(enumerate(docs), key=lambda item: (item[1].metadata or {}).get("retrieval_rank", item[0]))
+        for _, doc in ranked[:2]:
+            article = doc.metadata.get("article") if doc.metadata else None
+            if article:
+                sources.append(f"Điều {article}")
+                continue
+            content = doc.page_content[:100]
+            if "Điều" in content:
+                match = re.search(r'Điều \d+', content)
+                if match:
+                    sources.append(match.group())
+        return list(dict.fromkeys(sources))
+
+    def _format_sources(self, docs) -> str:
+        sources = self._extract_sources(docs)
+        return f"\n\nNguồn: {', '.join(sources)}" if sources else ""
+
+    def _format_answer(self, output: Dict[str, Any]) -> str:
+        # Thêm source citation từ chính các tài liệu chain đã dùng làm ngữ cảnh
+        return output["answer"] + self._format_sources(output["context"])
+
+    @staticmethod
+    def _rate_limited_message(error: Exception) -> str:
+        # Quota LLM đã cạn sau khi bộ lập lịch retry: phương thức dự phòng cũng gọi LLM nên chỉ làm 429 trầm trọng hơn
+        message = f"Xin lỗi, hệ thống đang vượt giới hạn gọi LLM ({error}). Vui lòng thử lại sau ít phút."
+        print(message)
+        return message
+
     def search_documents(self, query: str) -> str:
         """Tìm kiếm cơ bản trong tài liệu"""
         try:
             logger.info(f"Tìm kiếm: {query}")
-            result = self.rag_chain.invoke(query)
-
-            # Thêm source citation
-            docs = self.retriever.invoke(query)
-            sources = []
-            for i, doc in enumerate(docs[:2], 1):
-                content = doc.page_content[:100]
-                if "Điều" in content:
-                    match = re.search(r'Điều \d+', content)
-                    if match:
-                        sources.append(match.group())
+            return self._format_answer(self.rag_chain.invoke(query, config=self.run_config))
+        except Exception as e:
+            return f"Lỗi khi tìm kiếm: {str(e)}"
 
-            if sources:
-                result += f"\n\nNguồn: {', '.join(sources)}"
+    async def asearch_documents(self, query: str) -> str:
+        """Phiên bản bất đồng bộ của search_documents"""
+        try:
+            logger.info(f"Tìm kiếm: {query}")
+            return self._format_answer(await self.rag_chain.ainvoke(query, config=self.run_config))
+        except Exception as e:
+            return f"Lỗi khi tìm kiếm: {str(e)}"
+
+    def _article_inputs(self, question: str, articles: Tuple[int, ...]) -> Dict[str, Any]:
+        with metrics.span("retrieval.article_lookup"):
+            source = self.article_index.resolve_source(articles, question)
+            docs = self.article_index.get_documents(list(articles), source) if source is not None else []
+        logger.info(f"Tra cứu trực tiếp {', '.join(f'Điều {a}' for a in articles)} của '{source}' "
+                    f"({len(docs)} chunks), bỏ qua vector search")
+        return {"context": docs, "question": question}
+
+    def answer_from_articles(self, question: str, articles: Tuple[int, ...]) -> str:
+        """Trả lời dựa trên nội dung các Điều được lấy trực tiếp từ article index"""
+        try:
+            inputs = self._article_inputs(question, articles)
+            return self._format_answer({**inputs, "answer": self.answer_chain.invoke(inputs, config=self.run_config)})
+        except Exception as e:
+            return f"Lỗi khi tìm kiếm: {str(e)}"
 
-            return result
+    async def aanswer_from_articles(self, question: str, articles: Tuple[int, ...]) -> str:
+        try:
+            inputs = self._article_inputs(question, articles)
+            return self._format_answer({**inputs, "answer": await self.answer_chain.ainvoke(inputs, config=self.run_config)})
         except Exception as e:
             return f"Lỗi khi tìm kiếm: {str(e)}"
 
+    def _find_indexed_articles(self, question: str) -> Tuple[int, ...]:
+        """
+        Các Điều được nhắc tên trong câu hỏi và có trong article index, chỉ khi xác định được một văn bản duy nhất
+        chứa chúng (hoặc văn bản được nêu tên trong câu hỏi); số Điều mơ hồ giữa nhiều văn bản dùng vector search
+        """
+        if self.article_index is None or self.answer_chain is None:
+            return ()
+        numbers = [int(n) for n in re.findall(r'điều\s+(\d+)', question, re.IGNORECASE)]
+        articles = tuple(n for n in dict.fromkeys(numbers) if n in self.article_index)
+        if articles and self.article_index.resolve_source(articles, question) is None:
+            logger.info(f"{', '.join(f'Điều {a}' for a in articles)} có trong nhiều văn bản, dùng vector search")
+            return ()
+        return articles
+
+    def _run_sub_query(self, sub_query: SubQuery) -> str:
+        if sub_query.articles:
+            return self.answer_from_articles(sub_query.query, sub_query.articles)
+        return self.search_documents(sub_query.query)
+
+    async def _arun_sub_query(self, sub_query: SubQuery) -> str:
+        if sub_query.articles:
+            return await self.aanswer_from_articles(sub_query.query, sub_query.articles)
+        return await self.asearch_documents(sub_query.query)
+
+    async def _astream_sub_query(self, sub_query: SubQuery) -> AsyncIterator[str]:
+        """Stream từng token câu trả lời của một truy vấn con, trích dẫn nguồn được thêm vào cuối"""
+        try:
+            if sub_query.articles:
+                inputs = self._article_inputs(sub_query.query, sub_query.articles)
+                context = inputs["context"]
+                async for token in self.answer_chain.astream(inputs, config=self.run_config):
+                    yield token
+            else:
+                logger.info(f"Tìm kiếm: {sub_query.query}")
+                context = []
+                async for chunk in self.rag_chain.astream(sub_query.query, config=self.run_config):
+                    if "context" in chunk:
+                        context = chunk["context"]
+                    if chunk.get("answer"):
+                        yield chunk["answer"]
+
+            sources = self._format_sources(context)
+            if sources:
+                yield sources
+        except Exception as e:
+            yield f"Lỗi khi tìm kiếm: {str(e)}"
+
+    def _classify_question(self, question: str) -> str:
+        """Phân loại câu hỏi theo từ khóa"""
+        question_lower = question.lower()
+
+        if any(word in question_lower for word in ["so sánh", "khác biệt", "giống", "khác nhau"]):
+            return "comparison"
+        elif any(word in question_lower for word in ["định nghĩa", "là gì", "có nghĩa", "khái niệm"]):
+            return "definition"
+        elif any(word in question_lower for word in ["vi phạm", "phạt", "hậu quả", "trách nhiệm"]):
+            return "compliance"
+        elif any(word in question_lower for word in ["điều", "khoản", "quy định"]):
+            return "article"
+        else:
+            return "general"
+
+    def _plan_sub_queries(self, question: str) -> List[SubQuery]:
+        """
+        Lập danh sách truy vấn con theo loại câu hỏi.
+        Truy vấn đầu tiên luôn là câu hỏi gốc và có tiêu đề rỗng; nếu câu hỏi nêu rõ Điều có trong article index
+        thì truy vấn này lấy trực tiếp các Điều đó (với mọi loại câu hỏi), các truy vấn bổ sung vẫn dùng vector search.
+        """
+        planners = {
+            "comparison": self._plan_comparison_question,
+            "definition": self._plan_definition_question,
+            "compliance": self._plan_compliance_question,
+            "article": self._plan_article_question,
+            "general": self._plan_general_question,
+        }
+        category = self._classify_question(question)
+        metrics.set_handler(category)
+        with metrics.span("agent.plan"):
+            sub_queries = planners[category](question)
+            articles = self._find_indexed_articles(question)
+            if articles and not sub_queries[0].articles:
+                sub_queries[0] = sub_queries[0]._replace(articles=articles)
+            return sub_queries
+
+    def planned_queries(self, question: str) -> List[str]:
+        """Các truy vấn sẽ được embed khi trả lời câu hỏi (câu hỏi gốc và các truy vấn con cần vector search)"""
+        try:
+            sub_queries = self._plan_sub_queries(question)
+        except Exception:
+            sub_queries = []
+        return list(dict.fromkeys([question] + [sq.query for sq in sub_queries if not sq.articles]))
+
+    def _merge_results(self, sub_queries: List[SubQuery], results: List[str]) -> str:
+        """Ghép kết quả các truy vấn con theo đúng thứ tự đã lập"""
+        result = results[0]
+        for sub_query, info in zip(sub_queries[1:], results[1:]):
+            if "không tìm thấy" not in info.lower():
+                result += f"{sub_query.heading}{info}"
+        return result
+
+    def _run_sub_queries(self, sub_queries: List[SubQuery]) -> str:
+        """Chạy tuần tự các truy vấn con"""
+        results = [self._run_sub_query(sub_query) for sub_query in sub_queries]
+        return self._merge_results(sub_queries, results)
+
+    async def _arun_sub_queries(self, sub_queries: List[SubQuery]) -> str:
+        """Chạy đồng thời các truy vấn con, giới hạn bởi max_concurrent_subqueries"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_subqueries)
+
+        async def run(sub_query: SubQuery) -> str:
+            async with semaphore:
+                return await self._arun_sub_query(sub_query)
+
+        results = await asyncio.gather(*(run(sub_query) for sub_query in sub_queries))
+        return self._merge_results(sub_queries, list(results))
+
+    async def _astream_sub_queries(self, sub_queries: List[SubQuery]) -> AsyncIterator[str]:
+        """
+        Stream truy vấn chính token theo token trong khi các truy vấn con còn lại chạy song song;
+        mỗi phần bổ sung được phát ra ngay khi nó (và các phần đứng trước) hoàn thành, theo thứ tự đã lập.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_subqueries)
+
+        async def run(sub_query: SubQuery) -> str:
+            async with semaphore:
+                return await self._arun_sub_query(sub_query)
+
+        tasks = [asyncio.create_task(run(sub_query)) for sub_query in sub_queries[1:]]
+        try:
+            async with semaphore:
+                async for chunk in self._astream_sub_query(sub_queries[0]):
+                    yield chunk
+
+            for sub_query, task in zip(sub_queries[1:], tasks):
+                info = await task
+                if "không tìm thấy" not in info.lower():
+                    yield f"{sub_query.heading}{info}"
+        finally:
+            for task in tasks:
+                task.cancel()
+
     def analyze_question_and_respond(self, question: str) -> str:
         """Phân tích câu hỏi và đưa ra phản hồi thông minh"""
         try:
             logger.info(f"Phân tích câu hỏi: {question}")
+            return self._run_sub_queries(self._plan_sub_queries(question))
 
-            # Phân loại loại câu hỏi
-            question_lower = question.lower()
-
-            if any(word in question_lower for word in ["so sánh", "khác biệt", "giống", "khác nhau"]):
-                return self._handle_comparison_question(question)
-            elif any(word in question_lower for word in ["định nghĩa", "là gì", "có nghĩa", "khái niệm"]):
-                return self._handle_definition_question(question)
-            elif any(word in question_lower for word in ["vi phạm", "phạt", "hậu quả", "trách nhiệm"]):
-                return self._handle_compliance_question(question)
-            elif any(word in question_lower for word in ["điều", "khoản", "quy định"]):
-                return self._handle_article_question(question)
-            else:
-                return self._handle_general_question(question)
+        except Exception as e:
+            logger.error(f"Lỗi khi phân tích câu hỏi: {e}")
+            if is_rate_limit_error(e):
+                raise
+            with metrics.span("agent.fallback_search"):
+                return self.search_documents(question)
+
+    async def aanalyze_question_and_respond(self, question: str) -> str:
+        """Phiên bản bất đồng bộ: các truy vấn con độc lập được chạy song song"""
+        try:
+            logger.info(f"Phân tích câu hỏi: {question}")
+            return await self._arun_sub_queries(self._plan_sub_queries(question))
 
         except Exception as e:
             logger.error(f"Lỗi khi phân tích câu hỏi: {e}")
-            return self.search_documents(question)  
+            if is_rate_limit_error(e):
+                raise
+            with metrics.span("agent.fallback_search"):
+                return await self.asearch_documents(question)
 
-    def _handle_definition_question(self, question: str) -> str:
+    def _plan_definition_question(self, question: str) -> List[SubQuery]:
         """Xử lý câu hỏi về định nghĩa"""
         logger.info("Xử lý câu hỏi định nghĩa")
-        result = self.search_documents(question)
+        sub_queries = [SubQuery("", question)]
 
         # Tìm thêm thông tin liên quan
         if "định nghĩa" not in question.lower():
-            extended_query = f"định nghĩa {question}"
-            additional_info = self.search_documents(extended_query)
-            if "không tìm thấy" not in additional_info.lower():
-                result += f"\n\n📖 THÔNG TIN Bổ SUNG:\n{additional_info}"
+            sub_queries.append(SubQuery("\n\n📖 THÔNG TIN Bổ SUNG:\n", f"định nghĩa {question}"))
 
-        return result
+        return sub_queries
 
-    def _handle_comparison_question(self, question: str) -> str:
+    def _plan_comparison_question(self, question: str) -> List[SubQuery]:
         """Xử lý câu hỏi so sánh"""
         logger.info("Xử lý câu hỏi so sánh")
 
         # Tìm kiếm thông tin chung trước
-        result = self.search_documents(question)
+        sub_queries = [SubQuery("", question)]
 
         # Tìm từng khái niệm riêng lẻ
         words = question.split()
         concepts = [word for word in words if len(word) > 3 and word not in ['giữa', 'với', 'và', 'của', 'trong']]
 
-        additional_info = ""
         for concept in concepts[:2]:  
-            concept_query = f"định nghĩa {concept}"
-            concept_info = self.search_documents(concept_query)
-            if "không tìm thấy" not in concept_info.lower():
-                additional_info += f"\n\n VỀ '{concept.upper()}':\n{concept_info}"
+            sub_queries.append(SubQuery(f"\n\n VỀ '{concept.upper()}':\n", f"định nghĩa {concept}"))
 
-        if additional_info:
-            result += additional_info
-
-        return result
+        return sub_queries
 
-    def _handle_compliance_question(self, question: str) -> str:
+    def _plan_compliance_question(self, question: str) -> List[SubQuery]:
         """Xử lý câu hỏi về tuân thủ"""
         logger.info(" Xử lý câu hỏi tuân thủ")
 
-        # Tìm quy định
-        result = self.search_documents(question)
+        # Tìm quy định và hậu quả vi phạm
+        return [
+            SubQuery("", question),
+            SubQuery("\n\n HẬU QUẢ VI PHẠM:\n", f"hình phạt vi phạm {question}"),
+        ]
 
-        # Tìm hậu quả vi phạm
-        violation_query = f"hình phạt vi phạm {question}"
-        violation_info = self.search_documents(violation_query)
-        if "không tìm thấy" not in violation_info.lower():
-            result += f"\n\n HẬU QUẢ VI PHẠM:\n{violation_info}"
-
-        return result
-
-    def _handle_article_question(self, question: str) -> str:
+    def _plan_article_question(self, question: str) -> List[SubQuery]:
         """Xử lý câu hỏi về điều khoản cụ thể"""
         logger.info(" Xử lý câu hỏi về điều khoản")
 
-        result = self.search_documents(question)
+        # Câu hỏi nêu rõ Điều có trong article index: lấy trực tiếp, không cần vector search/viết lại truy vấn
+        articles = self._find_indexed_articles(question)
+        if articles:
+            return [SubQuery("", question, articles)]
+
+        sub_queries = [SubQuery("", question)]
 
         # Tìm điều khoản liên quan
         article_match = re.search(r'Điều \d+', question)
         if article_match:
             article = article_match.group()
-            related_query = f"điều khoản liên quan {article}"
-            related_info = self.search_documents(related_query)
-            if "không tìm thấy" not in related_info.lower():
-                result += f"\n\n ĐIỀU KHOẢN LIÊN QUAN:\n{related_info}"
+            sub_queries.append(SubQuery("\n\n ĐIỀU KHOẢN LIÊN QUAN:\n", f"điều khoản liên quan {article}"))
 
-        return result
+        return sub_queries
 
-    def _handle_general_question(self, question: str) -> str:
+    def _plan_general_question(self, question: str) -> List[SubQuery]:
         """Xử lý câu hỏi chung"""
         logger.info(" Xử lý câu hỏi chung")
-        return self.search_documents(question)
+        return [SubQuery("", question)]
+
+    def _cached_answer(self, question: str):
+        """Tra semantic cache, ghi nhận cache hit/miss vào metrics"""
+        if not self.answer_cache:
+            return None
+        with metrics.span("cache.answer_lookup"):
+            answer = self.answer_cache.get(question)
+        metrics.record_cache("answer", answer is not None)
+        if answer is not None:
+            metrics.set_handler("cached")
+        return answer
+
+    def _cache_answer(self, question: str, answer: str):
+        """Lưu câu trả lời vào semantic cache, bỏ qua các câu trả lời lỗi"""
+        if self.answer_cache and "Lỗi khi tìm kiếm" not in answer:
+            self.answer_cache.put(question, answer)
 
     def ask(self, question: str) -> str:
         """Phương thức chính để hỏi Agent"""
+        with metrics.trace():
+            return self._ask(question)
+
+    def _ask(self, question: str) -> str:
         try:
             print(f"\nAgent đang xử lý câu hỏi: '{question}'")
             print("Đang phân tích và tìm kiếm thông tin...")
             print("-" * 60)
 
             
-            self.conversation_history.append({"role": "user", "content": question})
+            self._remember("user", question)
 
-            
-            answer = self.analyze_question_and_respond(question)
+            answer = self._cached_answer(question)
+            if answer is None:
+                answer = self.analyze_question_and_respond(question)
+                self._cache_answer(question, answer)
 
            
-            self.conversation_history.append({"role": "assistant", "content": answer})
+            self._remember("assistant", answer)
 
             print("\n" + "="*60)
             print("KẾT QUẢ TƯ VẤN PHÁP LÝ")
@@ -161,12 +399,59 @@ class SimpleLegalAgent:
             return answer
 
         except Exception as e:
+            if is_rate_limit_error(e):
+                return self._rate_limited_message(e)
             error_msg = f"Xin lỗi, có lỗi xảy ra: {str(e)}. Đang thử phương thức dự phòng..."
             print(f"{error_msg}")
 
             # Fallback: Sử dụng RAG chain trực tiếp
             try:
-                fallback_answer = self.search_documents(question)
+                with metrics.span("agent.fallback_search"):
+                    fallback_answer = self.search_documents(question)
+                print(f"\nKết quả dự phòng:\n{fallback_answer}")
+                return fallback_answer
+            except Exception as fallback_error:
+                final_error = f"Không thể xử lý câu hỏi: {str(fallback_error)}"
+                print(f"{final_error}")
+                return final_error
+
+    async def aask(self, question: str) -> str:
+        """Phiên bản bất đồng bộ của ask: các truy vấn con được chạy song song"""
+        with metrics.trace():
+            return await self._aask(question)
+
+    async def _aask(self, question: str) -> str:
+        try:
+            print(f"\nAgent đang xử lý câu hỏi: '{question}'")
+            print("Đang phân tích và tìm kiếm thông tin...")
+            print("-" * 60)
+
+            self._remember("user", question)
+
+            answer = await asyncio.to_thread(self._cached_answer, question)
+            if answer is None:
+                answer = await self.aanalyze_question_and_respond(question)
+                await asyncio.to_thread(self._cache_answer, question, answer)
+
+            self._remember("assistant", answer)
+
+            print("\n" + "="*60)
+            print("KẾT QUẢ TƯ VẤN PHÁP LÝ")
+            print("="*60)
+            print(answer)
+            print("="*60)
+
+            return answer
+
+        except Exception as e:
+            if is_rate_limit_error(e):
+                return self._rate_limited_message(e)
+            error_msg = f"Xin lỗi, có lỗi xảy ra: {str(e)}. Đang thử phương thức dự phòng..."
+            print(f"{error_msg}")
+
+            try:
+                with metrics.span("agent.fallback_search"):
+                    fallback_answer = await self.asearch_documents(question)
                 print(f"\nKết quả dự phòng:\n{fallback_answer}")
                 return fallback_answer
             except Exception as fallback_error:
@@ -174,6 +459,45 @@ class SimpleLegalAgent:
                 print(f"{final_error}")
                 return final_error
 
+    async def astream_ask(self, question: str) -> AsyncIterator[str]:
+        """
+        Phiên bản streaming của aask: trả về từng đoạn câu trả lời ngay khi có.
+        Ghép các đoạn lại sẽ được đúng câu trả lời mà aask trả về.
+        """
+        with metrics.trace():
+            async for chunk in self._astream_ask(question):
+                yield chunk
+
+    async def _astream_ask(self, question: str) -> AsyncIterator[str]:
+        self._remember("user", question)
+        parts = []
+        try:
+            answer = await asyncio.to_thread(self._cached_answer, question)
+            if answer is not None:
+                parts.append(answer)
+                yield answer
+            else:
+                try:
+                    logger.info(f"Phân tích câu hỏi: {question}")
+                    sub_queries = self._plan_sub_queries(question)
+                except Exception as e:
+                    logger.error(f"Lỗi khi phân tích câu hỏi: {e}")
+                    sub_queries = [SubQuery("", question)]
+
+                async for chunk in self._astream_sub_queries(sub_queries):
+                    parts.append(chunk)
+                    yield chunk
+                await asyncio.to_thread(self._cache_answer, question, "".join(parts))
+
+        except Exception as e:
+            error_msg = f"Xin lỗi, có lỗi xảy ra: {str(e)}"
+            logger.error(error_msg)
+            parts.append(error_msg)
+            yield error_msg
+
+        finally:
+            self._remember("assistant", "".join(parts))
+
     def ask_multiple_followup(self, main_question: str, followup_questions: List[str]) -> Dict[str, str]:
         """Hỏi một câu chính và nhiều câu hỏi phụ"""
         results = {}
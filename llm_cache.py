@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_MODES = ("off", "on", "record", "replay")
+# Các tham số sinh của model được đưa vào khóa cache (đổi tham số thì không dùng lại phản hồi cũ)
+GENERATION_PARAM_KEYS = ("temperature", "max_tokens", "top_p", "n", "seed", "stop", "response_format")
+
+
+# Đánh dấu phản hồi lấy từ cache trong response_metadata, để callback số liệu không tính là một lượt gọi LLM
+CACHE_HIT_METADATA = {"llm_cache_hit": True}
+
+
+def is_cached_response(message) -> bool:
+    return bool((getattr(message, "response_metadata", None) or {}).get("llm_cache_hit"))
+
+
+class LLMCacheMissError(RuntimeError):
+    """Chế độ replay: prompt chưa từng được ghi lại nên không có phản hồi để trả về"""
+
+
+class LLMResponseStore:
+    """
+    Kho phản hồi LLM trên đĩa (SQLite), mỗi bản ghi được đánh địa chỉ bằng hash nội dung của
+    model + tham số sinh + prompt. Khi tổng kích thước vượt `max_bytes`, xóa các bản ghi
+    lâu nhất chưa được dùng (LRU theo thời điểm truy cập cuối).
+    """
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, response: Dict[str, Any]):
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, model, data, size, now, now)
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    return
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {'path': str(self.path), 'entries': entries, 'bytes': self._total_bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+def _message_payload(message: BaseMessage) -> List[Any]:
+    return [message.type, message.content]
+
+
+class CachedChatModel(BaseChatModel):
+    """
+    Bọc một chat model: phản hồi được tra trong LLMResponseStore trước khi gọi model thật.
+    Khóa cache = sha256(model_name, tham số sinh, danh sách message, stop). Các chế độ:
+    - "on": dùng phản hồi đã lưu nếu có, nếu không thì gọi model và lưu lại
+    - "record": luôn gọi model và ghi đè phản hồi đã lưu (ghi lại một phiên mới)
+    - "replay": chỉ dùng phản hồi đã ghi, prompt chưa có sẽ gây LLMCacheMissError (không gọi mạng)
+    Áp dụng cho cả invoke, ainvoke lẫn stream/astream; khi trúng cache, phản hồi được trả về trong một chunk.
+    """
+    llm: BaseChatModel
+    store: LLMResponseStore
+    model_name: str
+    mode: str = "on"
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "cache_mode": self.mode, **self._generation_params()}
+
+    def _generation_params(self) -> Dict[str, Any]:
+        params = getattr(self.llm, "_identifying_params", {}) or {}
+        return {key: params[key] for key in GENERATION_PARAM_KEYS if params.get(key) is not None}
+
+    def cache_key(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        payload = {
+            "model": self.model_name,
+            "params": self._generation_params(),
+            "messages": [_message_payload(message) for message in messages],
+            "stop": stop,
+            "kwargs": kwargs,
+        }
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if self.mode == "record":
+            return None
+        response = self.store.get(key)
+        metrics.record_cache("llm_response", response is not None)
+        if response is None and self.mode == "replay":
+            raise LLMCacheMissError(f"Không có phản hồi đã ghi cho prompt (key {key[:12]}…) ở chế độ replay")
+        return None if response is None else response["content"]
+
+    def _save(self, key: str, content: str, usage: Optional[Dict[str, Any]] = None):
+        self.store.put(key, self.model_name, {"content": content, "usage": dict(usage) if usage else None})
+
+    @staticmethod
+    def _result(content: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content,
+                                                                        response_metadata=dict(CACHE_HIT_METADATA)))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        key = self.cache_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            return self._result(cached)
+        result = self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        message = result.generations[0].message
+        self._save(key, message.content, getattr(message, "usage_metadata", None))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        key = self.cache_key(messages, stop, **kwargs)
+        # SQLite đồng bộ (và lock của store) chạy trong thread riêng để không chặn event loop
+        cached = await asyncio.to_thread(self._lookup, key)
+        if cached is not None:
+            return self._result(cached)
+        result = await self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        message = result.generations[0].message
+        await asyncio.to_thread(self._save, key, message.content, getattr(message, "usage_metadata", None))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        key = self.cache_key(messages, stop, **kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached, response_metadata=dict(CACHE_HIT_METADATA)))
+            return
+        parts, usage = [], None
+        for chunk in self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            parts.append(chunk.text)
+            usage = getattr(chunk.message, "usage_metadata", None) or usage
+            yield chunk
+        # Chỉ lưu khi stream kết thúc trọn vẹn
+        self._save(key, "".join(parts), usage)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        key = self.cache_key(messages, stop, **kwargs)
+        cached = await asyncio.to_thread(self._lookup, key)
+        if cached is not None:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached, response_metadata=dict(CACHE_HIT_METADATA)))
+            return
+        parts, usage = [], None
+        async for chunk in self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            parts.append(chunk.text)
+            usage = getattr(chunk.message, "usage_metadata", None) or usage
+            yield chunk
+        await asyncio.to_thread(self._save, key, "".join(parts), usage)
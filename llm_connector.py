@@ -1,24 +1,90 @@
 import logging
-from langchain_groq import ChatGroq
+import threading
+import time
+from typing import Optional
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
 class LLMConnector:
-    def __init__(self, groq_api_key: str, model_name: str):
+    """
+    Kết nối tới LLM qua Groq API. Với cache_mode khác "off", model được bọc bởi llm_cache.CachedChatModel:
+    phản hồi được lưu trên đĩa tại `cache_path` (tối đa `cache_max_bytes`), khóa theo model, hash prompt
+    và tham số sinh; "replay" chỉ dùng các phản hồi đã ghi và không gọi mạng.
+    Nếu truyền `scheduler` (llm_scheduler.LLMScheduler), các lượt gọi Groq đi qua bộ lập lịch (giới hạn quota,
+    retry 429, gộp prompt trùng) và client Groq không tự retry nữa; cache nằm ngoài nên lượt trúng cache
+    không tốn quota.
+    """
+    def __init__(self, groq_api_key: str, model_name: str, cache_mode: str = "off", cache_path: Optional[str] = None,
+                 cache_max_bytes: int = 64 * 1024 * 1024, scheduler=None, expected_completion_tokens: int = 512):
         self.groq_api_key = groq_api_key
         self.model_name = model_name
+        self.cache_mode = cache_mode
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_store = None
+        self.scheduler = scheduler
+        self.expected_completion_tokens = expected_completion_tokens
         self.llm = None
 
-    def connect(self):
-        """Kết nối và khởi tạo LLM thông qua Groq API"""
+    def _warmup(self):
+        """Gọi thử LLM một lần để mở kết nối tới Groq API trước khi có câu hỏi thật"""
+        start_time = time.perf_counter()
+        with metrics.span("llm.warmup"):
+            self.llm.invoke("Xin chào")
+        logger.info(f" Warm-up LLM '{self.model_name}' xong sau {time.perf_counter() - start_time:.2f} giây")
+
+    def _background_warmup(self):
+        try:
+            self._warmup()
+        except Exception as e:
+            logger.warning(f" Warm-up LLM thất bại: {e}. Kiểm tra GROQ_API_KEY và kết nối internet.")
+
+    def _with_scheduler(self, llm):
+        if self.scheduler is None:
+            return llm
+        from scheduled_llm import ScheduledChatModel
+        return ScheduledChatModel(llm=llm, scheduler=self.scheduler,
+                                  expected_completion_tokens=self.expected_completion_tokens)
+
+    def _with_cache(self, llm):
+        if self.cache_mode == "off":
+            return llm
+        from llm_cache import CachedChatModel, LLMResponseStore, LLM_CACHE_MODES
+        if self.cache_mode not in LLM_CACHE_MODES:
+            raise ValueError(f"LLM_CACHE_MODE không hợp lệ: '{self.cache_mode}'. Chọn một trong {LLM_CACHE_MODES}.")
+        self.cache_store = LLMResponseStore(self.cache_path, max_bytes=self.cache_max_bytes)
+        logger.info(f" Bật cache phản hồi LLM ({self.cache_mode}) tại '{self.cache_path}': "
+                    f"{len(self.cache_store)} phản hồi đã lưu")
+        return CachedChatModel(llm=llm, store=self.cache_store, model_name=self.model_name, mode=self.cache_mode)
+
+    def connect(self, warmup: str = "blocking"):
+        """
+        Kết nối và khởi tạo LLM thông qua Groq API.
+        warmup: "blocking" (gọi thử trước khi trả về), "background" (gọi thử ở thread nền) hoặc "off".
+        """
         try:
+            # Import trễ: langchain_groq chỉ được nạp khi thực sự kết nối
+            from langchain_groq import ChatGroq
+
             logger.info(f" Đang kết nối tới Large Language Model (LLM): {self.model_name} qua Groq API...")
+            # Ở chế độ replay không có lượt gọi mạng nào, nên không bắt buộc phải có API key
+            api_key = self.groq_api_key or ("replay-only" if self.cache_mode == "replay" else None)
             self.llm = ChatGroq(
-                groq_api_key=self.groq_api_key,
-                model_name=self.model_name
+                groq_api_key=api_key,
+                model_name=self.model_name,
+                # Bộ lập lịch tự retry có backoff dùng chung; để client Groq retry nữa sẽ nhân số request khi bị 429
+                max_retries=0 if self.scheduler is not None else 2
             )
+            self.llm = self._with_cache(self._with_scheduler(self.llm))
 
-            self.llm.invoke("Xin chào")
+            if self.cache_mode == "replay":
+                warmup = "off"  # warm-up chỉ để mở kết nối mạng, replay không gọi mạng
+            if warmup == "blocking":
+                self._warmup()
+            elif warmup == "background":
+                threading.Thread(target=self._background_warmup, name="llm-warmup", daemon=True).start()
 
             logger.info(f" Kết nối tới LLM '{self.model_name}' thành công!")
             return self.llm
@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Làn ưu tiên: số nhỏ hơn được cấp quota trước
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default="interactive")
+
+metrics.registry.describe("rag_llm_retries_total", "Số lượt gọi LLM được thử lại theo lý do (429 hoặc lỗi tạm thời)")
+metrics.registry.describe("rag_llm_coalesced_total", "Số lượt gọi LLM dùng chung kết quả của một prompt giống hệt đang chạy")
+
+
+@contextmanager
+def llm_priority(priority: str) -> Iterator[None]:
+    """Đặt làn ưu tiên cho các lượt gọi LLM bên trong khối (kể cả task/thread con tạo từ context hiện tại)"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Làn ưu tiên không hợp lệ: '{priority}'. Chọn một trong {tuple(PRIORITIES)}.")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Lỗi 429 / hết quota từ Groq (groq.RateLimitError hoặc lỗi có status_code 429)"""
+    if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+        return True
+    return "rate limit" in str(error).lower()
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Lỗi tạm thời đáng thử lại: 429, lỗi phía server (5xx), mất kết nối hoặc timeout"""
+    if is_rate_limit_error(error):
+        return True
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError",
+                                    "ServiceUnavailableError", "TimeoutError", "ConnectionError")
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Thời gian chờ server yêu cầu trong header Retry-After (nếu có)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket nạp lại đều theo `rate_per_minute`, dung lượng tối đa bằng quota một phút. Gọi khi đang giữ lock."""
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate_per_second > 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Số giây cần chờ để đủ `amount` (yêu cầu lớn hơn dung lượng chỉ cần bucket đầy)"""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate_per_second)
+
+    def consume(self, amount: float):
+        if self.enabled:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Điều chỉnh sau khi biết số token thực tế (delta > 0: dùng nhiều hơn ước lượng)"""
+        if self.enabled:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class LLMScheduler:
+    """
+    Lập lịch các lượt gọi LLM lên Groq:
+    - token bucket cho số request và số token mỗi phút (0 = không giới hạn)
+    - các lượt chờ quota được cấp theo làn ưu tiên ("interactive" trước "batch"), cùng làn thì theo thứ tự đến
+    - khi gặp 429, toàn bộ lượt gọi tạm dừng theo exponential backoff có jitter (hoặc theo Retry-After)
+    - các prompt giống hệt nhau đang chạy được gộp: chỉ lượt đầu gọi upstream, các lượt sau chờ kết quả của nó
+    """
+    POLL_SECONDS = 0.05
+
+    def __init__(self, requests_per_minute: float = 30, tokens_per_minute: float = 30000, max_retries: int = 5,
+                 backoff_base_seconds: float = 1.0, backoff_max_seconds: float = 30.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._waiters: list = []  # heap (priority, seq)
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._in_flight: Dict[str, Future] = {}
+        self._stats: Dict[str, int] = {'admitted': 0, 'coalesced': 0, 'retries': 0, 'rate_limited': 0}
+
+    # --- Cấp quota ---
+
+    def _enqueue(self, priority: str) -> Tuple[int, int]:
+        waiter = (PRIORITIES.get(priority, 0), next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiters, waiter)
+        return waiter
+
+    def _try_admit(self, waiter: Tuple[int, int], tokens: float) -> float:
+        """Cấp quota nếu `waiter` đứng đầu hàng đợi và đủ quota; trả về 0 nếu được cấp, ngược lại số giây nên chờ"""
+        with self._lock:
+            now = time.monotonic()
+            if self._waiters[0] != waiter:
+                return self.POLL_SECONDS
+            wait = max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self._stats['admitted'] += 1
+            self._condition.notify_all()
+            return 0.0
+
+    def _cancel(self, waiter: Tuple[int, int]):
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    def acquire(self, tokens: float, priority: Optional[str] = None):
+        waiter = self._enqueue(priority or current_priority())
+        start = time.perf_counter()
+        try:
+            while True:
+                wait = self._try_admit(waiter, tokens)
+                if wait <= 0:
+                    break
+                with self._condition:
+                    self._condition.wait(timeout=wait)
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        metrics.record_span("llm.queue_wait", time.perf_counter() - start)
+
+    async def aacquire(self, tokens: float, priority: Optional[str] = None):
+        waiter = self._enqueue(priority or current_priority())
+        start = time.perf_counter()
+        try:
+            while True:
+                wait = self._try_admit(waiter, tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._cancel(waiter)
+            raise
+        metrics.record_span("llm.queue_wait", time.perf_counter() - start)
+
+    def record_usage(self, estimated_tokens: float, actual_tokens: Optional[float]):
+        if actual_tokens:
+            with self._lock:
+                self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    # --- Retry ---
+
+    def backoff_seconds(self, attempt: int, error: BaseException) -> float:
+        """Exponential backoff có full jitter; ưu tiên Retry-After của server nếu có"""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(self.backoff_max_seconds, retry_after)
+        ceiling = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def on_error(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Trả về số giây chờ trước khi thử lại, hoặc None nếu không nên thử lại"""
+        if attempt >= self.max_retries or not is_retryable_error(error):
+            return None
+        delay = self.backoff_seconds(attempt, error)
+        with self._lock:
+            self._stats['retries'] += 1
+            if is_rate_limit_error(error):
+                # Dừng mọi lượt gọi chứ không riêng lượt bị 429, tránh dồn thêm request vào quota đã cạn
+                self._stats['rate_limited'] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        metrics.registry.inc("rag_llm_retries_total", labels={"reason": "rate_limit" if is_rate_limit_error(error)
+                                                               else "transient"})
+        logger.warning(f" Lỗi khi gọi LLM ({type(error).__name__}: {error}). Thử lại lần {attempt + 1}/"
+                       f"{self.max_retries} sau {delay:.1f} giây")
+        return delay
+
+    # --- Gộp prompt đang chạy ---
+
+    def join_in_flight(self, key: str) -> Tuple[Future, bool]:
+        """Trả về (future, is_leader): lượt đầu tiên với `key` là leader và phải gọi upstream rồi set kết quả"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                metrics.registry.inc("rag_llm_coalesced_total")
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def finish_in_flight(self, key: str, future: Future, result: Optional[str] = None,
+                         error: Optional[BaseException] = None):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, 'waiting': len(self._waiters), 'in_flight': len(self._in_flight)}
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_PATTERN = re.compile(r'\*\*NGỮ CẢNH:\*\*\s*(.*?)\s*\*\*DỰA VÀO NGỮ CẢNH', re.DOTALL)
+QUESTION_PATTERN = re.compile(r'\*\*Câu hỏi:\*\*\s*(.+)')
+REWRITE_PATTERN = re.compile(r'Original question:\s*(.+)', re.DOTALL)
+TOKEN_PATTERN = re.compile(r'\S+\s*')
+NOT_FOUND_ANSWER = "Tôi không tìm thấy thông tin về điều này trong tài liệu được cung cấp."
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(message.content if isinstance(message.content, str) else str(message.content)
+                     for message in messages)
+
+
+class DeterministicChatModel(BaseChatModel):
+    """
+    Chat model chạy cục bộ, không gọi mạng, luôn trả cùng một kết quả cho cùng một prompt.
+    Dùng thay ChatGroq khi benchmark hoặc chạy CI:
+    - prompt viết lại truy vấn của MultiQueryRetriever: trả về `num_rewrites` biến thể của câu hỏi
+    - prompt RAG: trích `answer_words` từ đầu tiên của phần NGỮ CẢNH (hoặc câu "không tìm thấy" nếu rỗng)
+    Độ trễ mô phỏng gồm `latency_ms` trước token đầu tiên và `tokens_per_second` cho phần sinh (0 = tức thì).
+    """
+    latency_ms: float = 0.0
+    tokens_per_second: float = 0.0
+    answer_words: int = 60
+    num_rewrites: int = 3
+
+    @property
+    def _llm_type(self) -> str:
+        return "deterministic-local"
+
+    def respond(self, prompt: str) -> str:
+        rewrite = REWRITE_PATTERN.search(prompt)
+        if rewrite:
+            question = rewrite.group(1).strip().splitlines()[0].strip()
+            variants = [question, f"quy định về {question}", f"nội dung pháp luật liên quan: {question}"]
+            return "\n".join(variants[:max(1, self.num_rewrites)])
+
+        context = CONTEXT_PATTERN.search(prompt)
+        if context is not None:
+            words = context.group(1).split()
+            if not words:
+                return NOT_FOUND_ANSWER
+            return " ".join(words[:self.answer_words])
+
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        return f"Xin chào! (local-{digest})"
+
+    @staticmethod
+    def _usage(prompt: str, text: str) -> dict:
+        input_tokens = len(TOKEN_PATTERN.findall(prompt))
+        output_tokens = len(TOKEN_PATTERN.findall(text))
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        prompt = _prompt_text(messages)
+        text = self.respond(prompt)
+        time.sleep(self.latency_ms / 1000 + self._token_delay() * len(TOKEN_PATTERN.findall(text)))
+        message = AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        prompt = _prompt_text(messages)
+        text = self.respond(prompt)
+        await asyncio.sleep(self.latency_ms / 1000 + self._token_delay() * len(TOKEN_PATTERN.findall(text)))
+        message = AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt = _prompt_text(messages)
+        text = self.respond(prompt)
+        time.sleep(self.latency_ms / 1000)
+        for token in TOKEN_PATTERN.findall(text):
+            time.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, text)))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        prompt = _prompt_text(messages)
+        text = self.respond(prompt)
+        await asyncio.sleep(self.latency_ms / 1000)
+        for token in TOKEN_PATTERN.findall(text):
+            await asyncio.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt, text)))
+
+
+class LocalLLMConnector:
+    """Cùng giao diện với LLMConnector nhưng trả về DeterministicChatModel, không cần GROQ_API_KEY hay mạng"""
+    def __init__(self, latency_ms: float = 0.0, tokens_per_second: float = 0.0, model_name: str = "deterministic-local"):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.model_name = model_name
+        self.llm = None
+
+    def connect(self, warmup: str = "off"):
+        self.llm = DeterministicChatModel(latency_ms=self.latency_ms, tokens_per_second=self.tokens_per_second)
+        logger.info(f" Dùng LLM cục bộ '{self.model_name}' (độ trễ {self.latency_ms:.0f} ms, "
+                    f"{self.tokens_per_second or 'không giới hạn'} tokens/s)")
+        return self.llm
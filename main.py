@@ -1,39 +1,27 @@
+import asyncio
 import logging
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from legal_agent import SimpleLegalAgent  
-
-from config import DATABASE_PATH, COLLECTION_NAME, EMBEDDING_MODEL_NAME, GROQ_API_KEY, LLM_MODEL_NAME
-from vector_store_loader import VectorStoreLoader
-from llm_connector import LLMConnector
+import time
+from legal_agent import SimpleLegalAgent
+from rag_system import RAGSystem
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
 logger = logging.getLogger(__name__)
 
-def format_docs(docs):
-    """Hàm hỗ trợ để định dạng các tài liệu truy xuất thành một chuỗi duy nhất."""
-    return "\n\n".join(doc.page_content for doc in docs)
-
-PROMPT_TEMPLATE = """
-Bạn là một trợ lý AI pháp lý, chuyên trả lời các câu hỏi dựa trên nội dung của văn bản Luật được cung cấp.
-Nhiệm vụ của bạn là trả lời câu hỏi của người dùng một cách chính xác và chỉ dựa vào thông tin có trong phần "NGỮ CẢNH" dưới đây.
-
-**NGỮ CẢNH:**
-{context}
-
-**DỰA VÀO NGỮ CẢNH TRÊN, HÃY TRẢ LỜI CÂU HỎI SAU:**
-**Câu hỏi:** {question}
+async def stream_answer(legal_agent: SimpleLegalAgent, question: str):
+    """In câu trả lời ra terminal ngay khi từng token/phần trả lời được sinh ra"""
+    print(f"\nAgent đang xử lý câu hỏi: '{question}'")
+    print("-" * 60)
+    start_time = time.time()
+    first_token_time = None
+    async for chunk in legal_agent.astream_ask(question):
+        if first_token_time is None and chunk:
+            first_token_time = time.time()
+        print(chunk, end="", flush=True)
+    end_time = time.time()
+    print("\n" + "=" * 60)
+    ttft = (first_token_time or end_time) - start_time
+    logger.info(f"Thời gian xử lý: {end_time - start_time:.2f} giây (time-to-first-token: {ttft:.2f} giây)")
 
-**QUY TẮC TRẢ LỜI:**
-- Trả lời thẳng vào vấn đề, không thêm lời chào hay các câu nói không liên quan.
-- Nếu câu trả lời có trong ngữ cảnh, hãy trích dẫn lại thông tin một cách ngắn gọn.
-- **Nếu câu trả lời không thể được tìm thấy trong ngữ cảnh, hãy trả lời chính xác là: "Tôi không tìm thấy thông tin về điều này trong tài liệu được cung cấp."**
-- Không được suy diễn, phỏng đoán hay sử dụng kiến thức bên ngoài ngữ cảnh.
-- Luôn trả lời bằng tiếng Việt.
-"""
-prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
 
 if __name__ == "__main__":
     print("🤖" + "=" * 60)
@@ -41,65 +29,16 @@ if __name__ == "__main__":
     print("=" * 65)
     logger.info("Bắt đầu khởi tạo hệ thống RAG...")
 
-    # --- Bước 2: Tải lại Kho Tri Thức và Khởi tạo Mô Hình ---
+    # --- Bước 2: Tải lại Kho Tri Thức, khởi tạo Mô Hình, RAG Chain và Agent ---
     logger.info("Tải lại kho tri thức và khởi tạo mô hình...")
 
-    vector_store_loader = VectorStoreLoader(
-        db_directory=DATABASE_PATH,
-        collection_name=COLLECTION_NAME,
-        embedding_model_name=EMBEDDING_MODEL_NAME
-    )
-    vectordb = vector_store_loader.load()
-    if not vectordb:
-        exit()
-
-    llm_connector = LLMConnector(
-        groq_api_key=GROQ_API_KEY,
-        model_name=LLM_MODEL_NAME
-    )
-    llm = llm_connector.connect()
-    if not llm:
-        exit()
-
-    print("-" * 60)
-    logger.info("Hoàn thành. Bắt đầu xây dựng RAG Chain.")
-
-    try:
-        base_retriever = vectordb.as_retriever(search_kwargs={"k": 3})
-        logger.info(" Đã khởi tạo Retriever cơ bản thành công")
-
-        logger.info(" Đang khởi tạo Multi-Query Retriever...")
-        retriever = MultiQueryRetriever.from_llm(
-            retriever=base_retriever,
-            llm=llm
-        )
-        logger.info(" Đã khởi tạo Multi-Query Retriever thành công")
-    except Exception as e:
-        logger.error(f" Lỗi khi khởi tạo Retriever: {e}")
-        exit()
-
-    try:
-        rag_chain = (
-                {"context": retriever | format_docs, "question": RunnablePassthrough()}
-                | prompt
-                | llm
-                | StrOutputParser()
-        )
-        logger.info(" Đã lắp ráp RAG Chain hoàn chỉnh!")
-    except Exception as e:
-        logger.error(f" Lỗi khi lắp ráp RAG Chain: {e}")
+    rag_system = RAGSystem()
+    if not rag_system.load():
+        logger.error(f" Không thể khởi tạo hệ thống: {rag_system.error}")
         exit()
+    legal_agent = rag_system.legal_agent
 
     try:
-        print("-" * 60)
-        logger.info(" Đang khởi tạo Simple Legal Agent...")
-
-        legal_agent = SimpleLegalAgent(
-            retriever=retriever,
-            llm=llm,
-            rag_chain=rag_chain
-        )
-
         print("\n SIMPLE LEGAL AGENT ĐÃ SẴN SÀNG!")
         print(" Gõ 'exit' để thoát.")
         print(" Gõ 'history' để xem lịch sử.")
@@ -116,7 +55,7 @@ if __name__ == "__main__":
             elif question.strip() == "":
                 print("Vui lòng nhập câu hỏi.")
             else:
-                legal_agent.ask(question)
+                asyncio.run(stream_answer(legal_agent, question))
 
     except Exception as e:
         logger.error(f" Lỗi khi khởi tạo và chạy Agent: {e}")
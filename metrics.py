@@ -0,0 +1,253 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Số mẫu gần nhất giữ lại cho mỗi chuỗi số liệu để tính p50/p95/p99
+DEFAULT_WINDOW_SIZE = 2048
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, Any]]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in (labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def percentile(sorted_values: List[float], quantile: float) -> float:
+    """Percentile theo nearest-rank trên danh sách đã sắp xếp"""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(quantile * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Summary:
+    """Đếm số lần quan sát, tổng giá trị và giữ cửa sổ các mẫu gần nhất để tính percentile"""
+    def __init__(self, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=window_size)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def snapshot(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        result = {"count": self.count, "sum": round(self.total, 6)}
+        for quantile in QUANTILES:
+            result[f"p{int(quantile * 100)}"] = round(percentile(ordered, quantile), 6)
+        return result
+
+
+class MetricsRegistry:
+    """
+    Bộ đếm (counter) và phân phối (summary) dùng chung trong tiến trình, có nhãn (labels).
+    Xuất dạng JSON (to_dict) và dạng văn bản Prometheus (to_prometheus) với các quantile p50/p95/p99.
+    """
+    def __init__(self, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.window_size = window_size
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._summaries: Dict[str, Dict[Labels, Summary]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, Any]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = Summary(self.window_size)
+            summary.observe(value)
+
+    def counter_value(self, name: str, labels: Optional[Dict[str, Any]] = None) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(labels), "value": value} for labels, value in sorted(series.items())]
+                for name, series in sorted(self._counters.items())
+            }
+            summaries = {
+                name: [{"labels": dict(labels), **summary.snapshot()} for labels, summary in sorted(series.items())]
+                for name, series in sorted(self._summaries.items())
+            }
+        return {"counters": counters, "summaries": summaries}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._summaries.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} summary")
+                for labels, summary in sorted(series.items()):
+                    ordered = sorted(summary.samples)
+                    for quantile in QUANTILES:
+                        lines.append(f"{name}{_format_labels(labels, ('quantile', str(quantile)))} "
+                                     f"{percentile(ordered, quantile):.6f}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {summary.total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {summary.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("rag_requests_total", "Số câu hỏi đã xử lý theo handler")
+registry.describe("rag_request_seconds", "Thời gian xử lý một câu hỏi theo handler")
+registry.describe("rag_stage_seconds", "Thời gian của từng giai đoạn (span)")
+registry.describe("rag_llm_calls_total", "Số lượt gọi LLM theo giai đoạn")
+registry.describe("rag_llm_errors_total", "Số lượt gọi LLM bị lỗi")
+registry.describe("rag_llm_prompt_tokens_total", "Tổng số prompt tokens gửi tới LLM")
+registry.describe("rag_llm_completion_tokens_total", "Tổng số completion tokens LLM sinh ra")
+registry.describe("rag_llm_calls_per_request", "Số lượt gọi LLM cho mỗi câu hỏi")
+registry.describe("rag_cache_hits_total", "Số lần trúng cache theo loại cache")
+registry.describe("rag_cache_misses_total", "Số lần trượt cache theo loại cache")
+registry.describe("rag_context_tokens_saved_total", "Số token ngữ cảnh tiết kiệm được nhờ đóng gói ngữ cảnh")
+
+
+class Trace:
+    """Các span và số liệu LLM của một câu hỏi, dùng để log phân rã thời gian khi câu hỏi kết thúc"""
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = {}
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits: Dict[str, int] = {}
+
+    def add_span(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def add_llm_call(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def add_cache_hit(self, cache: str):
+        with self._lock:
+            self.cache_hits[cache] = self.cache_hits.get(cache, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "handler": self.handler,
+                "total_seconds": round(time.perf_counter() - self.start, 6),
+                "stages": {stage: {"count": len(values), "seconds": round(sum(values), 6)}
+                           for stage, values in self.stages.items()},
+                "llm_calls": self.llm_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cache_hits": dict(self.cache_hits),
+            }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("rag_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def set_handler(handler: str):
+    """Đặt tên handler (loại câu hỏi) cho trace hiện tại"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.handler = handler
+
+
+@contextmanager
+def trace(handler: str = "general") -> Iterator[Trace]:
+    """
+    Theo dõi một câu hỏi: các span, lượt gọi LLM và cache hit ghi nhận bên trong (kể cả ở các task/thread
+    con được tạo với context hiện tại) được gộp vào trace, được log và ghi vào registry khi kết thúc.
+    """
+    current = Trace(handler)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Async generator được tiếp tục ở context khác với context đã tạo trace
+            _current_trace.set(None)
+        summary = current.summary()
+        registry.inc("rag_requests_total", labels={"handler": current.handler})
+        registry.observe("rag_request_seconds", summary["total_seconds"], labels={"handler": current.handler})
+        registry.observe("rag_llm_calls_per_request", current.llm_calls, labels={"handler": current.handler})
+        breakdown = ", ".join(f"{stage}: {info['seconds']:.2f}s x{info['count']}"
+                              for stage, info in summary["stages"].items())
+        logger.info(f" Trace [{current.handler}] {summary['total_seconds']:.2f}s | {breakdown} | "
+                    f"LLM calls: {current.llm_calls} (prompt {current.prompt_tokens}, "
+                    f"completion {current.completion_tokens} tokens)")
+
+
+def record_span(stage: str, seconds: float):
+    registry.observe("rag_stage_seconds", seconds, labels={"stage": stage})
+    current = _current_trace.get()
+    if current is not None:
+        current.add_span(stage, seconds)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Đo thời gian một giai đoạn (dùng được cả trong code đồng bộ lẫn coroutine)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def record_cache(cache: str, hit: bool):
+    registry.inc("rag_cache_hits_total" if hit else "rag_cache_misses_total", labels={"cache": cache})
+    current = _current_trace.get()
+    if hit and current is not None:
+        current.add_cache_hit(cache)
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from llm_cache import is_cached_response
+from metrics import current_trace, record_span, registry
+
+
+def _token_usage(response) -> Tuple[int, int]:
+    """Lấy số prompt/completion tokens từ kết quả LLM (llm_output của ChatGroq hoặc usage_metadata khi streaming)"""
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if usage:
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+    prompt_tokens = completion_tokens = 0
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += int(metadata.get("input_tokens") or 0)
+            completion_tokens += int(metadata.get("output_tokens") or 0)
+    return prompt_tokens, completion_tokens
+
+
+def _served_from_cache(response) -> bool:
+    generations = [generation for batch in getattr(response, "generations", None) or [] for generation in batch]
+    return bool(generations) and all(is_cached_response(getattr(generation, "message", None))
+                                     for generation in generations)
+
+
+registry.describe("rag_llm_cached_responses_total",
+                  "Số phản hồi LLM lấy từ cache (không tính vào rag_llm_calls_total) theo giai đoạn")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Callback LangChain ghi span cho các retriever và lượt gọi LLM trong chain (kèm token usage).
+    Truyền qua config={"callbacks": [...]} khi gọi chain để mọi retriever/LLM con đều được ghi nhận;
+    lượt gọi LLM nằm bên trong một retriever (MultiQueryRetriever) được tính là "llm.query_rewrite".
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._retriever_runs: Dict[UUID, Tuple[str, float]] = {}
+        self._llm_runs: Dict[UUID, Tuple[str, float]] = {}
+
+    def _track(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        with self._lock:
+            self._parents[run_id] = parent_run_id
+
+    def _under_retriever(self, run_id: Optional[UUID]) -> bool:
+        with self._lock:
+            while run_id is not None:
+                if run_id in self._retriever_runs:
+                    return True
+                run_id = self._parents.get(run_id)
+        return False
+
+    def _forget(self, run_id: UUID):
+        with self._lock:
+            self._parents.pop(run_id, None)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        self._track(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._forget(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        self._forget(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "retriever"
+        self._track(run_id, parent_run_id)
+        with self._lock:
+            self._retriever_runs[run_id] = (f"retrieval.{name}", time.perf_counter())
+
+    def _end_retriever(self, run_id: UUID):
+        with self._lock:
+            run = self._retriever_runs.pop(run_id, None)
+        self._forget(run_id)
+        if run is not None:
+            record_span(run[0], time.perf_counter() - run[1])
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs):
+        self._end_retriever(run_id)
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs):
+        self._end_retriever(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        self._track(run_id, parent_run_id)
+        stage = "llm.query_rewrite" if self._under_retriever(parent_run_id) else "llm.generation"
+        with self._lock:
+            self._llm_runs[run_id] = (stage, time.perf_counter())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        self._forget(run_id)
+        if run is None:
+            return
+        stage, start = run
+        if _served_from_cache(response):
+            # Phản hồi lấy từ cache LLM: không phải lượt gọi LLM, chỉ đếm riêng (rag_cache_hits_total đã ghi nhận)
+            record_span(f"{stage}.cached", time.perf_counter() - start)
+            registry.inc("rag_llm_cached_responses_total", labels={"stage": stage})
+            return
+        record_span(stage, time.perf_counter() - start)
+        prompt_tokens, completion_tokens = _token_usage(response)
+        registry.inc("rag_llm_calls_total", labels={"stage": stage})
+        registry.inc("rag_llm_prompt_tokens_total", prompt_tokens)
+        registry.inc("rag_llm_completion_tokens_total", completion_tokens)
+        current = current_trace()
+        if current is not None:
+            current.add_llm_call(prompt_tokens, completion_tokens)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        self._forget(run_id)
+        if run is not None:
+            registry.inc("rag_llm_errors_total", labels={"stage": run[0]})
+            current = current_trace()
+            if current is not None:
+                current.add_llm_call(0, 0)
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from vector_quantization import VectorCodec, CODES_FILE, CODEC_FILE, create_codec, save_codec, load_codec
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+NUMPY_INDEX_DIR = "numpy_index"
+
+
+def numpy_index_dir(db_path: str, collection_name: str) -> Path:
+    """Thư mục chứa index NumPy của một collection, nằm cạnh dữ liệu Chroma trong cùng db_path"""
+    return Path(db_path) / NUMPY_INDEX_DIR / collection_name
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorIndex:
+    """
+    Index vector trong tiến trình: ma trận embeddings float32 đã chuẩn hóa được memory-map từ
+    file .npy, kèm file metadata.json (ids, documents, metadatas).
+    Top-k chính xác bằng một phép nhân ma trận và argpartition, hỗ trợ truy vấn theo lô.
+
+    Nếu index được lưu kèm mã nén (float16 / int8 / PQ), tìm kiếm chạy xấp xỉ trên mã nén để lấy
+    k * rerank_factor ứng viên, rồi chấm lại chính xác chỉ các hàng ứng viên của ma trận float32
+    (memory-map nên phần còn lại của ma trận không bị nạp vào RAM).
+    """
+    SCORE_BLOCK_SIZE = 65536
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray,
+                 codec: Optional[VectorCodec] = None, codes: Optional[np.ndarray] = None, rerank_factor: int = 4):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.codec = codec
+        self.codes = codes
+        self.rerank_factor = max(1, rerank_factor)
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True, rerank_factor: int = 4) -> "NumpyVectorIndex":
+        index_dir = Path(index_dir)
+        with open(index_dir / METADATA_FILE, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        embeddings = np.load(index_dir / EMBEDDINGS_FILE, mmap_mode='r' if mmap else None)
+        if len(metadata['ids']) != embeddings.shape[0]:
+            raise ValueError(f"Index NumPy không nhất quán: {len(metadata['ids'])} ids, {embeddings.shape[0]} vectors")
+        codec, codes = load_codec(index_dir, mmap=False)
+        if codes is not None and codes.shape[0] != embeddings.shape[0]:
+            logger.warning(f" Mã nén không khớp với embeddings ({codes.shape[0]} / {embeddings.shape[0]}), dùng tìm kiếm chính xác.")
+            codec, codes = None, None
+        return cls(metadata['ids'], metadata['documents'], metadata['metadatas'], embeddings,
+                   codec=codec, codes=codes, rerank_factor=rerank_factor)
+
+    @staticmethod
+    def save(index_dir: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray,
+             compression: str = "none", pq_subspaces: int = 16):
+        """
+        Ghi index ra đĩa. Dùng file tạm + os.replace để các tiến trình đang memory-map không đọc phải file dở dang.
+        Với compression khác "none", ghi thêm mã nén (codes.npy) và tham số codec (codec.npz) bên cạnh
+        embeddings float32 (vẫn cần cho bước chấm lại chính xác): nén giảm ma trận quét khi tìm kiếm
+        nhưng làm tăng tổng dung lượng trên đĩa.
+        """
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+        tmp_embeddings = index_dir / (EMBEDDINGS_FILE + ".tmp")
+        with open(tmp_embeddings, 'wb') as f:
+            np.save(f, embeddings)
+        tmp_metadata = index_dir / (METADATA_FILE + ".tmp")
+        with open(tmp_metadata, 'w', encoding='utf-8') as f:
+            json.dump({'ids': ids, 'documents': documents, 'metadatas': metadatas}, f, ensure_ascii=False, separators=(',', ':'))
+
+        replacements = [(tmp_embeddings, index_dir / EMBEDDINGS_FILE), (tmp_metadata, index_dir / METADATA_FILE)]
+        if compression != "none" and len(embeddings):
+            codec = create_codec(compression, pq_subspaces).fit(embeddings)
+            codes = codec.encode(embeddings)
+            codec_files = save_codec(index_dir, codec, codes)
+            replacements += codec_files
+            stored_bytes = embeddings.nbytes + sum(os.path.getsize(tmp_path) for tmp_path, _ in codec_files)
+            logger.info(f" Nén vectors ({compression}): ma trận tìm kiếm {embeddings.nbytes / 1e6:.2f} MB -> "
+                        f"{codes.nbytes / 1e6:.2f} MB (giảm {embeddings.nbytes / max(codes.nbytes, 1):.1f} lần); "
+                        f"dung lượng vectors trên đĩa {embeddings.nbytes / 1e6:.2f} MB -> {stored_bytes / 1e6:.2f} MB "
+                        f"(giữ float32 để chấm lại chính xác)")
+        else:
+            for name in (CODES_FILE, CODEC_FILE):
+                (index_dir / name).unlink(missing_ok=True)
+
+        for tmp_path, path in replacements:
+            os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0
+
+    def search(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm top-k cho một hoặc nhiều vector truy vấn.
+        Trả về (indices, scores) dạng (số truy vấn, k), sắp xếp giảm dần theo cosine similarity.
+        """
+        queries = normalize_rows(query_vectors)
+        n = len(self.ids)
+        k = min(k, n)
+        if k <= 0:
+            empty = np.empty((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        if self.codec is not None:
+            return self._search_compressed(queries, k)
+
+        scores = queries @ self.embeddings.T
+        return self._top_k(scores, k)
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n = scores.shape[1]
+        if k < n:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(n), scores.shape)
+        top_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def approximate_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Điểm xấp xỉ trên mã nén, tính theo từng khối hàng để giới hạn bộ nhớ tạm khi giải nén"""
+        return np.concatenate([
+            self.codec.scores(queries, self.codes[start:start + self.SCORE_BLOCK_SIZE])
+            for start in range(0, len(self.ids), self.SCORE_BLOCK_SIZE)
+        ], axis=1)
+
+    def _search_compressed(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n_candidates = min(len(self.ids), k * self.rerank_factor)
+        candidates, _ = self._top_k(self.approximate_scores(queries), n_candidates)
+
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for row, (query, row_candidates) in enumerate(zip(queries, candidates)):
+            # Chấm lại chính xác chỉ các hàng ứng viên của ma trận float32
+            rows = np.sort(row_candidates)
+            exact = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+            order = np.argsort(-exact)[:k]
+            indices[row], scores[row] = rows[order], exact[order]
+        return indices, scores
+
+    def document(self, position: int) -> Document:
+        return Document(page_content=self.documents[position], metadata=dict(self.metadatas[position]),
+                        id=self.ids[position])
+
+    def get_by_ids(self, ids: Sequence[str]) -> List[Document]:
+        return [self.document(self._positions[doc_id]) for doc_id in ids if doc_id in self._positions]
+
+
+class NumpyVectorStore(VectorStore):
+    """Adapter LangChain cho NumpyVectorIndex, dùng được với as_retriever() như Chroma"""
+    def __init__(self, index: NumpyVectorIndex, embedding_function: Embeddings):
+        self.index = index
+        self.embedding_function = embedding_function
+
+    @classmethod
+    def load(cls, db_path: str, collection_name: str, embedding_function: Embeddings, mmap: bool = True,
+             rerank_factor: int = 4) -> "NumpyVectorStore":
+        index = NumpyVectorIndex.load(str(numpy_index_dir(db_path, collection_name)), mmap=mmap,
+                                      rerank_factor=rerank_factor)
+        return cls(index, embedding_function)
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding_function
+
+    def count(self) -> int:
+        return len(self.index)
+
+    def _results(self, indices: np.ndarray, scores: np.ndarray) -> List[Tuple[Document, float]]:
+        return [(self.index.document(int(i)), float(s)) for i, s in zip(indices, scores)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        indices, scores = self.index.search(np.asarray(embedding, dtype=np.float32), k)
+        return self._results(indices[0], scores[0])
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def batch_similarity_search_with_score(self, queries: List[str], k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """Truy vấn theo lô: một lần embed cho tất cả câu hỏi và một phép nhân ma trận duy nhất"""
+        if not queries:
+            return []
+        vectors = np.asarray(self.embedding_function.embed_documents(queries), dtype=np.float32)
+        indices, scores = self.index.search(vectors, k)
+        return [self._results(row_indices, row_scores) for row_indices, row_scores in zip(indices, scores)]
+
+    def _select_relevance_score_fn(self):
+        # Điểm là cosine similarity trong [-1, 1], quy về [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        return self.index.get_by_ids(ids)
+
+    def add_texts(self, texts, metadatas=None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("Index NumPy chỉ đọc khi truy vấn. Hãy dùng build_kb.py để thêm dữ liệu.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs: Any) -> "NumpyVectorStore":
+        raise NotImplementedError("Hãy dùng build_kb.py với VECTOR_BACKEND = \"numpy\" để tạo index.")
@@ -0,0 +1,89 @@
+import logging
+import threading
+from typing import Any, Dict, List
+
+from langchain_core.documents import Document
+
+from article_index import child_body
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ParentChildExpander:
+    """
+    Truy xuất cha-con: vector search/BM25 so khớp trên các chunk nhỏ cấp Khoản, ngữ cảnh gửi LLM được dựng
+    theo Điều cha (article_index.ArticleIndex.get_parent). Các Khoản khớp của cùng một Điều được gom lại:
+    - Điều cha không dài quá `max_article_chars`: đưa nguyên Điều (đủ ngữ cảnh, chi phí nhỏ)
+    - ngược lại: chỉ đưa các Khoản khớp theo thứ tự trong Điều, mở đầu bằng tiêu đề Điều và danh sách Khoản đã trích
+    Tài liệu không phải chunk con (không có "parent_id") được giữ nguyên. Thứ tự đầu ra theo thứ hạng của Khoản
+    khớp tốt nhất trong mỗi Điều.
+    """
+    def __init__(self, article_index, max_article_chars: int = 1200):
+        self.article_index = article_index
+        self.max_article_chars = max_article_chars
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            'requests': 0, 'children_in': 0, 'full_articles': 0, 'excerpts': 0, 'chars_out': 0, 'chars_saved': 0,
+        }
+
+    @staticmethod
+    def _excerpt(parent: Document, children: List[Document]) -> Document:
+        heading = parent.metadata.get("heading", "")
+        ordered = sorted(children, key=lambda doc: int(doc.metadata.get("part", 0) or 0))
+        bodies = list(dict.fromkeys(child_body(doc.page_content, heading) for doc in ordered))
+        clauses = list(dict.fromkeys(int(doc.metadata.get("clause", 0) or 0) for doc in ordered))
+        cited = ", ".join(str(clause) for clause in clauses if clause > 0)
+        header = f"{heading} (trích khoản {cited})" if heading and cited else heading
+        content = "\n".join(([header] if header else []) + bodies)
+        metadata = {**parent.metadata, "clauses": ",".join(str(clause) for clause in clauses)}
+        return Document(page_content=content, metadata=metadata, id=parent.id)
+
+    def expand(self, docs: List[Document]) -> List[Document]:
+        """Thay các chunk con bằng Điều cha hoặc đoạn trích các Khoản khớp của nó"""
+        with metrics.span("retrieval.parent_expand"):
+            return self._expand(docs)
+
+    def _expand(self, docs: List[Document]) -> List[Document]:
+        docs = list(docs or [])
+        groups: Dict[str, List[Document]] = {}
+        order: List[Any] = []
+        for doc in docs:
+            parent_id = (doc.metadata or {}).get("parent_id")
+            if parent_id and parent_id in self.article_index.parents:
+                if parent_id not in groups:
+                    groups[parent_id] = []
+                    order.append(parent_id)
+                groups[parent_id].append(doc)
+            else:
+                order.append(doc)
+
+        expanded, full_articles, excerpts, saved = [], 0, 0, 0
+        for item in order:
+            if isinstance(item, Document):
+                expanded.append(item)
+                continue
+            parent = self.article_index.get_parent(item)
+            if len(parent.page_content) <= self.max_article_chars:
+                expanded.append(parent)
+                full_articles += 1
+            else:
+                excerpt = self._excerpt(parent, groups[item])
+                expanded.append(excerpt)
+                excerpts += 1
+                saved += len(parent.page_content) - len(excerpt.page_content)
+
+        chars_out = sum(len(doc.page_content) for doc in expanded)
+        with self._lock:
+            for key, value in (('requests', 1), ('children_in', sum(len(g) for g in groups.values())),
+                               ('full_articles', full_articles), ('excerpts', excerpts), ('chars_out', chars_out),
+                               ('chars_saved', saved)):
+                self._stats[key] += value
+        if groups:
+            logger.info(f" Cha-con: {len(docs)} đoạn -> {full_articles} Điều đầy đủ, {excerpts} đoạn trích Khoản "
+                        f"({chars_out} ký tự, bớt {saved} ký tự so với đưa nguyên Điều)")
+        return expanded
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,60 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    Bọc một embedding function: ghi nhớ embedding của các truy vấn gần đây (LRU) để semantic cache,
+    vector search và các truy vấn con không phải encode lại cùng một câu, và cho phép encode trước
+    cả một lô truy vấn bằng một lần gọi model (`prime`).
+    """
+    def __init__(self, embeddings: Embeddings, max_size: int = 1024):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self._vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, text: str):
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is not None:
+                self._vectors.move_to_end(text)
+            return vector
+
+    def _store(self, texts: List[str], vectors: List[List[float]]):
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._vectors[text] = list(vector)
+                self._vectors.move_to_end(text)
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+    def prime(self, texts: List[str]) -> int:
+        """Encode trước các truy vấn chưa có trong cache bằng một lần gọi model, trả về số truy vấn đã encode"""
+        with self._lock:
+            missing = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        if not missing:
+            return 0
+        self._store(missing, self.embeddings.embed_documents(missing))
+        logger.info(f" Đã encode trước {len(missing)} truy vấn trong một lần gọi embedding model")
+        return len(missing)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._lookup(text)
+        metrics.record_cache("query_embedding", vector is not None)
+        if vector is None:
+            with metrics.span("embedding.query"):
+                vector = self.embeddings.embed_query(text)
+            self._store([text], [vector])
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
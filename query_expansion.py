@@ -0,0 +1,62 @@
+import re
+import unicodedata
+from typing import Dict, List
+
+# Bảng viết tắt và từ đồng nghĩa thường gặp trong câu hỏi về văn bản pháp luật.
+# Dùng để mở rộng truy vấn cục bộ, không tốn lượt gọi LLM.
+LEGAL_ABBREVIATIONS: Dict[str, str] = {
+    "dlcn": "dữ liệu cá nhân",
+    "csdl": "cơ sở dữ liệu",
+    "csdlqg": "cơ sở dữ liệu quốc gia",
+    "ttdlqg": "trung tâm dữ liệu quốc gia",
+    "cqnn": "cơ quan nhà nước",
+    "ubnd": "ủy ban nhân dân",
+    "nđ": "nghị định",
+    "nđ-cp": "nghị định chính phủ",
+    "tt": "thông tư",
+    "qđ": "quyết định",
+    "bca": "bộ công an",
+    "bqp": "bộ quốc phòng",
+    "cntt": "công nghệ thông tin",
+    "ttg": "thủ tướng chính phủ",
+}
+
+LEGAL_SYNONYMS: Dict[str, List[str]] = {
+    "phạt": ["xử phạt", "xử lý vi phạm"],
+    "hình phạt": ["xử lý vi phạm", "chế tài"],
+    "vi phạm": ["hành vi bị nghiêm cấm"],
+    "cấm": ["hành vi bị nghiêm cấm"],
+    "định nghĩa": ["giải thích từ ngữ"],
+    "là gì": ["được hiểu là", "giải thích từ ngữ"],
+    "khái niệm": ["giải thích từ ngữ"],
+    "chia sẻ": ["cung cấp", "kết nối, chia sẻ"],
+    "lưu trữ": ["lưu giữ", "hoạt động lưu trữ dữ liệu"],
+    "bảo mật": ["bảo vệ dữ liệu", "an ninh dữ liệu"],
+    "trách nhiệm": ["nghĩa vụ", "quyền, nghĩa vụ"],
+    "hiệu lực": ["hiệu lực thi hành"],
+    "nhạy cảm": ["dữ liệu cá nhân nhạy cảm"],
+    "người dân": ["cá nhân", "chủ thể dữ liệu"],
+}
+
+
+def expand_query(query: str, max_variants: int = 3) -> List[str]:
+    """
+    Sinh các biến thể của truy vấn bằng bảng viết tắt/đồng nghĩa pháp lý.
+    Không bao gồm truy vấn gốc; trả về danh sách rỗng nếu không có gì để mở rộng.
+    """
+    normalized = unicodedata.normalize('NFC', query).lower()
+
+    expanded = normalized
+    for abbreviation, full_form in LEGAL_ABBREVIATIONS.items():
+        expanded = re.sub(rf'(?<!\w){re.escape(abbreviation)}(?!\w)', full_form, expanded)
+
+    variants = []
+    if expanded != normalized:
+        variants.append(expanded)
+    for term, synonyms in LEGAL_SYNONYMS.items():
+        pattern = rf'(?<!\w){re.escape(term)}(?!\w)'
+        if re.search(pattern, expanded):
+            for synonym in synonyms:
+                variants.append(re.sub(pattern, synonym, expanded, count=1))
+
+    return list(dict.fromkeys(v for v in variants if v != normalized))[:max_variants]
@@ -0,0 +1,131 @@
+import logging
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
+from langchain_core.output_parsers import StrOutputParser
+from langchain.retrievers.multi_query import MultiQueryRetriever
+
+from bm25_index import BM25Index, bm25_index_path
+from article_index import ArticleIndex, article_index_path
+from hybrid_retriever import HybridRetriever
+from adaptive_retriever import AdaptiveRetriever
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = """
+Bạn là một trợ lý AI pháp lý, chuyên trả lời các câu hỏi dựa trên nội dung của văn bản Luật được cung cấp.
+Nhiệm vụ của bạn là trả lời câu hỏi của người dùng một cách chính xác và chỉ dựa vào thông tin có trong phần "NGỮ CẢNH" dưới đây.
+
+**NGỮ CẢNH:**
+{context}
+
+**DỰA VÀO NGỮ CẢNH TRÊN, HÃY TRẢ LỜI CÂU HỎI SAU:**
+**Câu hỏi:** {question}
+
+**QUY TẮC TRẢ LỜI:**
+- Trả lời thẳng vào vấn đề, không thêm lời chào hay các câu nói không liên quan.
+- Nếu câu trả lời có trong ngữ cảnh, hãy trích dẫn lại thông tin một cách ngắn gọn.
+- **Nếu câu trả lời không thể được tìm thấy trong ngữ cảnh, hãy trả lời chính xác là: "Tôi không tìm thấy thông tin về điều này trong tài liệu được cung cấp."**
+- Không được suy diễn, phỏng đoán hay sử dụng kiến thức bên ngoài ngữ cảnh.
+- Luôn trả lời bằng tiếng Việt.
+"""
+prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+
+
+def format_docs(docs):
+    """Hàm hỗ trợ để định dạng các tài liệu truy xuất thành một chuỗi duy nhất."""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def build_retriever(vectordb, llm, k: int = 3, bm25_index=None, hybrid_top_k: int = 5, bm25_k: int = 10,
+                    rrf_k: int = 60, mode: str = "multi_query", expansion: str = "llm",
+                    min_top_score: float = 0.65, min_score_margin: float = 0.015):
+    """
+    Tạo retriever cho RAG trên vector search k kết quả theo `mode`:
+    - "multi_query": luôn dùng Multi-Query Retriever (thêm một lượt gọi LLM mỗi lần truy xuất)
+    - "adaptive": vector search trước, chỉ mở rộng truy vấn (bằng LLM hoặc bảng từ đồng nghĩa) khi kết quả kém tin cậy
+    - "vector": chỉ vector search
+    Nếu có BM25 index thì gộp thêm kết quả tìm kiếm từ vựng bằng Reciprocal Rank Fusion.
+    """
+    base_retriever = vectordb.as_retriever(search_kwargs={"k": k})
+    logger.info(" Đã khởi tạo Retriever cơ bản thành công")
+
+    if mode == "multi_query":
+        retriever = MultiQueryRetriever.from_llm(retriever=base_retriever, llm=llm)
+        logger.info(" Đã khởi tạo Multi-Query Retriever thành công")
+    elif mode == "adaptive":
+        llm_retriever = MultiQueryRetriever.from_llm(retriever=base_retriever, llm=llm) if expansion == "llm" else None
+        retriever = AdaptiveRetriever(vectorstore=vectordb, k=k, min_top_score=min_top_score,
+                                      min_score_margin=min_score_margin, expansion=expansion,
+                                      llm_retriever=llm_retriever)
+        logger.info(f" Đã khởi tạo Adaptive Retriever (mở rộng truy vấn: {expansion})")
+    elif mode == "vector":
+        retriever = base_retriever
+    else:
+        raise ValueError(f"RETRIEVAL_MODE không hợp lệ: '{mode}'. Chọn 'adaptive', 'multi_query' hoặc 'vector'.")
+
+    if bm25_index is not None:
+        retriever = HybridRetriever(vector_retriever=retriever, bm25_index=bm25_index,
+                                    top_k=hybrid_top_k, bm25_k=bm25_k, rrf_k=rrf_k)
+        logger.info(f" Đã bật Hybrid Retriever (BM25 + vector, {len(bm25_index)} documents)")
+    return retriever
+
+
+def load_bm25_index(db_path: str, collection_name: str):
+    """Tải BM25 index đã build cùng knowledge base, trả về None nếu chưa có"""
+    path = bm25_index_path(db_path, collection_name)
+    if not path.exists():
+        logger.warning(f" Không tìm thấy BM25 index tại '{path}'. Hãy chạy lại build_kb.py. Chỉ dùng vector search.")
+        return None
+    try:
+        return BM25Index.load(str(path))
+    except Exception as e:
+        logger.error(f" Lỗi khi tải BM25 index: {e}. Chỉ dùng vector search.")
+        return None
+
+
+def load_article_index(db_path: str, collection_name: str):
+    """Tải article index ((file nguồn, số Điều) -> chunks) đã build cùng knowledge base, trả về None nếu chưa có"""
+    path = article_index_path(db_path, collection_name)
+    if not path.exists():
+        logger.warning(f" Không tìm thấy article index tại '{path}'. Câu hỏi về Điều cụ thể sẽ dùng vector search.")
+        return None
+    try:
+        return ArticleIndex.load(str(path))
+    except Exception as e:
+        logger.error(f" Lỗi khi tải article index: {e}")
+        return None
+
+
+def build_answer_chain(llm, context_packer=None):
+    """
+    Chain sinh câu trả lời từ các tài liệu đã truy xuất.
+    Đầu vào: {"context": List[Document], "question": str}, đầu ra: chuỗi câu trả lời.
+    Nếu có `context_packer` thì ngữ cảnh được khử trùng lặp và giới hạn theo ngân sách token trước khi gửi LLM.
+    """
+    pack = context_packer.pack if context_packer is not None else list
+    return (
+            RunnablePassthrough.assign(context=lambda x: format_docs(pack(x["context"])))
+            | prompt
+            | llm
+            | StrOutputParser()
+    )
+
+
+def build_rag_chain(retriever, llm, context_packer=None, parent_expander=None):
+    """
+    Lắp ráp RAG Chain trả về cả câu trả lời lẫn các tài liệu đã dùng làm ngữ cảnh,
+    để trích dẫn nguồn được lấy từ đúng lần truy xuất đó (không phải truy xuất lại).
+    Nếu có `parent_expander` thì các chunk cấp Khoản được thay bằng Điều cha hoặc đoạn trích Khoản của nó.
+    Nếu có `context_packer` thì "context" là danh sách tài liệu đã được đóng gói (đúng phần LLM nhận được).
+    Đầu ra: {"context": List[Document], "question": str, "answer": str}
+    """
+    context = retriever
+    if parent_expander is not None:
+        context = context | RunnableLambda(parent_expander.expand)
+    if context_packer is not None:
+        context = context | RunnableLambda(context_packer.pack)
+    rag_chain = RunnableParallel(
+        {"context": context, "question": RunnablePassthrough()}
+    ).assign(answer=build_answer_chain(llm))
+    logger.info(" Đã lắp ráp RAG Chain hoàn chỉnh!")
+    return rag_chain
@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import DATABASE_PATH, COLLECTION_NAME, EMBEDDING_MODEL_NAME, GROQ_API_KEY, LLM_MODEL_NAME, \
+    MAX_CONCURRENT_SUBQUERIES, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_SIZE, \
+    SEMANTIC_CACHE_TTL_SECONDS, VECTOR_BACKEND, RETRIEVER_K, HYBRID_SEARCH_ENABLED, HYBRID_TOP_K, BM25_TOP_K, \
+    RRF_K, RETRIEVAL_MODE, QUERY_EXPANSION, ADAPTIVE_MIN_TOP_SCORE, ADAPTIVE_MIN_SCORE_MARGIN, \
+    MAX_HISTORY_TURNS, LLM_WARMUP, QUERY_EMBEDDING_BATCH_SIZE, QUERY_EMBEDDING_BATCH_WAIT_MS, \
+    EMBEDDING_BACKEND, VECTOR_RERANK_FACTOR, CONTEXT_PACKING_ENABLED, CONTEXT_TOKEN_BUDGET, CONTEXT_TOKEN_ENCODING, \
+    LLM_PROVIDER, LOCAL_LLM_LATENCY_MS, LOCAL_LLM_TOKENS_PER_SECOND, LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_MB, \
+    LLM_SCHEDULER_ENABLED, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS, \
+    LLM_BACKOFF_MAX_SECONDS, LLM_EXPECTED_COMPLETION_TOKENS, PARENT_ARTICLE_MAX_CHARS
+from vector_store_loader import VectorStoreLoader
+from llm_connector import LLMConnector
+from legal_agent import SimpleLegalAgent
+from kb_version import read_kb_version
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RAGSystem:
+    """
+    Khởi tạo toàn bộ hệ thống RAG từ config (vector store, LLM, retriever, chain, cache, Agent).
+    Dùng chung cho CLI (main.py), giao diện Gradio (app.py) và HTTP API (api.py).
+    `llm_connector` (đối tượng có phương thức connect(warmup)) thay cho connector tạo từ config, ví dụ
+    local_llm.LocalLLMConnector khi benchmark.
+    """
+    def __init__(self, llm_connector=None):
+        self.llm_connector = llm_connector
+        self.vector_store_loader = None
+        self.vectordb = None
+        self.llm = None
+        self.retriever = None
+        self.rag_chain = None
+        self.context_packer = None
+        self.parent_expander = None
+        self.legal_agent = None
+        self.error = None
+        self.startup_timings: Dict[str, float] = {}
+        self._load_lock = threading.Lock()
+        self._loader_thread: Optional[threading.Thread] = None
+        self._loaded = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.legal_agent is not None
+
+    def status(self) -> Dict[str, bool]:
+        """Trạng thái từng thành phần, dùng cho health/readiness check"""
+        return {
+            "vector_store": self.vectordb is not None,
+            "llm": self.llm is not None,
+            "agent": self.ready,
+        }
+
+    def load_in_background(self):
+        """Bắt đầu khởi tạo hệ thống ở thread nền (chỉ một lần), không chặn luồng gọi"""
+        with self._load_lock:
+            if self._loader_thread is None:
+                self._loader_thread = threading.Thread(target=self.load, name="rag-system-loader", daemon=True)
+                self._loader_thread.start()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Chờ quá trình khởi tạo kết thúc; trả về True nếu hệ thống sẵn sàng"""
+        self._loaded.wait(timeout)
+        return self.ready
+
+    @staticmethod
+    def _create_llm_connector():
+        if LLM_PROVIDER == "local":
+            from local_llm import LocalLLMConnector
+            return LocalLLMConnector(latency_ms=LOCAL_LLM_LATENCY_MS, tokens_per_second=LOCAL_LLM_TOKENS_PER_SECOND)
+        if LLM_PROVIDER != "groq":
+            raise ValueError(f"LLM_PROVIDER không hợp lệ: '{LLM_PROVIDER}'. Chọn 'groq' hoặc 'local'.")
+        scheduler = None
+        if LLM_SCHEDULER_ENABLED:
+            from llm_scheduler import LLMScheduler
+            scheduler = LLMScheduler(requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+                                     tokens_per_minute=LLM_TOKENS_PER_MINUTE, max_retries=LLM_MAX_RETRIES,
+                                     backoff_base_seconds=LLM_BACKOFF_BASE_SECONDS,
+                                     backoff_max_seconds=LLM_BACKOFF_MAX_SECONDS)
+        return LLMConnector(groq_api_key=GROQ_API_KEY, model_name=LLM_MODEL_NAME, cache_mode=LLM_CACHE_MODE,
+                            cache_path=LLM_CACHE_PATH, cache_max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+                            scheduler=scheduler, expected_completion_tokens=LLM_EXPECTED_COMPLETION_TOKENS)
+
+    def _timed(self, name: str, func: Callable, *args):
+        """Bọc một bước khởi tạo để ghi lại thời gian chạy của nó vào startup_timings"""
+        def run():
+            start_time = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.startup_timings[name] = time.perf_counter() - start_time
+        return run
+
+    def load(self) -> bool:
+        """
+        Khởi tạo hệ thống; trả về False (và lưu lỗi vào `error`) nếu có bước thất bại.
+        Embedding model, vector store, LLM client và các index được tải song song ở các thread riêng,
+        thời gian của từng thành phần được log sau khi khởi tạo xong.
+        """
+        try:
+            return self._load()
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f" Lỗi khi khởi tạo hệ thống RAG: {e}")
+            return False
+        finally:
+            self._loaded.set()
+
+    def _load(self) -> bool:
+        start_time = time.perf_counter()
+        # Import trễ: langchain retrievers/chains và numpy chỉ được nạp khi khởi tạo hệ thống
+        from answer_cache import SemanticAnswerCache
+        from context_packer import ContextPacker
+        from metrics_callback import MetricsCallbackHandler
+        from parent_child import ParentChildExpander
+        from rag_pipeline import build_rag_chain, build_retriever, build_answer_chain, load_bm25_index, \
+            load_article_index
+        self.startup_timings["imports"] = time.perf_counter() - start_time
+
+        self.vector_store_loader = VectorStoreLoader(
+            db_directory=DATABASE_PATH,
+            collection_name=COLLECTION_NAME,
+            embedding_model_name=EMBEDDING_MODEL_NAME,
+            backend=VECTOR_BACKEND,
+            query_batch_size=QUERY_EMBEDDING_BATCH_SIZE,
+            query_batch_wait_ms=QUERY_EMBEDDING_BATCH_WAIT_MS,
+            embedding_backend=EMBEDDING_BACKEND,
+            rerank_factor=VECTOR_RERANK_FACTOR
+        )
+        llm_connector = self.llm_connector = self.llm_connector or self._create_llm_connector()
+
+        with ThreadPoolExecutor(max_workers=5, thread_name_prefix="rag-startup") as executor:
+            embeddings_future = executor.submit(
+                self._timed("embedding_model", self.vector_store_loader.load_embedding_model))
+            vectordb_future = executor.submit(
+                self._timed("vector_store", self.vector_store_loader.load, embeddings_future))
+            llm_future = executor.submit(self._timed("llm", llm_connector.connect, LLM_WARMUP))
+            bm25_future = executor.submit(
+                self._timed("bm25_index", load_bm25_index, DATABASE_PATH, COLLECTION_NAME)
+            ) if HYBRID_SEARCH_ENABLED else None
+            article_future = executor.submit(
+                self._timed("article_index", load_article_index, DATABASE_PATH, COLLECTION_NAME))
+
+            try:
+                embeddings_future.result()
+            except Exception as e:
+                self.error = f"Không thể tải embedding model: {e}"
+                logger.error(f" {self.error}")
+                return False
+            self.vectordb = vectordb_future.result()
+            self.llm = llm_future.result()
+            bm25_index = bm25_future.result() if bm25_future else None
+            article_index = article_future.result()
+
+        if not self.vectordb:
+            self.error = "Không thể tải Vector Database."
+            return False
+        if not self.llm:
+            self.error = "Không thể kết nối LLM."
+            return False
+
+        chain_start = time.perf_counter()
+        self.retriever = build_retriever(
+            self.vectordb,
+            self.llm,
+            k=RETRIEVER_K,
+            bm25_index=bm25_index,
+            hybrid_top_k=HYBRID_TOP_K,
+            bm25_k=BM25_TOP_K,
+            rrf_k=RRF_K,
+            mode=RETRIEVAL_MODE,
+            expansion=QUERY_EXPANSION,
+            min_top_score=ADAPTIVE_MIN_TOP_SCORE,
+            min_score_margin=ADAPTIVE_MIN_SCORE_MARGIN
+        )
+        if CONTEXT_PACKING_ENABLED:
+            self.context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET,
+                                                encoding_name=CONTEXT_TOKEN_ENCODING)
+        if article_index is not None and article_index.parents:
+            self.parent_expander = ParentChildExpander(article_index, max_article_chars=PARENT_ARTICLE_MAX_CHARS)
+        self.rag_chain = build_rag_chain(self.retriever, self.llm, context_packer=self.context_packer,
+                                         parent_expander=self.parent_expander)
+
+        # Semantic cache cho các câu hỏi lặp lại với cách diễn đạt khác nhau
+        answer_cache = None
+        if SEMANTIC_CACHE_ENABLED:
+            answer_cache = SemanticAnswerCache(
+                embedding_function=self.vector_store_loader.embedding_function,
+                similarity_threshold=SEMANTIC_CACHE_THRESHOLD,
+                max_size=SEMANTIC_CACHE_MAX_SIZE,
+                ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+                version_provider=lambda: read_kb_version(DATABASE_PATH)
+            )
+
+        self.legal_agent = SimpleLegalAgent(
+            retriever=self.retriever,
+            llm=self.llm,
+            rag_chain=self.rag_chain,
+            max_concurrent_subqueries=MAX_CONCURRENT_SUBQUERIES,
+            answer_cache=answer_cache,
+            article_index=article_index,
+            answer_chain=build_answer_chain(self.llm, context_packer=self.context_packer),
+            max_history_turns=MAX_HISTORY_TURNS,
+            callbacks=[MetricsCallbackHandler()]
+        )
+        self.startup_timings["chains"] = time.perf_counter() - chain_start
+        self.startup_timings["total"] = time.perf_counter() - start_time
+
+        breakdown = ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in self.startup_timings.items())
+        logger.info(f" Thời gian khởi động theo thành phần: {breakdown}")
+        logger.info("Tất cả thành phần đã sẵn sàng!")
+        return True
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Số liệu theo dõi (span, lượt gọi LLM, token, cache) kèm thống kê của các thành phần, dạng JSON"""
+        snapshot = metrics.registry.to_dict()
+        components = {}
+        if self.context_packer is not None:
+            components["context_packer"] = self.context_packer.get_stats()
+        if self.parent_expander is not None:
+            components["parent_child"] = self.parent_expander.get_stats()
+        if self.legal_agent is not None and self.legal_agent.answer_cache is not None:
+            components["answer_cache"] = self.legal_agent.answer_cache.get_stats()
+        if getattr(self.llm_connector, "cache_store", None) is not None:
+            components["llm_cache"] = self.llm_connector.cache_store.get_stats()
+        if getattr(self.llm_connector, "scheduler", None) is not None:
+            components["llm_scheduler"] = self.llm_connector.scheduler.get_stats()
+        retriever = getattr(self.retriever, "vector_retriever", self.retriever)
+        if hasattr(retriever, "get_stats"):
+            components["retriever"] = retriever.get_stats()
+        snapshot["components"] = components
+        snapshot["startup_timings"] = dict(self.startup_timings)
+        return snapshot
+
+    def prime_queries(self, questions: List[str]) -> int:
+        """
+        Encode trước trong một lần gọi model mọi truy vấn mà Agent sẽ dùng cho lô câu hỏi
+        (câu hỏi gốc và các truy vấn con đã lập), để các bước sau chỉ tra cache.
+        """
+        embedding_function = self.vector_store_loader.embedding_function
+        if not self.ready or not hasattr(embedding_function, "prime"):
+            return 0
+        queries = []
+        for question in questions:
+            queries.extend(self.legal_agent.planned_queries(question))
+        return embedding_function.prime(queries)
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from llm_scheduler import LLMScheduler
+
+# Ước lượng thô số token của prompt khi chưa có tokenizer của model (~4 ký tự/token)
+CHARS_PER_TOKEN = 4
+
+
+def _total_tokens(message: BaseMessage) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    Bọc một chat model để mọi lượt gọi upstream đi qua LLMScheduler: chờ quota request/token mỗi phút
+    theo làn ưu tiên hiện tại, thử lại khi gặp 429/lỗi tạm thời, và gộp các prompt giống hệt nhau đang chạy.
+    Stream chỉ được thử lại khi chưa nhận được chunk nào; lượt gộp vào một stream đang chạy nhận toàn bộ
+    câu trả lời trong một chunk khi stream đó kết thúc.
+    """
+    llm: BaseChatModel
+    scheduler: LLMScheduler
+    expected_completion_tokens: int = 512
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scheduled-{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return getattr(self.llm, "_identifying_params", {}) or {}
+
+    def _estimate_tokens(self, messages: List[BaseMessage]) -> int:
+        chars = sum(len(message.content) if isinstance(message.content, str) else len(str(message.content))
+                    for message in messages)
+        return chars // CHARS_PER_TOKEN + self.expected_completion_tokens
+
+    def _request_key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        payload = {"params": self._identifying_params, "messages": [[m.type, m.content] for m in messages],
+                   "stop": stop, "kwargs": kwargs}
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _result(content: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _call_with_retry(self, call: Callable[[], ChatResult], estimate: int) -> ChatResult:
+        attempt = 0
+        while True:
+            self.scheduler.acquire(estimate)
+            try:
+                result = call()
+            except Exception as e:
+                delay = self.scheduler.on_error(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.scheduler.record_usage(estimate, _total_tokens(result.generations[0].message))
+            return result
+
+    async def _acall_with_retry(self, call: Callable[[], Any], estimate: int) -> ChatResult:
+        attempt = 0
+        while True:
+            await self.scheduler.aacquire(estimate)
+            try:
+                result = await call()
+            except Exception as e:
+                delay = self.scheduler.on_error(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.scheduler.record_usage(estimate, _total_tokens(result.generations[0].message))
+            return result
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        key = self._request_key(messages, stop, kwargs)
+        future, leader = self.scheduler.join_in_flight(key)
+        if not leader:
+            return self._result(future.result())
+        try:
+            result = self._call_with_retry(
+                lambda: self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                self._estimate_tokens(messages))
+        except BaseException as e:
+            self.scheduler.finish_in_flight(key, future, error=e)
+            raise
+        self.scheduler.finish_in_flight(key, future, result=result.generations[0].message.content)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        key = self._request_key(messages, stop, kwargs)
+        future, leader = self.scheduler.join_in_flight(key)
+        if not leader:
+            return self._result(await asyncio.wrap_future(future))
+        try:
+            result = await self._acall_with_retry(
+                lambda: self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                self._estimate_tokens(messages))
+        except BaseException as e:
+            self.scheduler.finish_in_flight(key, future, error=e)
+            raise
+        self.scheduler.finish_in_flight(key, future, result=result.generations[0].message.content)
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        key = self._request_key(messages, stop, kwargs)
+        future, leader = self.scheduler.join_in_flight(key)
+        if not leader:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=future.result()))
+            return
+        estimate = self._estimate_tokens(messages)
+        parts, usage, attempt = [], None, 0
+        try:
+            while True:
+                self.scheduler.acquire(estimate)
+                try:
+                    for chunk in self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        parts.append(chunk.text)
+                        usage = _total_tokens(chunk.message) or usage
+                        yield chunk
+                    break
+                except Exception as e:
+                    delay = None if parts else self.scheduler.on_error(attempt, e)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            self.scheduler.finish_in_flight(key, future, error=e)
+            raise
+        self.scheduler.record_usage(estimate, usage)
+        self.scheduler.finish_in_flight(key, future, result="".join(parts))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._request_key(messages, stop, kwargs)
+        future, leader = self.scheduler.join_in_flight(key)
+        if not leader:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=await asyncio.wrap_future(future)))
+            return
+        estimate = self._estimate_tokens(messages)
+        parts, usage, attempt = [], None, 0
+        try:
+            while True:
+                await self.scheduler.aacquire(estimate)
+                try:
+                    async for chunk in self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        parts.append(chunk.text)
+                        usage = _total_tokens(chunk.message) or usage
+                        yield chunk
+                    break
+                except Exception as e:
+                    # Đã trả chunk cho người gọi thì không thể thử lại mà không lặp nội dung
+                    delay = None if parts else self.scheduler.on_error(attempt, e)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        except BaseException as e:
+            self.scheduler.finish_in_flight(key, future, error=e)
+            raise
+        self.scheduler.record_usage(estimate, usage)
+        self.scheduler.finish_in_flight(key, future, result="".join(parts))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.vectorstores import VectorStore  # noqa: E402
+
+from adaptive_retriever import AdaptiveRetriever  # noqa: E402
+from numpy_vector_store import NumpyVectorIndex, NumpyVectorStore  # noqa: E402
+
+COSINES = [0.6, 0.59, 0.2]
+
+
+class FixedEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def _unit(cosine: float):
+    return [cosine, float(np.sqrt(1.0 - cosine ** 2))]
+
+
+class FakeChroma(VectorStore):
+    """Như langchain Chroma với collection mặc định (hnsw:space = "l2"): điểm thô là bình phương khoảng cách L2"""
+    def __init__(self):
+        self._collection = type("Collection", (), {"metadata": None})()
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return [(Document(page_content=f"doc {i}"), 2.0 - 2.0 * cosine) for i, cosine in enumerate(COSINES[:k])]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError
+
+
+def _numpy_store() -> NumpyVectorStore:
+    embeddings = np.asarray([_unit(cosine) for cosine in COSINES], dtype=np.float32)
+    index = NumpyVectorIndex([f"id{i}" for i in range(3)], [f"doc {i}" for i in range(3)], [{} for _ in range(3)],
+                             embeddings)
+    return NumpyVectorStore(index, FixedEmbeddings())
+
+
+@pytest.mark.parametrize("make_store", [FakeChroma, _numpy_store])
+def test_threshold_is_cosine_similarity_on_every_backend(make_store):
+    retriever = AdaptiveRetriever(vectorstore=make_store(), k=2, min_top_score=0.65, min_score_margin=0.0)
+    scored = retriever._search("câu hỏi")
+    assert [round(score, 4) for _, score in scored] == [0.6, 0.59]
+    assert not retriever._is_confident(scored)
+
+    retriever.min_top_score = 0.55
+    assert retriever._is_confident(scored)
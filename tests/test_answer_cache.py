@@ -0,0 +1,55 @@
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, legal_references
+
+
+class FakeEmbeddings:
+    """Embedding giả: mọi câu hỏi gần như trùng nhau, giống sbert với các câu chỉ khác số Điều"""
+    def embed_query(self, text: str):
+        seed = sum(text.encode('utf-8')) % 7
+        return [1.0, 0.001 * seed, 0.0]
+
+
+def test_legal_references_are_normalized():
+    assert legal_references("Khoản 2 điều 5 quy định gì?") == (("khoản", "2"), ("điều", "5"))
+    assert legal_references("Điều 5 và Điều 5") == (("điều", "5"),)
+    assert legal_references("Dữ liệu cá nhân là gì?") == ()
+
+
+def test_questions_about_different_articles_do_not_collide():
+    cache = SemanticAnswerCache(FakeEmbeddings(), similarity_threshold=0.92)
+    cache.put("Điều 5 quy định gì?", "Nội dung Điều 5\n📚 Nguồn: Điều 5")
+
+    assert cache.get("Điều 6 quy định gì?") is None
+    assert cache.get("Khoản 1 Điều 5 quy định gì?") is None
+    assert cache.get("điều 5 quy định gì?") == "Nội dung Điều 5\n📚 Nguồn: Điều 5"
+
+    cache.put("Điều 6 quy định gì?", "Nội dung Điều 6\n📚 Nguồn: Điều 6")
+    assert cache.get("Điều 6 quy định gì?") == "Nội dung Điều 6\n📚 Nguồn: Điều 6"
+    assert cache.get("Điều 5 quy định gì?") == "Nội dung Điều 5\n📚 Nguồn: Điều 5"
+
+
+def test_expired_best_match_does_not_hide_fresh_match():
+    vectors = {"cũ": [1.0, 0.3, 0.0], "mới": [1.0, -0.3, 0.0], "hỏi": [1.0, 0.05, 0.0]}
+    embeddings = type("Embeddings", (), {"embed_query": lambda self, text: vectors[text]})()
+    cache = SemanticAnswerCache(embeddings, similarity_threshold=0.9, ttl_seconds=3600)
+    cache.put("cũ", "câu trả lời cũ")
+    cache.put("mới", "câu trả lời mới")
+    oldest = next(iter(cache._entries))
+    cache._entries[oldest]["created_at"] -= 7200
+
+    assert cache.get("hỏi") == "câu trả lời mới"
+    assert np.count_nonzero(cache._valid) == 1
+
+
+def test_repeated_put_updates_slot_in_place():
+    cache = SemanticAnswerCache(FakeEmbeddings(), similarity_threshold=0.92, max_size=2)
+    cache.put("Điều 7 quy định gì?", "Điều 7")
+    cache.put("Điều 8 quy định gì?", "Điều 8")
+    cache.put("Điều 7 quy định gì?", "Điều 7 (mới)")
+    cache.put("điều 7 quy định gì vậy?", "Điều 7 (mới nhất)")
+
+    stats = cache.get_stats()
+    assert stats['size'] == 2 and stats['evictions'] == 0
+    assert cache.get("Điều 8 quy định gì?") == "Điều 8"
+    assert cache.get("Điều 7 quy định gì?") == "Điều 7 (mới nhất)"
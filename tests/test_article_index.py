@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from article_index import ArticleIndex  # noqa: E402
+
+
+def _chunk(source: str, article: int, chapter: str = "Chương I"):
+    content = f"Điều {article}. Tiêu đề\nNội dung Điều {article} của {source}"
+    metadata = {"article": article, "chapter": chapter, "heading": f"Điều {article}. Tiêu đề", "source_file": source}
+    return f"{source}-{article}", content, metadata
+
+
+def _index(*chunks) -> ArticleIndex:
+    ids, documents, metadatas = zip(*chunks)
+    return ArticleIndex.build(list(ids), list(documents), list(metadatas))
+
+
+def test_same_article_number_in_two_documents_is_ambiguous():
+    index = _index(_chunk("luat_bvdl.txt", 12), _chunk("nghi_dinh_13.txt", 12), _chunk("nghi_dinh_13.txt", 40))
+
+    assert 12 in index
+    assert index.resolve_source([12]) is None
+    assert index.resolve_source([12], "Điều 12 Nghị định 13 quy định gì?") == "nghi_dinh_13.txt"
+    assert index.resolve_source([12, 40]) == "nghi_dinh_13.txt"
+
+    docs = index.get_documents([12], "luat_bvdl.txt")
+    assert [doc.metadata["source_file"] for doc in docs] == ["luat_bvdl.txt"]
+    assert index.get_articles_in_chapter("Chương I", "nghi_dinh_13.txt") == [12, 40]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _index(_chunk("a.txt", 1), _chunk("b.txt", 1), _chunk("b.txt", 2))
+    path = tmp_path / "index.json"
+    index.save(str(path))
+
+    loaded = ArticleIndex.load(str(path))
+    assert loaded.articles == index.articles
+    assert loaded.chapters == index.chapters
+    assert loaded.resolve_source([2]) == "b.txt"
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import metrics  # noqa: E402
+from llm_cache import CachedChatModel, LLMResponseStore  # noqa: E402
+from local_llm import DeterministicChatModel  # noqa: E402
+from metrics_callback import MetricsCallbackHandler  # noqa: E402
+
+
+@pytest.fixture
+def model(tmp_path):
+    store = LLMResponseStore(str(tmp_path / "llm_cache.sqlite3"))
+    return CachedChatModel(llm=DeterministicChatModel(), store=store, model_name="local", mode="on")
+
+
+def test_cache_hits_are_not_counted_as_llm_calls(model):
+    metrics.registry.reset()
+    config = {"callbacks": [MetricsCallbackHandler()]}
+
+    async def main():
+        with metrics.trace() as trace:
+            first = await model.ainvoke("Xin chào", config=config)
+            second = await model.ainvoke("Xin chào", config=config)
+            streamed = "".join([chunk.content async for chunk in model.astream("Xin chào", config=config)])
+        return first, second, streamed, trace
+
+    first, second, streamed, trace = asyncio.run(main())
+    assert first.content == second.content == streamed
+    assert trace.llm_calls == 1
+    assert metrics.registry.counter_value("rag_llm_calls_total", {"stage": "llm.generation"}) == 1
+    assert metrics.registry.counter_value("rag_llm_cached_responses_total", {"stage": "llm.generation"}) == 2
+    assert metrics.registry.counter_value("rag_cache_hits_total", {"cache": "llm_response"}) == 2
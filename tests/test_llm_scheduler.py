@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import LLMScheduler, is_rate_limit_error, llm_priority
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def _empty_request_bucket(requests_per_minute: float = 600) -> LLMScheduler:
+    """Scheduler vừa hết quota request: mỗi lượt được cấp phải chờ bucket nạp lại (0,1 giây với 600/phút)"""
+    scheduler = LLMScheduler(requests_per_minute=requests_per_minute, tokens_per_minute=0)
+    scheduler.requests.level = 0.0
+    return scheduler
+
+
+def test_interactive_waiter_is_admitted_before_queued_batch_waiters():
+    scheduler = _empty_request_bucket()
+    admitted = []
+
+    async def wait(name: str, priority: str):
+        await scheduler.aacquire(1, priority=priority)
+        admitted.append(name)
+
+    async def main():
+        with llm_priority("batch"):
+            batch = [asyncio.create_task(wait(f"batch{i}", None)) for i in range(3)]
+        await asyncio.sleep(0)  # các lượt batch đã vào hàng đợi
+        interactive = asyncio.create_task(wait("interactive", "interactive"))
+        await asyncio.gather(*batch, interactive)
+
+    asyncio.run(main())
+    assert admitted == ["interactive", "batch0", "batch1", "batch2"]
+    assert scheduler.get_stats()['waiting'] == 0
+
+
+def test_threaded_acquire_respects_priority():
+    scheduler = _empty_request_bucket()
+    admitted = []
+    lock = threading.Lock()
+
+    def wait(name: str, priority: str):
+        scheduler.acquire(1, priority=priority)
+        with lock:
+            admitted.append(name)
+
+    batch = [threading.Thread(target=wait, args=(f"batch{i}", "batch")) for i in range(2)]
+    for thread in batch:
+        thread.start()
+    while scheduler.get_stats()['waiting'] < 2:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=wait, args=("interactive", "interactive"))
+    interactive.start()
+    for thread in batch + [interactive]:
+        thread.join(timeout=5)
+    assert admitted[0] == "interactive"
+    assert sorted(admitted[1:]) == ["batch0", "batch1"]
+
+
+def test_invalid_priority_is_rejected():
+    with pytest.raises(ValueError):
+        with llm_priority("urgent"):
+            pass
+
+
+def test_rate_limit_pauses_all_callers_and_stops_after_max_retries():
+    scheduler = LLMScheduler(requests_per_minute=0, tokens_per_minute=0, max_retries=2,
+                             backoff_base_seconds=0.01, backoff_max_seconds=0.05)
+    error = RateLimitError("Rate limit reached")
+    assert is_rate_limit_error(error)
+
+    delays = [scheduler.on_error(attempt, error) for attempt in range(3)]
+    assert all(0 < delay <= 0.05 for delay in delays[:2])
+    assert delays[2] is None
+    stats = scheduler.get_stats()
+    assert stats['retries'] == 2 and stats['rate_limited'] == 2
+    assert scheduler._paused_until > 0
+
+
+def test_non_retryable_error_is_not_retried():
+    scheduler = LLMScheduler(max_retries=5)
+    assert scheduler.on_error(0, ValueError("prompt không hợp lệ")) is None
+    assert not is_rate_limit_error(ValueError("Điều 429"))
+
+
+def test_retry_after_header_is_honoured():
+    scheduler = LLMScheduler(backoff_base_seconds=0.01, backoff_max_seconds=30.0)
+    error = RateLimitError("Rate limit reached")
+    error.response = type("Response", (), {"headers": {"retry-after": "7"}})()
+    assert scheduler.backoff_seconds(0, error) == 7.0
+
+
+def test_leader_failure_reaches_every_follower_and_clears_in_flight():
+    scheduler = LLMScheduler()
+    future, leader = scheduler.join_in_flight("prompt")
+    followers = [scheduler.join_in_flight("prompt") for _ in range(3)]
+    assert leader and not any(is_leader for _, is_leader in followers)
+    assert all(follower is future for follower, _ in followers)
+
+    error = RuntimeError("upstream lỗi")
+    scheduler.finish_in_flight("prompt", future, error=error)
+    for follower, _ in followers:
+        with pytest.raises(RuntimeError):
+            follower.result(timeout=1)
+    assert scheduler._in_flight == {}
+    assert scheduler.get_stats()['coalesced'] == 3
+
+    # Lượt gọi sau khi leader thất bại trở thành leader mới thay vì nhận lại lỗi cũ
+    _, leader = scheduler.join_in_flight("prompt")
+    assert leader
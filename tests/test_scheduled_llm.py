@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from llm_scheduler import LLMScheduler  # noqa: E402
+from local_llm import DeterministicChatModel  # noqa: E402
+from scheduled_llm import ScheduledChatModel  # noqa: E402
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class CountingChatModel(DeterministicChatModel):
+    """LLM cục bộ đếm số lượt gọi upstream; `error` (nếu có) được raise sau độ trễ mô phỏng"""
+    calls: int = 0
+    error: str = ""
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        if self.error == "rate_limit":
+            raise RateLimitError("Rate limit reached")
+        if self.error:
+            raise ValueError(self.error)
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+def _scheduled(upstream: CountingChatModel, **scheduler_kwargs) -> ScheduledChatModel:
+    scheduler = LLMScheduler(**{"requests_per_minute": 0, "tokens_per_minute": 0, **scheduler_kwargs})
+    return ScheduledChatModel(llm=upstream, scheduler=scheduler)
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    upstream = CountingChatModel(latency_ms=50)
+    model = _scheduled(upstream)
+
+    async def main():
+        return await asyncio.gather(*(model.ainvoke("Xin chào") for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert upstream.calls == 1
+    assert len({result.content for result in results}) == 1
+    assert model.scheduler.get_stats()['coalesced'] == 4
+    assert model.scheduler._in_flight == {}
+
+
+def test_identical_concurrent_streams_share_one_upstream_stream():
+    upstream = CountingChatModel(latency_ms=50)
+    model = _scheduled(upstream)
+
+    async def collect() -> str:
+        return "".join([chunk.content async for chunk in model.astream("Xin chào")])
+
+    async def main():
+        return await asyncio.gather(*(collect() for _ in range(3)))
+
+    answers = asyncio.run(main())
+    assert upstream.calls == 1
+    assert len(set(answers)) == 1 and answers[0]
+    assert model.scheduler._in_flight == {}
+
+
+def test_persistent_rate_limit_reaches_caller_after_max_retries():
+    upstream = CountingChatModel(error="rate_limit")
+    model = _scheduled(upstream, max_retries=2, backoff_base_seconds=0.001, backoff_max_seconds=0.01)
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(model.ainvoke("Xin chào"))
+    assert upstream.calls == 3
+    stats = model.scheduler.get_stats()
+    assert stats['retries'] == 2 and stats['rate_limited'] == 2
+    assert model.scheduler._in_flight == {}
+
+
+def test_leader_failure_is_raised_to_every_follower():
+    upstream = CountingChatModel(latency_ms=50, error="upstream lỗi")
+    model = _scheduled(upstream)
+
+    async def main():
+        return await asyncio.gather(*(model.ainvoke("Xin chào") for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert upstream.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert model.scheduler._in_flight == {}
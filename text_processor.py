@@ -1,11 +1,21 @@
-import re
+import hashlib
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 from pathlib import Path
-from datetime import datetime
+
+from law_parser import LawStructureParser, LawUnit, format_clauses, normalize_line
 
 logger = logging.getLogger(__name__)
 
+
+def make_chunk_id(prefix: str, content: str, source: str = "") -> str:
+    """
+    Tạo ID xác định (deterministic) cho chunk từ hash nội dung, để build lại cùng một
+    văn bản cho ra cùng các ID thay vì tạo bản sao mới.
+    """
+    digest = hashlib.sha1(f"{source}\x00{content}".encode('utf-8')).hexdigest()[:20]
+    return f"{prefix}_{digest}"
+
 class TextProcessor:
     """
     Lớp xử lý văn bản đầu vào, bao gồm đọc, làm sạch và các chiến lược phân đoạn thông minh.
@@ -32,16 +42,12 @@ class TextProcessor:
         if not text or not text.strip():
             return ""
 
-        text = re.sub(r'\r\n', '\n', text)
-        text = re.sub(r'[ \t]+', ' ', text)
-
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        cleaned_text = '\n'.join(lines)
+        cleaned_text = '\n'.join(line for line in map(normalize_line, text.splitlines()) if line)
 
         logger.info(f" Văn bản sau khi làm sạch: {len(cleaned_text)} ký tự")
         return cleaned_text
 
-    def _split_by_sentence(self, text: str, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
+    def _split_by_sentence(self, text: str, chunk_size: int, overlap: int, source: str = "") -> List[Dict[str, Any]]:
         """
         Chiến lược chunking cơ bản: chia theo câu và ghép lại.
         Đây là phương thức nội bộ (private method).
@@ -60,9 +66,9 @@ class TextProcessor:
         docs = text_splitter.split_text(text)
 
         chunks = []
-        for i, doc_content in enumerate(docs):
+        for doc_content in docs:
             chunks.append({
-                "id": f"chunk_sent_{datetime.now().timestamp()}_{i}",
+                "id": make_chunk_id("chunk_sent", doc_content, source),
                 "content": doc_content,
                 "length": len(doc_content)
             })
@@ -70,70 +76,124 @@ class TextProcessor:
         logger.info(f" Đã tạo {len(chunks)} chunks theo câu.")
         return chunks
 
-    def _split_by_law_article(self, text: str, max_chars_per_chunk: int) -> List[Dict[str, Any]]:
+    def _law_unit_chunks(self, units: Iterable[LawUnit], max_chars_per_chunk: int, source: str = "",
+                         clause_level: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Chuyển các đơn vị cấu trúc (Điều, tiêu đề Chương/Mục, ...) thành chunk, mỗi chunk mang metadata cấu trúc:
+        heading, law_part (Phần), chapter (Chương), section (Mục), article (số Điều, 0 nếu không thuộc Điều nào),
+        article_title, path (đường dẫn cấu trúc) và clauses (các số Khoản trong chunk, dạng "1,2,3"; chỉ có với
+        Điều chia Khoản). Đơn vị dài hơn `max_chars_per_chunk` được chia theo ranh giới Khoản/Điểm, metadata có
+        thêm "part" (thứ tự phần). Với clause_level=True, các Điều có Khoản được chia thành chunk con cấp Khoản
+        (_clause_chunks).
+        """
+        for unit in units:
+            content = unit.content
+            metadata = unit.metadata()
+            if clause_level and unit.article and unit.clauses:
+                yield from self._clause_chunks(unit, max_chars_per_chunk, source)
+                continue
+            if len(content) <= max_chars_per_chunk:
+                if unit.clauses:
+                    metadata["clauses"] = format_clauses(unit.clause_numbers())
+                yield {"id": make_chunk_id("chunk_law", content, source), "content": content, "length": len(content),
+                       "metadata": metadata}
+                continue
+            logger.info(f" '{unit.heading}' dài {len(content)} ký tự, chia theo Khoản/Điểm.")
+            for part_index, (clauses, part) in enumerate(unit.split(max_chars_per_chunk)):
+                part_metadata = {**metadata, "part": part_index}
+                if clauses:
+                    part_metadata["clauses"] = format_clauses(clauses)
+                yield {"id": make_chunk_id("chunk_law", part, source), "content": part, "length": len(part),
+                       "metadata": part_metadata}
+
+    def _clause_chunks(self, unit: LawUnit, max_chars_per_chunk: int, source: str = "") -> Iterator[Dict[str, Any]]:
         """
-        Chiến lược chunking thông minh: chia theo cấu trúc Chương, Điều của văn bản luật.
+        Chunk con cấp Khoản của một Điều để embed và so khớp: mỗi chunk gồm dòng tiêu đề Điều và một Khoản
+        (hoặc một nhóm Điểm nếu Khoản quá dài). Metadata có thêm "clause" (số Khoản, 0 = phần dẫn), "part"
+        (thứ tự trong Điều) và "parent_id" để ghép lại Điều cha khi truy xuất (ArticleIndex.get_parent).
+        """
+        prefix = f"{unit.heading}\n"
+        metadata = {**unit.metadata(), "parent_id": make_chunk_id("article", unit.content, source)}
+        budget = max(max_chars_per_chunk - len(prefix), max_chars_per_chunk // 2)
+        for part_index, (clause, body) in enumerate(unit.children(budget)):
+            content = prefix + body
+            yield {"id": make_chunk_id("chunk_clause", content, source), "content": content, "length": len(content),
+                   "metadata": {**metadata, "clause": clause, "part": part_index}}
+
+    def _split_by_law_article(self, text: str, max_chars_per_chunk: int, source: str = "") -> List[Dict[str, Any]]:
+        """
+        Chiến lược chunking thông minh: chia theo cấu trúc Phần/Chương/Mục/Điều của văn bản luật.
         Đây là phương thức nội bộ (private method).
         """
         logger.info("Áp dụng chiến lược chunking thông minh theo Điều luật...")
+        chunks = list(self._law_unit_chunks(LawStructureParser().parse_text(text), max_chars_per_chunk, source))
+        logger.info(f" Đã tạo {len(chunks)} chunks dựa trên cấu trúc Điều/Chương.")
+        return chunks
 
-        raw_parts = re.split(r'(Chương [IVXLCDM\d]+.*?)\n|(Điều \d+\..*?)\n', text)
-        parts = [p.strip() for p in raw_parts if p and p.strip()]
-
-        chunks = []
-        current_heading = ""
-        current_content = ""
-        chunk_id_counter = 0
-
-        for part in parts:
-            is_heading = part.startswith("Chương") or part.startswith("Điều")
-
-            if is_heading and current_content:
-                full_content = (current_heading + "\n" + current_content).strip()
-                chunks.append({
-                    "id": f"chunk_law_{datetime.now().timestamp()}_{chunk_id_counter}",
-                    "content": full_content,
-                    "length": len(full_content),
-                    "metadata": {"heading": current_heading}
-                })
-                chunk_id_counter += 1
-
-                current_heading = part
-                current_content = ""
-            elif is_heading:
-                current_heading = part
-            else:
-                current_content += "\n" + part
-
-        if current_content:
-            full_content = (current_heading + "\n" + current_content).strip()
-            chunks.append({
-                "id": f"chunk_law_{datetime.now().timestamp()}_{chunk_id_counter}",
-                "content": full_content,
-                "length": len(full_content),
-                "metadata": {"heading": current_heading}
-            })
-
-        final_chunks = []
-        for chunk in chunks:
-            if chunk['length'] > max_chars_per_chunk:
-                logger.warning(f" Chunk '{chunk['metadata']['heading']}' quá dài ({chunk['length']} ký tự). Sẽ chia nhỏ hơn.")
-                smaller_chunks_data = self._split_by_sentence(chunk['content'], max_chars_per_chunk, overlap=int(max_chars_per_chunk*0.1))
-                final_chunks.extend(smaller_chunks_data)
-            else:
-                final_chunks.append(chunk)
+    def _split_by_law_clause(self, text: str, max_chars_per_chunk: int, source: str = "") -> List[Dict[str, Any]]:
+        """
+        Chiến lược chunking cha-con: chunk cấp Khoản/Điểm (tối đa `max_chars_per_chunk` ký tự) liên kết với Điều cha.
+        Đây là phương thức nội bộ (private method).
+        """
+        logger.info("Áp dụng chiến lược chunking cấp Khoản (cha-con)...")
+        chunks = list(self._law_unit_chunks(LawStructureParser().parse_text(text), max_chars_per_chunk, source,
+                                            clause_level=True))
+        logger.info(f" Đã tạo {len(chunks)} chunks cấp Khoản/Điều.")
+        return chunks
 
-        logger.info(f" Đã tạo {len(final_chunks)} chunks dựa trên cấu trúc Điều/Chương.")
-        return final_chunks
+    def iter_law_chunks_from_file(self, file_path: str, max_chars_per_chunk: int, source: str = "",
+                                  clause_level: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Đọc file qua memory map và trả về lần lượt từng chunk theo cấu trúc luật trong một lượt duy nhất
+        (chuẩn hóa khoảng trắng, nhận diện tiêu đề và chia chunk cùng lúc), không cần read_file/clean_text trước.
+        """
+        return self._law_unit_chunks(LawStructureParser().parse_file(file_path), max_chars_per_chunk, source,
+                                     clause_level=clause_level)
 
-    def split_into_chunks(self, text: str, chunk_size: int = 1500, overlap: int = 150, strategy: str = "law_article") -> List[Dict[str, Any]]:
+    def split_into_chunks(self, text: str, chunk_size: int = 1500, overlap: int = 150, strategy: str = "law_article", source: str = "") -> List[Dict[str, Any]]:
         """
         Phương thức chính để phân đoạn văn bản, có thể chọn chiến lược.
+        `source` (tên file) được đưa vào hash của ID để cùng một đoạn văn ở hai file khác nhau không trùng ID.
         """
         if strategy == "law_article":
-            return self._split_by_law_article(text, max_chars_per_chunk=chunk_size)
+            chunks = self._split_by_law_article(text, max_chars_per_chunk=chunk_size, source=source)
+        elif strategy == "law_clause":
+            chunks = self._split_by_law_clause(text, max_chars_per_chunk=chunk_size, source=source)
         elif strategy == "sentence":
-            return self._split_by_sentence(text, chunk_size, overlap)
+            chunks = self._split_by_sentence(text, chunk_size, overlap, source=source)
         else:
             logger.error(f" Chiến lược chunking không hợp lệ: {strategy}. Sử dụng 'sentence' làm mặc định.")
-            return self._split_by_sentence(text, chunk_size, overlap)
+            chunks = self._split_by_sentence(text, chunk_size, overlap, source=source)
+
+        return self._dedupe(chunks)
+
+    def split_file_into_chunks(self, file_path: str, chunk_size: int = 1500, overlap: int = 150, strategy: str = "law_article", source: str = "") -> List[Dict[str, Any]]:
+        """
+        Như split_into_chunks nhưng đọc trực tiếp từ file. Với chiến lược "law_article"/"law_clause", file được
+        phân tích theo luồng (iter_law_chunks_from_file) thay vì đọc, làm sạch rồi mới chia chunk.
+        """
+        if strategy not in ("law_article", "law_clause"):
+            text = self.clean_text(self.read_file(file_path))
+            return self.split_into_chunks(text, chunk_size, overlap, strategy, source) if text else []
+        try:
+            chunks = list(self.iter_law_chunks_from_file(file_path, chunk_size, source,
+                                                         clause_level=strategy == "law_clause"))
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error(f" Lỗi khi đọc file: {e}")
+            return []
+        logger.info(f" Đã tạo {len(chunks)} chunks dựa trên cấu trúc Điều/Chương từ {Path(file_path).name}.")
+        return self._dedupe(chunks)
+
+    @staticmethod
+    def _dedupe(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Các chunk có nội dung giống hệt nhau sẽ có cùng ID, chỉ giữ lại chunk đầu tiên
+        unique_chunks = []
+        seen_ids = set()
+        for chunk in chunks:
+            if chunk['id'] in seen_ids:
+                continue
+            seen_ids.add(chunk['id'])
+            unique_chunks.append(chunk)
+        if len(unique_chunks) < len(chunks):
+            logger.warning(f" Bỏ qua {len(chunks) - len(unique_chunks)} chunks trùng lặp nội dung.")
+        return unique_chunks
@@ -1,35 +1,110 @@
+import shutil
 import logging
-from typing import List, Dict, Any
+from collections import OrderedDict
+from typing import List, Dict, Any, Set
 from pathlib import Path
 import chromadb
+import numpy as np
+
+from numpy_vector_store import NumpyVectorIndex, numpy_index_dir, normalize_rows
+from vector_quantization import ProductQuantizationCodec
 
 logger = logging.getLogger(__name__)
 
+
+def chunk_metadata(chunk: Dict[str, Any], source_file: str) -> Dict[str, Any]:
+    """
+    Metadata được lưu kèm mỗi chunk, dùng chung cho mọi backend: file nguồn, độ dài và
+    metadata cấu trúc do TextProcessor sinh ra (heading, chapter, section, article, clauses, ...).
+    Chroma chỉ chấp nhận giá trị str/int/float/bool nên các giá trị khác bị bỏ qua.
+    """
+    metadata = {
+        key: value for key, value in chunk.get('metadata', {}).items()
+        if isinstance(value, (str, int, float, bool))
+    }
+    metadata.update({'source_file': source_file, 'length': chunk['length']})
+    return metadata
+
+
 class VectorDatabase:
     """Lưu trữ và quản lý vector database bằng ChromaDB"""
-    def __init__(self, db_path: str, collection_name: str = "documents"):
+    def __init__(self, db_path: str, collection_name: str = "documents", batch_size: int = 1000):
         self.db_path = Path(db_path)
         self.collection_name = collection_name
         self.db_path.mkdir(exist_ok=True)
         self.client = chromadb.PersistentClient(path=str(self.db_path))
         self.collection = self.client.get_or_create_collection(name=self.collection_name)
+        # Chroma giới hạn số bản ghi cho mỗi lần ghi, không được vượt quá giới hạn này
+        try:
+            self.batch_size = max(1, min(batch_size, self.client.get_max_batch_size()))
+        except Exception:
+            self.batch_size = max(1, batch_size)
         logger.info(f" Đã kết nối/tạo thành công collection '{self.collection_name}' tại '{self.db_path}'")
 
-    def add_documents(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]], source_file: str):
-        if not chunks or not embeddings or len(chunks) != len(embeddings):
+    def add_documents(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, source_file: str):
+        if not chunks or len(embeddings) == 0 or len(chunks) != len(embeddings):
             logger.error(" Số lượng chunks và embeddings không khớp.")
             return False
         try:
             ids = [chunk['id'] for chunk in chunks]
             documents = [chunk['content'] for chunk in chunks]
-            metadatas = [{'source_file': source_file, 'length': chunk['length']} for chunk in chunks]
-            self.collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+            metadatas = [chunk_metadata(chunk, source_file) for chunk in chunks]
+            for start in range(0, len(ids), self.batch_size):
+                end = start + self.batch_size
+                self.collection.upsert(ids=ids[start:end], documents=documents[start:end],
+                                       embeddings=embeddings[start:end], metadatas=metadatas[start:end])
             logger.info(f" Đã thêm {len(chunks)} documents vào vector database.")
             return True
         except Exception as e:
             logger.error(f" Lỗi khi thêm documents: {e}")
             return False
 
+    def reset(self):
+        """Xóa và tạo lại collection"""
+        try:
+            self.client.delete_collection(name=self.collection_name)
+            self.collection = self.client.create_collection(name=self.collection_name)
+            logger.info(f" Đã tạo lại collection '{self.collection_name}' thành công.")
+        except Exception as e:
+            logger.error(f" Lỗi khi tạo lại collection: {e}. Collection không tồn tại.")
+            self.collection = self.client.get_or_create_collection(name=self.collection_name)
+
+    def get_ids_by_source(self, source_file: str) -> Set[str]:
+        """Lấy ID của tất cả chunks đã lưu từ một file nguồn"""
+        try:
+            result = self.collection.get(where={'source_file': source_file}, include=[])
+            return set(result['ids'])
+        except Exception as e:
+            logger.error(f" Lỗi khi lấy danh sách chunks của '{source_file}': {e}")
+            return set()
+
+    def get_sources(self) -> Set[str]:
+        """Tên các file nguồn đang có chunk trong collection"""
+        result = self.collection.get(include=['metadatas'])
+        return {(metadata or {}).get('source_file', '') for metadata in result['metadatas']}
+
+    def delete_ids(self, ids: List[str]) -> bool:
+        if not ids:
+            return True
+        try:
+            ids = list(ids)
+            for start in range(0, len(ids), self.batch_size):
+                self.collection.delete(ids=ids[start:start + self.batch_size])
+            logger.info(f" Đã xóa {len(ids)} documents khỏi vector database.")
+            return True
+        except Exception as e:
+            logger.error(f" Lỗi khi xóa documents: {e}")
+            return False
+
+    def get_all_records(self) -> Dict[str, List[Any]]:
+        """Lấy toàn bộ ids, documents và metadatas (dùng để build các index phụ như BM25)"""
+        result = self.collection.get(include=['documents', 'metadatas'])
+        return {'ids': result['ids'], 'documents': result['documents'], 'metadatas': result['metadatas']}
+
+    def flush(self):
+        """Chroma ghi trực tiếp xuống đĩa sau mỗi lần thêm/xóa, không cần làm gì thêm"""
+        return True
+
     def get_database_info(self) -> Dict[str, Any]:
         try:
             return {
@@ -40,3 +115,125 @@ class VectorDatabase:
         except Exception as e:
             logger.error(f" Lỗi khi lấy thông tin database: {e}")
             return {}
+
+
+class NumpyVectorDatabase:
+    """
+    Backend lưu trữ dạng ma trận NumPy (embeddings.npy + metadata.json) cho NumpyVectorStore.
+    Có cùng giao diện với VectorDatabase. Toàn bộ records (văn bản, metadata, embeddings) được giữ trong
+    bộ nhớ khi build và chỉ ghi ra đĩa khi gọi flush(), kèm mã nén vectors nếu `compression` khác "none";
+    bộ nhớ khi build vì vậy tăng theo kích thước cả knowledge base.
+    """
+    def __init__(self, db_path: str, collection_name: str = "documents", batch_size: int = 1000,
+                 compression: str = "none", pq_subspaces: int = 16):
+        self.db_path = Path(db_path)
+        self.collection_name = collection_name
+        self.batch_size = max(1, batch_size)
+        self.compression = compression
+        self.pq_subspaces = pq_subspaces
+        self.index_dir = numpy_index_dir(str(self.db_path), collection_name)
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._dirty = False
+
+        if (self.index_dir / "metadata.json").exists():
+            index = NumpyVectorIndex.load(str(self.index_dir), mmap=False)
+            for i, doc_id in enumerate(index.ids):
+                self._records[doc_id] = {'document': index.documents[i], 'metadata': index.metadatas[i],
+                                         'embedding': index.embeddings[i]}
+            # Đổi cấu hình nén (kể cả số đoạn PQ) thì ghi lại index kèm mã nén mới ở lần flush tới dù dữ liệu không đổi
+            stored_compression = index.codec.name if index.codec is not None else "none"
+            if stored_compression != compression:
+                self._dirty = True
+            elif compression == "pq" and len(index.ids):
+                expected = ProductQuantizationCodec._split_count(index.embeddings.shape[1], pq_subspaces)
+                if index.codec.subspaces != expected:
+                    self._dirty = True
+        logger.info(f" Đã mở index NumPy '{self.collection_name}' tại '{self.index_dir}' ({len(self._records)} documents)")
+
+    def upsert_records(self, ids: List[str], documents: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]]):
+        embeddings = normalize_rows(embeddings)
+        for doc_id, document, embedding, metadata in zip(ids, documents, embeddings, metadatas):
+            self._records[doc_id] = {'document': document, 'metadata': metadata, 'embedding': embedding}
+        self._dirty = True
+
+    def add_documents(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, source_file: str):
+        if not chunks or len(embeddings) == 0 or len(chunks) != len(embeddings):
+            logger.error(" Số lượng chunks và embeddings không khớp.")
+            return False
+        try:
+            self.upsert_records([chunk['id'] for chunk in chunks], [chunk['content'] for chunk in chunks],
+                                embeddings, [chunk_metadata(chunk, source_file) for chunk in chunks])
+            logger.info(f" Đã thêm {len(chunks)} documents vào index NumPy.")
+            return True
+        except Exception as e:
+            logger.error(f" Lỗi khi thêm documents: {e}")
+            return False
+
+    def reset(self):
+        """Xóa toàn bộ index"""
+        self._records.clear()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        self._dirty = True
+        logger.info(f" Đã xóa index NumPy '{self.collection_name}'.")
+
+    def get_ids_by_source(self, source_file: str) -> Set[str]:
+        return {doc_id for doc_id, record in self._records.items() if record['metadata'].get('source_file') == source_file}
+
+    def get_sources(self) -> Set[str]:
+        return {record['metadata'].get('source_file', '') for record in self._records.values()}
+
+    def delete_ids(self, ids: List[str]) -> bool:
+        for doc_id in ids:
+            if self._records.pop(doc_id, None) is not None:
+                self._dirty = True
+        if ids:
+            logger.info(f" Đã xóa {len(ids)} documents khỏi index NumPy.")
+        return True
+
+    def get_all_records(self) -> Dict[str, List[Any]]:
+        return {
+            'ids': list(self._records),
+            'documents': [record['document'] for record in self._records.values()],
+            'metadatas': [record['metadata'] for record in self._records.values()],
+        }
+
+    def flush(self):
+        """Ghi index ra đĩa nếu có thay đổi"""
+        if not self._dirty:
+            return True
+        try:
+            ids = list(self._records)
+            records = list(self._records.values())
+            if records:
+                embeddings = np.stack([record['embedding'] for record in records])
+            else:
+                embeddings = np.empty((0, 0), dtype=np.float32)
+            NumpyVectorIndex.save(str(self.index_dir), ids, [record['document'] for record in records],
+                                  [record['metadata'] for record in records], embeddings,
+                                  compression=self.compression, pq_subspaces=self.pq_subspaces)
+            self._dirty = False
+            logger.info(f" Đã ghi {len(ids)} vectors vào '{self.index_dir}'.")
+            return True
+        except Exception as e:
+            logger.error(f" Lỗi khi ghi index NumPy: {e}")
+            return False
+
+    def get_database_info(self) -> Dict[str, Any]:
+        return {
+            'database_path': str(self.index_dir),
+            'collection_name': self.collection_name,
+            'total_documents': len(self._records)
+        }
+
+
+def create_vector_database(backend: str, db_path: str, collection_name: str, batch_size: int = 1000,
+                           compression: str = "none", pq_subspaces: int = 16):
+    """Tạo vector database phía build theo backend cấu hình ("chroma" hoặc "numpy")"""
+    if backend == "numpy":
+        return NumpyVectorDatabase(db_path, collection_name, batch_size=batch_size,
+                                   compression=compression, pq_subspaces=pq_subspaces)
+    if backend != "chroma":
+        logger.error(f" Backend vector không hợp lệ: {backend}. Sử dụng 'chroma' làm mặc định.")
+    if compression != "none":
+        logger.warning(f" VECTOR_COMPRESSION='{compression}' chỉ áp dụng cho backend 'numpy', Chroma lưu float32.")
+    return VectorDatabase(db_path, collection_name, batch_size=batch_size)
@@ -0,0 +1,179 @@
+import logging
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CODES_FILE = "codes.npy"
+CODEC_FILE = "codec.npz"
+COMPRESSIONS = ("none", "float16", "int8", "pq")
+
+
+class VectorCodec:
+    """
+    Nén các vector embedding đã chuẩn hóa thành mã nhỏ gọn và tính điểm inner product xấp xỉ
+    giữa vector truy vấn (float32) với các mã đó. Kết quả xấp xỉ được chấm lại chính xác
+    bằng ma trận float32 gốc trong NumpyVectorIndex.
+    """
+    name = "none"
+
+    def fit(self, vectors: np.ndarray) -> "VectorCodec":
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Điểm xấp xỉ dạng (số truy vấn, số mã)"""
+        raise NotImplementedError
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {}
+
+
+class Float16Codec(VectorCodec):
+    """Lưu vector dạng float16: giảm một nửa bộ nhớ, sai số rất nhỏ"""
+    name = "float16"
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float16)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        return queries @ codes.astype(np.float32).T
+
+
+class Int8Codec(VectorCodec):
+    """Lượng tử hóa vô hướng int8 với hệ số tỉ lệ theo từng chiều: giảm 4 lần bộ nhớ"""
+    name = "int8"
+
+    def __init__(self, scale: np.ndarray = None):
+        self.scale = scale
+
+    def fit(self, vectors: np.ndarray) -> "Int8Codec":
+        scale = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Gộp hệ số tỉ lệ vào vector truy vấn thay vì giải nén cả ma trận mã
+        return (queries * self.scale) @ codes.astype(np.float32).T
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {'scale': self.scale}
+
+
+class ProductQuantizationCodec(VectorCodec):
+    """
+    Product quantization: chia vector thành `subspaces` đoạn, mỗi đoạn được thay bằng chỉ số (uint8)
+    của centroid gần nhất trong codebook k-means riêng. Mỗi vector chỉ còn `subspaces` byte.
+    Điểm xấp xỉ được tính bằng bảng tra inner product giữa truy vấn và các centroid.
+    """
+    name = "pq"
+
+    def __init__(self, subspaces: int = 16, centroids: np.ndarray = None, iterations: int = 20, seed: int = 0,
+                 max_train_vectors: int = 20000):
+        self.subspaces = subspaces
+        self.centroids = centroids  # (subspaces, số centroid, chiều mỗi đoạn)
+        self.iterations = iterations
+        self.seed = seed
+        self.max_train_vectors = max_train_vectors
+
+    @staticmethod
+    def _split_count(dimension: int, subspaces: int) -> int:
+        """Số đoạn lớn nhất không vượt quá `subspaces` và chia hết số chiều"""
+        for count in range(min(subspaces, dimension), 0, -1):
+            if dimension % count == 0:
+                return count
+        return 1
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dimension = vectors.shape
+        return vectors.reshape(n, self.subspaces, dimension // self.subspaces).transpose(1, 0, 2)
+
+    def _kmeans(self, data: np.ndarray, n_centroids: int, rng: np.random.Generator) -> np.ndarray:
+        centroids = data[rng.choice(len(data), n_centroids, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignments = self._nearest(data, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, data)
+            counts = np.bincount(assignments, minlength=n_centroids)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+        return distances.argmin(axis=1)
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizationCodec":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.subspaces = self._split_count(vectors.shape[1], self.subspaces)
+        rng = np.random.default_rng(self.seed)
+        # Codebook chỉ cần huấn luyện trên một mẫu con khi knowledge base lớn
+        if len(vectors) > self.max_train_vectors:
+            vectors = vectors[rng.choice(len(vectors), self.max_train_vectors, replace=False)]
+        n_centroids = min(256, len(vectors))
+        self.centroids = np.stack([self._kmeans(part, n_centroids, rng) for part in self._split(vectors)])
+        logger.info(f" Đã huấn luyện PQ codebook: {self.subspaces} đoạn x {n_centroids} centroid")
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        return np.stack([self._nearest(part, centroids) for part, centroids in zip(parts, self.centroids)],
+                        axis=1).astype(np.uint8)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Bảng tra (số truy vấn, số đoạn, số centroid): inner product của từng đoạn truy vấn với từng centroid
+        tables = np.einsum('qsd,scd->qsc', self._split(queries).transpose(1, 0, 2), self.centroids)
+        scores = np.zeros((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for s in range(self.subspaces):
+            scores += tables[:, s, codes[:, s]]
+        return scores
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {'centroids': self.centroids}
+
+
+def create_codec(compression: str, pq_subspaces: int = 16) -> VectorCodec:
+    if compression == "float16":
+        return Float16Codec()
+    if compression == "int8":
+        return Int8Codec()
+    if compression == "pq":
+        return ProductQuantizationCodec(subspaces=pq_subspaces)
+    raise ValueError(f"VECTOR_COMPRESSION không hợp lệ: '{compression}'. Chọn một trong {COMPRESSIONS}.")
+
+
+def save_codec(index_dir: Path, codec: VectorCodec, codes: np.ndarray, tmp_suffix: str = ".tmp"):
+    """Ghi mã nén và tham số codec ra file tạm; trả về danh sách (file tạm, file đích) để os.replace"""
+    tmp_codes = index_dir / (CODES_FILE + tmp_suffix)
+    with open(tmp_codes, 'wb') as f:
+        np.save(f, np.ascontiguousarray(codes))
+    tmp_codec = index_dir / (CODEC_FILE + tmp_suffix)
+    with open(tmp_codec, 'wb') as f:
+        np.savez(f, name=np.array(codec.name), **codec.params())
+    return [(tmp_codes, index_dir / CODES_FILE), (tmp_codec, index_dir / CODEC_FILE)]
+
+
+def load_codec(index_dir: Path, mmap: bool = True):
+    """Đọc codec và mã nén của index; trả về (None, None) nếu index không được nén"""
+    if not (index_dir / CODEC_FILE).exists():
+        return None, None
+    with np.load(index_dir / CODEC_FILE) as data:
+        name = str(data['name'])
+        if name == "float16":
+            codec = Float16Codec()
+        elif name == "int8":
+            codec = Int8Codec(scale=data['scale'])
+        else:
+            centroids = data['centroids']
+            codec = ProductQuantizationCodec(subspaces=centroids.shape[0], centroids=centroids)
+    codes = np.load(index_dir / CODES_FILE, mmap_mode='r' if mmap else None)
+    return codec, codes
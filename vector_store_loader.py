@@ -1,33 +1,88 @@
 import logging
-import os
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_community.vectorstores import Chroma
+from concurrent.futures import Future
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from query_embedding_cache import QueryEmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+
+class _DeferredEmbeddings(Embeddings):
+    """Embedding function có model đang được tải ở thread khác; chỉ chờ model khi thực sự cần encode"""
+    def __init__(self, embeddings_future: Future):
+        self._embeddings_future = embeddings_future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embeddings_future.result().embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings_future.result().embed_documents(texts)
+
+
 class VectorStoreLoader:
-    def __init__(self, db_directory: str, collection_name: str, embedding_model_name: str):
+    def __init__(self, db_directory: str, collection_name: str, embedding_model_name: str, backend: str = "chroma",
+                 query_batch_size: int = 32, query_batch_wait_ms: float = 5.0, embedding_backend: str = "torch",
+                 rerank_factor: int = 4):
         self.db_directory = db_directory
         self.collection_name = collection_name
         self.embedding_model_name = embedding_model_name
+        self.backend = backend
+        self.query_batch_size = query_batch_size
+        self.query_batch_wait_ms = query_batch_wait_ms
+        self.embedding_backend = embedding_backend
+        self.rerank_factor = rerank_factor
         self.embedding_function = None
         self.vectordb = None
 
-    def load(self):
-        """Tải lại Vector Database đã lưu"""
+    def load_embedding_model(self) -> Embeddings:
+        """
+        Tải embedding model qua cùng EmbeddingGenerator với bước build knowledge base, để vector truy vấn
+        được chuẩn hóa giống hệt vector đã lưu (import trễ vì sentence-transformers/torch nạp rất chậm)
+        """
+        from embedding_generator import EmbeddingGenerator, EmbeddingService
+
+        logger.info(" Đang khởi tạo embedding function...")
+        return EmbeddingService(
+            EmbeddingGenerator(self.embedding_model_name, backend=self.embedding_backend),
+            max_batch_size=self.query_batch_size,
+            max_wait_ms=self.query_batch_wait_ms
+        )
+
+    def load(self, embeddings_future: Optional[Future] = None):
+        """
+        Tải lại Vector Database đã lưu. Nếu truyền `embeddings_future` (model đang được tải song song
+        bằng load_embedding_model ở thread khác) thì không chờ model mà mở vector store ngay.
+        """
         try:
-            logger.info(" Đang khởi tạo embedding function...")
-            self.embedding_function = SentenceTransformerEmbeddings(model_name=self.embedding_model_name)
-
-            logger.info(f" Đang tải lại Vector Database từ đường dẫn: {self.db_directory}")
-            self.vectordb = Chroma(
-                persist_directory=self.db_directory,
-                embedding_function=self.embedding_function,
-                collection_name=self.collection_name
-            )
-
-            logger.info(
-                f" Tải lại Vector Database thành công. Số lượng documents: {self.vectordb._collection.count()}")
+            if embeddings_future is None:
+                embeddings = self.load_embedding_model()
+            else:
+                embeddings = _DeferredEmbeddings(embeddings_future)
+            # Embedding của truy vấn được ghi nhớ để semantic cache, vector search và batch API dùng chung
+            self.embedding_function = QueryEmbeddingCache(embeddings)
+
+            logger.info(f" Đang tải lại Vector Database ({self.backend}) từ đường dẫn: {self.db_directory}")
+            if self.backend == "numpy":
+                from numpy_vector_store import NumpyVectorStore
+                self.vectordb = NumpyVectorStore.load(
+                    db_path=self.db_directory,
+                    collection_name=self.collection_name,
+                    embedding_function=self.embedding_function,
+                    rerank_factor=self.rerank_factor
+                )
+                count = self.vectordb.count()
+            else:
+                from langchain_community.vectorstores import Chroma
+                self.vectordb = Chroma(
+                    persist_directory=self.db_directory,
+                    embedding_function=self.embedding_function,
+                    collection_name=self.collection_name
+                )
+                count = self.vectordb._collection.count()
+
+            logger.info(f" Tải lại Vector Database thành công. Số lượng documents: {count}")
             return self.vectordb
         except Exception as e:
             logger.error(f" Lỗi nghiêm trọng khi tải lại Vector Database: {e}")